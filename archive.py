@@ -0,0 +1,199 @@
+import os
+import gzip
+import json
+import numpy as np
+import pandas as pd
+import helpers
+
+# Past stays of a hotel under data/hotel_*/archive: check-out clears the stay of a
+# client from client_list and appends it here, so client_list only holds clients
+# who are reserved, checked in or between stays.
+#
+# Stays are partitioned by the month they end in, one gzip csv per month
+# (stays-2030-08.csv.gz). Each append adds a gzip member to the end of its partition,
+# so nothing already archived is rewritten. manifest.json keeps the first start and
+# last end of each partition, which lets a query over a date range open only the
+# partitions holding stays overlapping it.
+ARCHIVE_DIR = "archive"
+MANIFEST_FILE = "manifest.json"
+
+STAY_DTYPES = {
+    "client_id": "int64",
+    "room": "int32",
+    "start": "datetime64[ns]",
+    "end": "datetime64[ns]",
+    "payment_due": "float64",
+    "paid": "bool",
+    "checked_out": "datetime64[ns]",
+}
+DATE_COLUMNS = ["start", "end", "checked_out"]
+
+
+def archive_path(full_path, file_name=""):
+    return os.path.join(full_path, ARCHIVE_DIR, file_name)
+
+
+def partition(end):
+    """
+    File name of the partition of stays ending on end.
+    """
+    return f"stays-{end:%Y-%m}.csv.gz"
+
+
+def empty():
+    return pd.DataFrame(
+        {column: pd.Series(dtype=dtype) for column, dtype in STAY_DTYPES.items()}
+    )
+
+
+def read_manifest(full_path):
+    fp = archive_path(full_path, MANIFEST_FILE)
+    if not os.path.isfile(fp):
+        return {}
+
+    with open(fp) as in_file:
+        return json.load(in_file)
+
+
+def write_manifest(full_path, manifest):
+    with helpers.atomic_open(archive_path(full_path, MANIFEST_FILE)) as out_file:
+        json.dump(manifest, out_file, indent=2, sort_keys=True)
+
+
+def stamp(full_path):
+    """
+    Changes whenever stays are archived, for the report cache.
+    """
+    fp = archive_path(full_path, MANIFEST_FILE)
+    if not os.path.isfile(fp):
+        return ()
+
+    stat = os.stat(fp)
+    return ((stat.st_mtime_ns, stat.st_size),)
+
+
+def append(full_path, stays):
+    """
+    Archives stays (pd.DataFrame() with the columns of STAY_DTYPES), each in the partition of its end.
+    """
+    if stays.empty:
+        return
+
+    os.makedirs(archive_path(full_path), exist_ok=True)
+    manifest = read_manifest(full_path)
+    stays = stays[list(STAY_DTYPES)].astype(STAY_DTYPES)
+
+    for file_name, group in stays.groupby(stays["end"].map(partition)):
+        fp = archive_path(full_path, file_name)
+        new_partition = not os.path.isfile(fp)
+        size = 0 if new_partition else os.stat(fp).st_size
+
+        with gzip.open(fp, "at") as out_file:
+            group.to_csv(
+                out_file,
+                header=new_partition,
+                index=False,
+                date_format=helpers.CLIENT_DATE_FORMAT,
+            )
+
+        entry = manifest.get(file_name)
+        if new_partition:
+            first, last = group["start"].min(), group["end"].max()
+        elif entry is not None and entry["size"] == size:
+            first = min(group["start"].min(), pd.Timestamp(entry["start"]))
+            last = max(group["end"].max(), pd.Timestamp(entry["end"]))
+        else:
+            archived = _read_partition(fp)
+            first, last = archived["start"].min(), archived["end"].max()
+        manifest[file_name] = _entry(fp, first, last)
+
+    write_manifest(full_path, manifest)
+
+
+def _entry(fp, first, last):
+    return {
+        "start": first.strftime(helpers.CLIENT_DATE_FORMAT),
+        "end": last.strftime(helpers.CLIENT_DATE_FORMAT),
+        "size": os.stat(fp).st_size,
+    }
+
+
+def _read_partition(fp):
+    stays = pd.read_csv(fp, dtype={"client_id": "int64", "room": "int32"})
+    for column in DATE_COLUMNS:
+        stays[column] = pd.to_datetime(stays[column], format=helpers.CLIENT_DATE_FORMAT)
+
+    return stays.astype(STAY_DTYPES)
+
+
+def partitions(full_path, start=None, end=None):
+    """
+    Partitions which may hold stays overlapping start .. end (either bound may be None).
+
+    Partitions missing from the manifest, or which changed since it was written (an
+    append interrupted before the manifest was updated), are read to bring it up to date.
+    """
+    folder = archive_path(full_path)
+    if not os.path.isdir(folder):
+        return []
+
+    manifest = read_manifest(full_path)
+    file_names = sorted(f for f in os.listdir(folder) if f.endswith(".csv.gz"))
+
+    changed = False
+    for file_name in file_names:
+        fp = archive_path(full_path, file_name)
+        entry = manifest.get(file_name)
+        if entry is None or entry["size"] != os.stat(fp).st_size:
+            stays = _read_partition(fp)
+            manifest[file_name] = _entry(fp, stays["start"].min(), stays["end"].max())
+            changed = True
+
+    if changed:
+        write_manifest(full_path, manifest)
+
+    return [
+        file_name
+        for file_name in file_names
+        if (
+            end is None
+            or pd.Timestamp(manifest[file_name]["start"]) <= pd.Timestamp(end)
+        )
+        and (
+            start is None
+            or pd.Timestamp(manifest[file_name]["end"]) >= pd.Timestamp(start)
+        )
+    ]
+
+
+def read(full_path, start=None, end=None):
+    """
+    Archived stays overlapping start .. end (inclusive, either bound may be None), by end.
+    A stay archived twice (by a checkpoint which was interrupted, see Config.checkpoint())
+    is only returned once.
+
+    Return:
+    pd.DataFrame() with the columns of STAY_DTYPES
+    """
+    frames = [
+        _read_partition(archive_path(full_path, file_name))
+        for file_name in partitions(full_path, start, end)
+    ]
+    if not frames:
+        return empty()
+
+    stays = pd.concat(frames, ignore_index=True).drop_duplicates()
+    return overlapping(stays, start, end)
+
+
+def overlapping(stays, start=None, end=None):
+    keep = np.ones(len(stays), bool)
+    if start is not None:
+        keep &= (stays["end"] >= pd.Timestamp(start)).values
+    if end is not None:
+        keep &= (stays["start"] <= pd.Timestamp(end)).values
+
+    stays = stays[keep]
+    order = np.lexsort((stays["client_id"].values, stays["end"].values))
+
+    return stays.iloc[order].reset_index(drop=True)
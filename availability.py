@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+# Keys pack (room code, start day) into one int64: room code in the high bits,
+# days since epoch shifted to be non-negative in the low bits.
+DAY_BITS = 20
+DAY_OFFSET = 1 << (DAY_BITS - 1)
+
+
+def to_days(dates):
+    """
+    Converts dates (scalar or array-like) to integer days since epoch.
+    """
+    if np.ndim(dates) == 0:
+        return int(np.datetime64(pd.Timestamp(dates), "D").astype(np.int64))
+
+    return np.asarray(pd.DatetimeIndex(dates).values.astype("datetime64[D]"), np.int64)
+
+
+def from_days(days):
+    return pd.DatetimeIndex(np.asarray(days, np.int64).astype("datetime64[D]"))
+
+
+class AvailabilityIndex(object):
+    """
+    Free intervals of a set of rooms (usually all the rooms of one type) as sorted arrays.
+
+    Intervals of a room never overlap, so the only interval of a room that can contain
+    a prospective reservation is the last one starting before it. Intervals are sorted
+    by (room, start), which lets a single searchsorted find that interval for every room
+    at once: a query is O(rooms * log(intervals)) instead of a scan of the whole history.
+    """
+
+    def __init__(self, rooms):
+        self.rooms = [int(room) for room in rooms]
+        self.room_code = {room: code for code, room in enumerate(self.rooms)}
+
+        self.keys = np.empty(0, np.int64)
+        self.codes = np.empty(0, np.int64)
+        self.starts = np.empty(0, np.int64)
+        self.ends = np.empty(0, np.int64)
+
+    @classmethod
+    def from_intervals(cls, intervals):
+        """
+        Builds the index from intervals, a mapping of rooms to pd.Series() (DatetimeIndex start, end as values).
+        A dataframe with rooms as columns works as well.
+        """
+        index = cls(intervals.keys())
+        codes, starts, ends = [], [], []
+
+        for code, room in enumerate(index.rooms):
+            room_intervals = intervals[room].dropna()
+            codes.append(np.full(room_intervals.size, code, np.int64))
+            starts.append(to_days(room_intervals.index))
+            ends.append(to_days(room_intervals.values))
+
+        if not codes:
+            return index
+
+        codes = np.concatenate(codes)
+        starts = np.concatenate(starts)
+        keys = index._key(codes, starts)
+        order = np.argsort(keys, kind="stable")
+
+        index.keys = keys[order]
+        index.codes = codes[order]
+        index.starts = starts[order]
+        index.ends = np.concatenate(ends)[order]
+
+        return index
+
+    def free_nights(self, start, end):
+        """
+        Number of rooms with a free interval covering each night from start to end (inclusive).
+
+        Each free interval clipped to the range adds +1 on its first night and -1 after
+        its last night; a cumulative sum over those events gives the count of every night
+        at once, in O(intervals + nights).
+
+        Return:
+        np.array() of int64, one count per night
+        """
+        first = to_days(start)
+        num_nights = max(to_days(end) - first + 1, 0)
+
+        lo = np.maximum(self.starts, first) - first
+        hi = np.minimum(self.ends, first + num_nights - 1) - first
+        keep = lo <= hi
+
+        events = np.bincount(lo[keep], minlength=num_nights + 1)
+        events -= np.bincount(hi[keep] + 1, minlength=num_nights + 1)
+
+        return np.cumsum(events)[:num_nights]
+
+    def _key(self, code, day):
+        return (code << DAY_BITS) | (day + DAY_OFFSET)
+
+    def query(self, start, end):
+        """
+        Rooms with a free interval strictly containing (start, end).
+
+        Return:
+        pd.DataFrame() with rooms as index, start and end of the free interval as columns
+        """
+        if self.keys.size == 0:
+            return self._frame(np.empty(0, np.int64))
+
+        codes = np.arange(len(self.rooms), dtype=np.int64)
+        pos = np.searchsorted(self.keys, self._key(codes, to_days(start))) - 1
+
+        found = pos >= 0
+        pos = np.where(found, pos, 0)
+        found &= self.codes[pos] == codes
+        found &= self.ends[pos] > to_days(end)
+
+        return self._frame(pos[found])
+
+    def _frame(self, pos):
+        return pd.DataFrame(
+            {"start": from_days(self.starts[pos]), "end": from_days(self.ends[pos])},
+            index=pd.Index([self.rooms[code] for code in self.codes[pos]], name="room"),
+        )
+
+    def set(self, room_number, start, end):
+        """
+        Adds the free interval (start, end) to a room, replacing an interval with the same start.
+        """
+        code = self.room_code.get(int(room_number))
+        if code is None:
+            return
+
+        start_day = to_days(start)
+        key = self._key(code, start_day)
+        i = np.searchsorted(self.keys, key)
+
+        if i < self.keys.size and self.keys[i] == key:
+            self.ends[i] = to_days(end)
+        else:
+            self.keys = np.insert(self.keys, i, key)
+            self.codes = np.insert(self.codes, i, code)
+            self.starts = np.insert(self.starts, i, start_day)
+            self.ends = np.insert(self.ends, i, to_days(end))
+
+    def remove(self, room_number, start):
+        """
+        Removes the free interval of a room starting at start.
+        """
+        code = self.room_code.get(int(room_number))
+        if code is None:
+            return
+
+        key = self._key(code, to_days(start))
+        i = np.searchsorted(self.keys, key)
+
+        if i < self.keys.size and self.keys[i] == key:
+            self.keys = np.delete(self.keys, i)
+            self.codes = np.delete(self.codes, i)
+            self.starts = np.delete(self.starts, i)
+            self.ends = np.delete(self.ends, i)
@@ -0,0 +1,446 @@
+import os
+import io
+import json
+import time
+import shutil
+import platform
+import tempfile
+import contextlib
+import subprocess
+import statistics
+from datetime import datetime
+import click
+import numpy as np
+import pandas as pd
+import hotel
+import storage
+import archive
+from availability import to_days, from_days
+
+# Rooms, room types and years of booking history of each scale
+SCALES = {
+    "small": {"num_rooms": 50, "num_types": 3, "years": 1},
+    "medium": {"num_rooms": 500, "num_types": 10, "years": 2},
+    "large": {"num_rooms": 2000, "num_types": 20, "years": 3},
+}
+
+BENCHMARKS = [
+    "load",
+    "register",
+    "reserve-dates",
+    "delete-reservation",
+    "clear-cache",
+    "get-one-client",
+    "get-some-clients",
+    "get-all-clients",
+    "get-client-id",
+]
+
+# Free interval of a room which has no reservation after it (see helpers.room_intervals())
+LAST_DAY = to_days(pd.Timestamp.max.date())
+
+
+def room_stays(rng, first_day, last_day, fragmentation):
+    """
+    Random (start, end) days of the stays of one room, sorted and at least one free day apart.
+
+    fragmentation is the share of days taken by stays (0 < fragmentation < 1): stays last 1 to 7
+    nights, and the higher it is the shorter the free intervals left between them.
+    """
+    fragmentation = min(max(fragmentation, 0.01), 0.95)
+    mean_gap = max(5 * (1 - fragmentation) / fragmentation, 1)
+    num_stays = int((last_day - first_day) / (5 + mean_gap) * 1.5) + 10
+
+    nights = rng.integers(1, 8, num_stays)
+    gaps = rng.geometric(1 / mean_gap, num_stays)
+    starts = (
+        first_day + np.cumsum(gaps) + np.concatenate([[0], np.cumsum(nights + 1)[:-1]])
+    )
+    ends = starts + nights
+    keep = ends < last_day
+
+    return starts[keep], ends[keep]
+
+
+def _dates(days):
+    return np.datetime_as_string(np.asarray(days).astype("datetime64[D]"))
+
+
+def generate_hotel(
+    hotel_dir,
+    num_rooms=100,
+    num_types=4,
+    years=1,
+    fragmentation=0.5,
+    seed=0,
+    today=None,
+):
+    """
+    Writes a synthetic hotel in the layout of hotel initialize.
+
+    Arguments:
+    hotel_dir is the directory to create (data/hotel_* for use with a session, any path with hotel --hotel)
+    num_rooms, num_types and years are type INT; room n has type (n - 1) % num_types + 1
+    fragmentation is type FLOAT, see room_stays()
+    seed is type INT; the same arguments always give the same hotel
+    today is type date (default: today); stays run from years before it until a year after it
+
+    Return:
+    The number of clients, one per stay
+
+    Description:
+    Stays which ended before today are checked out (state 3) and archived, stays covering today
+    are checked in (state 1) and later ones are reserved (state 2). Check-out does not rejoin
+    intervals, so the history leaves expired intervals in the room files for clear-cache.
+    """
+    rng = np.random.default_rng(seed)
+    today = to_days(today or datetime.now().date())
+    first_day = today - 365 * years
+    last_day = today + 365
+
+    rooms = [
+        {
+            "number": n,
+            "type": (n - 1) % num_types + 1,
+            "cost": 50 * ((n - 1) % num_types + 1),
+        }
+        for n in range(1, num_rooms + 1)
+    ]
+    os.makedirs(os.path.join(hotel_dir, "rooms", "reservations"))
+    os.makedirs(os.path.join(hotel_dir, "rooms", "intervals"))
+    with open(os.path.join(hotel_dir, "hotel.json"), "w") as out_file:
+        json.dump({"hotel_name": "Bench", "rooms": rooms}, out_file, indent=2)
+
+    stays = []
+    for room in rooms:
+        starts, ends = room_stays(rng, first_day, last_day, fragmentation)
+        stays.append(
+            pd.DataFrame(
+                {"room": room["number"], "cost": room["cost"], "s": starts, "e": ends}
+            )
+        )
+    stays = pd.concat(stays).sort_values(["s", "room"], kind="stable")
+    stays.index = pd.RangeIndex(len(stays), name="client_id")
+
+    past = stays["e"] < today
+    future = stays["s"] > today
+    current = ~past & ~future
+
+    client_list = pd.DataFrame(
+        {
+            "state": np.select([past, current], [3, 1], 2),
+            "start": np.where(past, "", _dates(stays["s"])),
+            "end": np.where(past, "", _dates(stays["e"])),
+            "reserved_room": np.where(past, -1, stays["room"]),
+            "payment_due": np.where(
+                past, np.nan, (stays["e"] - stays["s"]) * stays["cost"]
+            ),
+            "paid": past.values,
+            "curr_room": np.where(current, stays["room"], -1),
+        },
+        index=stays.index,
+    )
+    client_list.to_csv(os.path.join(hotel_dir, "client_list.csv"))
+
+    # Checked out on their last day, paid
+    past_stays = stays[past]
+    archive.append(
+        hotel_dir,
+        pd.DataFrame(
+            {
+                "client_id": past_stays.index,
+                "room": past_stays["room"].values,
+                "start": from_days(past_stays["s"]),
+                "end": from_days(past_stays["e"]),
+                "payment_due": (past_stays["e"] - past_stays["s"]).values
+                * past_stays["cost"].values,
+                "paid": True,
+                "checked_out": from_days(past_stays["e"]),
+            }
+        ),
+    )
+
+    client_supp = pd.DataFrame(
+        {
+            "name": [f"guest{i}" for i in stays.index],
+            "email": [f"guest{i}@example.com" for i in stays.index],
+        },
+        index=stays.index,
+    )
+    client_supp.to_csv(os.path.join(hotel_dir, "client_supp.csv"))
+
+    for number, group in stays.groupby("room"):
+        reserved = group[future[group.index]]
+        lines = [
+            f"{start},{client_id}"
+            for start, client_id in zip(_dates(reserved["s"]), reserved.index)
+        ]
+        _write_lines(hotel_dir, "reservations", number, "start,client_id", lines)
+
+        starts = np.concatenate([[first_day], group["e"].values + 1])
+        ends = np.concatenate([group["s"].values - 1, [LAST_DAY]])
+        lines = [f"{start},{end}" for start, end in zip(_dates(starts), _dates(ends))]
+        _write_lines(hotel_dir, "intervals", number, "start,end", lines)
+
+    # Rooms without any stay are free from the first day on
+    for room in rooms:
+        fp = os.path.join(hotel_dir, "rooms", "intervals", f"{room['number']}.csv")
+        if not os.path.isfile(fp):
+            _write_lines(
+                hotel_dir, "reservations", room["number"], "start,client_id", []
+            )
+            _write_lines(
+                hotel_dir,
+                "intervals",
+                room["number"],
+                "start,end",
+                [f"{_dates(first_day)},{_dates(LAST_DAY)}"],
+            )
+
+    return len(stays)
+
+
+def _write_lines(hotel_dir, table, room_number, header, lines):
+    with open(
+        os.path.join(hotel_dir, "rooms", table, f"{room_number}.csv"), "w"
+    ) as out_file:
+        out_file.write("\n".join([header] + lines) + "\n")
+
+
+def run_command(hotel_dir, args, expect=None):
+    """
+    Runs a hotel command in this process on hotel_dir and returns how long it took.
+    Each run starts from a new Config, as a command line call would.
+
+    Commands report most failures (no room available, unknown client, ...) by printing
+    a message, so a command which changes the hotel is given the message it prints on
+    success (expect). A command which aborts, exits with an error or does not print
+    expect fails the benchmark rather than recording a timing of something else.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        start = time.perf_counter()
+        try:
+            result = hotel.cli.main(
+                ["--hotel", hotel_dir] + args, prog_name="hotel", standalone_mode=False
+            )
+        except click.Abort:
+            result = 1
+        elapsed = time.perf_counter() - start
+
+    exit_code = result if isinstance(result, int) else 0
+    if exit_code != 0 or (expect is not None and expect not in output.getvalue()):
+        raise click.ClickException(
+            f"hotel {' '.join(args)} failed on {hotel_dir}:\n{output.getvalue()}"
+        )
+
+    return elapsed
+
+
+def time_load(hotel_dir):
+    start = time.perf_counter()
+    hotel.Config(hotel_dir).load()
+
+    return time.perf_counter() - start
+
+
+def run_benchmarks(hotel_dir, num_clients, repeat, benchmarks=BENCHMARKS):
+    """
+    Times each benchmark repeat times on the hotel of hotel_dir.
+
+    Return:
+    dict of benchmark -> list of seconds
+
+    Description:
+    Commands which change the hotel are run so that it ends up as it started: the clients
+    registered are reserved then deleted again, and clear-cache runs on a fresh copy each time.
+    Reservations are made two years ahead, after the generated stays, so they always succeed.
+    """
+    timings = {}
+    new_ids = list(range(num_clients, num_clients + repeat))
+    today = datetime.now().date()
+
+    for benchmark in benchmarks:
+        runs = []
+        for i in range(repeat):
+            if benchmark == "load":
+                runs.append(time_load(hotel_dir))
+            elif benchmark == "register":
+                args = [f"bench{i}", f"bench{i}@example.com"]
+                runs.append(
+                    run_command(
+                        hotel_dir, ["register"] + args, "Registration successful!"
+                    )
+                )
+            elif benchmark == "reserve-dates":
+                start = pd.Timestamp(today) + pd.Timedelta(days=730 + 10 * i)
+                end = start + pd.Timedelta(days=3)
+                args = [str(new_ids[i]), "1", f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}"]
+                runs.append(
+                    run_command(
+                        hotel_dir, ["reserve-dates"] + args, "Reservation successful!"
+                    )
+                )
+            elif benchmark == "delete-reservation":
+                runs.append(
+                    run_command(
+                        hotel_dir,
+                        ["delete-reservation", str(new_ids[i])],
+                        "The reservation has been deleted.",
+                    )
+                )
+            elif benchmark == "clear-cache":
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    copy_dir = os.path.join(tmp_dir, "hotel")
+                    shutil.copytree(hotel_dir, copy_dir)
+                    runs.append(run_command(copy_dir, ["clear-cache"], "Removed "))
+            elif benchmark == "get-one-client":
+                runs.append(run_command(hotel_dir, ["get-one-client", str(i)]))
+            elif benchmark == "get-some-clients":
+                runs.append(run_command(hotel_dir, ["get-some-clients", "2"]))
+            elif benchmark == "get-all-clients":
+                runs.append(run_command(hotel_dir, ["get-all-clients"]))
+            elif benchmark == "get-client-id":
+                runs.append(
+                    run_command(
+                        hotel_dir,
+                        ["get-client-id", f"guest{i}", f"guest{i}@example.com"],
+                        f"The client ID for guest{i} is",
+                    )
+                )
+        timings[benchmark] = runs
+
+    return timings
+
+
+def summary(runs):
+    return {
+        "repeat": len(runs),
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs),
+        "max": max(runs),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.group()
+def bench():
+    """
+    Benchmarks of the hotel commands on synthetic hotels.
+    """
+
+
+@bench.command()
+@click.argument("hotel_dir", type=click.Path(exists=False))
+@click.option("--rooms", "num_rooms", type=click.INT, default=100, show_default=True)
+@click.option("--types", "num_types", type=click.INT, default=4, show_default=True)
+@click.option("--years", type=click.INT, default=1, show_default=True)
+@click.option(
+    "--fragmentation",
+    type=click.FLOAT,
+    default=0.5,
+    show_default=True,
+    help="Share of days taken by stays; higher leaves more, shorter free intervals.",
+)
+@click.option("--seed", type=click.INT, default=0, show_default=True)
+def generate(hotel_dir, num_rooms, num_types, years, fragmentation, seed):
+    """
+    Write a synthetic hotel to HOTEL_DIR (use it with hotel --hotel HOTEL_DIR).
+    """
+    num_clients = generate_hotel(
+        hotel_dir, num_rooms, num_types, years, fragmentation, seed
+    )
+    click.echo(f"Generated {num_rooms} rooms and {num_clients} clients in {hotel_dir}")
+
+
+@bench.command()
+@click.option(
+    "--scale",
+    "scales",
+    type=click.Choice(list(SCALES)),
+    multiple=True,
+    help="Scale to run (repeatable, default: small and medium).",
+)
+@click.option(
+    "--benchmark",
+    "benchmarks",
+    type=click.Choice(BENCHMARKS),
+    multiple=True,
+    help="Benchmark to run (repeatable, default: all).",
+)
+@click.option(
+    "--storage",
+    "backend",
+    type=click.Choice(["csv", "sqlite"]),
+    default="csv",
+    show_default=True,
+)
+@click.option("--repeat", type=click.INT, default=5, show_default=True)
+@click.option("--fragmentation", type=click.FLOAT, default=0.5, show_default=True)
+@click.option("--seed", type=click.INT, default=0, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    default="bench_results.json",
+    show_default=True,
+)
+def run(scales, benchmarks, backend, repeat, fragmentation, seed, output):
+    """
+    Time the hotel commands at several scales and write the results as JSON.
+    """
+    scales = scales or ("small", "medium")
+    benchmarks = benchmarks or BENCHMARKS
+    results = []
+
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            hotel_dir = os.path.join(tmp_dir, "hotel_bench")
+            num_clients = generate_hotel(
+                hotel_dir, fragmentation=fragmentation, seed=seed, **SCALES[scale]
+            )
+            if backend == "sqlite":
+                storage.migrate("", hotel_dir)
+
+            timings = run_benchmarks(hotel_dir, num_clients, repeat, benchmarks)
+
+        for benchmark, runs in timings.items():
+            result = dict(
+                scale=scale, clients=num_clients, benchmark=benchmark, **SCALES[scale]
+            )
+            result.update(summary(runs))
+            results.append(result)
+            click.echo(
+                f"{scale:8} {benchmark:20} median {result['median'] * 1000:9.1f} ms  min {result['min'] * 1000:9.1f} ms"
+            )
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "storage": backend,
+        "fragmentation": fragmentation,
+        "seed": seed,
+        "results": results,
+    }
+    with open(output, "w") as out_file:
+        json.dump(report, out_file, indent=2)
+    click.echo(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+class RoomCatalog(object):
+    """
+    Room metadata of hotel.json, indexed once per hotel.
+
+    Rooms are keyed by their number as an int everywhere: the room files, the
+    reservations and intervals of a Config and client_list.reserved_room all use
+    the same keys, so no lookup has to convert between str and int.
+    """
+
+    def __init__(self, rooms):
+        """
+        rooms is the "rooms" list of hotel.json (dicts with number, type and cost)
+        """
+        self.numbers = np.array([int(room["number"]) for room in rooms], np.int64)
+        self.room_types = np.array([int(room["type"]) for room in rooms], np.int64)
+        self.costs = np.array([room["cost"] for room in rooms])
+
+        numbers = self.numbers.tolist()
+        self.type_of = dict(zip(numbers, self.room_types.tolist()))
+        self.cost_of = dict(zip(numbers, self.costs.tolist()))
+
+        # Rooms of each type keep the order of hotel.json
+        self.types = sorted(set(self.type_of.values()))
+        self.rooms_of_type = {
+            room_type: self.numbers[self.room_types == room_type].tolist()
+            for room_type in self.types
+        }
+
+    @classmethod
+    def from_hotel(cls, hotel):
+        return cls(hotel["rooms"])
+
+    def rooms(self, room_type):
+        """
+        Room numbers of room_type, empty if the hotel has no such type.
+        """
+        return self.rooms_of_type.get(int(room_type), [])
+
+    def cost(self, room_number):
+        return self.cost_of[int(room_number)]
+
+    def type_codes(self, room_numbers):
+        """
+        Position of the type of each room in self.types, -1 for unknown rooms.
+
+        Arguments:
+        room_numbers is array-like of room numbers
+
+        Return:
+        np.array() of int64
+        """
+        numbers = np.asarray(room_numbers, np.int64)
+        if self.numbers.size == 0:
+            return np.full(numbers.size, -1, np.int64)
+
+        order = np.argsort(self.numbers)
+        pos = np.searchsorted(self.numbers, numbers, sorter=order)
+        pos = order[np.minimum(pos, self.numbers.size - 1)]
+        codes = np.searchsorted(self.types, self.room_types[pos])
+
+        return np.where(self.numbers[pos] == numbers, codes, -1)
@@ -2,12 +2,31 @@ from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 import os
+import contextlib
 import click
 import json
-import jsonschema
+from availability import AvailabilityIndex, to_days, from_days
+import packing
+
+# Column dtypes of client_list, enforced whenever it is read or written.
+# Rooms keep -1 for "no room"; the nullable Int32 keeps them integers even if a
+# value goes missing, instead of turning the whole column into floats.
+CLIENT_LIST_DTYPES = {
+    "state": "int8",
+    "start": "datetime64[ns]",
+    "end": "datetime64[ns]",
+    "reserved_room": "Int32",
+    "payment_due": "float64",
+    "paid": "bool",
+    "curr_room": "Int32",
+}
+CLIENT_DATE_FORMAT = "%Y-%m-%d"
 
 
 def validate_json(hotel_json):
+    # Only initialize validates JSON, other commands should not pay for importing jsonschema
+    import jsonschema
+
     schema = {
         "type": "object",
         "properties": {
@@ -46,137 +65,208 @@ def validate_json(hotel_json):
         return False
 
 
-def handle_session():
-    if not os.path.exists("session.csv"):
-        click.echo("No current session.")
-        raise click.Abort()
+def build_client_index(client_supp):
+    """
+    Maps (name, email) to client_id for every client in client_supp.
+    """
+    keys = zip(client_supp["name"], client_supp["email"])
 
+    return dict(zip(keys, client_supp.index.tolist()))
 
-def create_temp(hotel_name):
-    hotel_dir = "data/hotel_" + hotel_name + "\n"
-    with open("session.csv", "w") as out_file:
-        out_file.write(hotel_dir)
 
+def unique_client(client_index, name, email):
+    """
+    Returns the client ID registered with name and email, None if there is none.
+    """
+    return client_index.get((name, email))
 
-def get_hotel_path():
-    with open("session.csv", "r") as fp:
-        line = fp.readline().rstrip()
 
-    return line
+def get_reservations(r_path, rooms=None):
+    if rooms is None:
+        num_files = os.listdir(r_path)
+    else:
+        num_files = [str(room) + ".csv" for room in rooms]
+    reservations = {}
 
+    for file in num_files:
+        room = int(os.path.splitext(file)[0])
 
-def unique_client(client_supp, name, email):
-    df = client_supp.reset_index()
+        real_file = os.path.join(r_path, file)
+        df = pd.read_csv(real_file)
 
-    def find_id(x):
-        if x["name"] == name and x["email"] == email:
-            return x["client_id"]
+        reservations[room] = room_reservations(df, room)
 
-    id_list = df.apply(find_id, axis=1).dropna()
+    return reservations
 
-    return id_list
+
+def room_reservations(df, room):
+    """
+    Turns the (start, client_id) rows of a single room into a sorted pd.Series().
+    """
+    datetime_series = pd.to_datetime(df["start"])
+    datetime_index = pd.DatetimeIndex(datetime_series.values)
+
+    series = pd.Series(df["client_id"].values, index=datetime_index, name=room)
+
+    return series.sort_index()
 
 
-def get_reservations(r_path):
-    num_files = os.listdir(r_path)
-    reservations = pd.DataFrame()
+def get_intervals(i_path, rooms=None):
+    if rooms is None:
+        num_files = os.listdir(i_path)
+    else:
+        num_files = [str(room) + ".csv" for room in rooms]
+    intervals = {}
 
     for file in num_files:
-        room = os.path.splitext(file)[0]
+        room = int(os.path.splitext(file)[0])
+
+        real_file = os.path.join(i_path, file)
 
-        real_file = os.path.join(r_path, file)
         df = pd.read_csv(real_file)
 
-        datetime_series = pd.to_datetime(df["start"])
-        datetime_index = pd.DatetimeIndex(datetime_series.values)
+        intervals[room] = room_intervals(df, room)
 
-        df = df.set_index(datetime_index)
-        df.drop("start", axis=1, inplace=True)
-        df = df.rename(columns={"client_id": room})
-        reservations = pd.concat([reservations, df], axis=1, sort=False)
+    return intervals
 
-    return reservations
 
+def room_intervals(df, room):
+    """
+    Turns the (start, end) rows of a single room into a sorted pd.Series().
+    A room without any interval has never been reserved and is free from today onwards.
+    """
+    inf_intv = df.empty or df.isnull().values.any()
 
-def get_intervals(i_path):
-    num_files = os.listdir(i_path)
-    intervals = pd.DataFrame()
+    if inf_intv:
+        df = pd.DataFrame(
+            {"start": [datetime.now().date()], "end": [pd.Timestamp.max.date()]}
+        )
 
-    for file in num_files:
-        room = os.path.splitext(file)[0]
+    datetime_series = pd.to_datetime(df["start"])
+    datetime_index = pd.DatetimeIndex(datetime_series.values)
 
-        real_file = os.path.join(i_path, file)
+    ends = pd.to_datetime(df["end"]).values
+    series = pd.Series(ends, index=datetime_index, name=room)
 
-        df = pd.read_csv(real_file)
-        inf_intv = df.isnull().values.any()
+    return series.sort_index()
 
-        if inf_intv:
-            df["start"] = datetime.now().date()
-            df["end"] = pd.Timestamp.max.date()
 
-        datetime_series = pd.to_datetime(df["start"])
-        datetime_index = pd.DatetimeIndex(datetime_series.values)
+def new_client_supp(client_id, name, contact_info, client_index=None):
+    """
+    One row client_supp holding a newly registered client.
+    """
+    if client_index is not None:
+        client_index[(name, contact_info)] = client_id
 
-        df["end"] = pd.to_datetime(df["end"])
-        df = df.set_index(datetime_index)
-        df.drop("start", axis=1, inplace=True)
-        df = df.rename(columns={"end": room})
-        intervals = pd.concat([intervals, df], axis=1, sort=False)
+    return pd.DataFrame(
+        {"name": [name], "email": [contact_info]},
+        index=pd.Index([client_id], name="client_id"),
+    )
 
-    return intervals
 
+def typed_client_list(client_list):
+    """
+    client_list with the columns and dtypes of CLIENT_LIST_DTYPES.
+
+    Arguments:
+    client_list is type pd.Dataframe(); dates may be strings of format %Y-%m-%d,
+        missing dates NaN or empty strings
+
+    Return:
+    client_list itself if it already has the right dtypes, a typed copy otherwise
+    """
+    dtypes = pd.Series(CLIENT_LIST_DTYPES)
+    if (
+        list(client_list.columns) == list(dtypes.index)
+        and (client_list.dtypes.astype(str) == dtypes).all()
+    ):
+        return client_list
 
-def add_client_supp(client_supp, name, contact_info):
-    temp_supp = pd.DataFrame({"name": [name], "email": [contact_info]})
+    client_list = client_list[list(CLIENT_LIST_DTYPES)].copy()
+    for column in ["start", "end"]:
+        if client_list[column].dtype == object:
+            dates = client_list[column].replace("", np.nan)
+            client_list[column] = pd.to_datetime(dates, format=CLIENT_DATE_FORMAT)
 
-    return client_supp.append(temp_supp, ignore_index=True)
+    return client_list.astype(CLIENT_LIST_DTYPES)
 
 
-def add_client_list(
-    client_list, state, start, end, res_room, payment_due, paid, curr_room
+def new_client_list(
+    client_id, state, start, end, res_room, payment_due, paid, curr_room
 ):
-    temp_info = pd.DataFrame(
+    """
+    One row client_list holding a newly registered client.
+    """
+    client_list = pd.DataFrame(
         {
             "state": [state],
-            "start": [start],
-            "end": [end],
+            "start": [np.nan if start is None else start],
+            "end": [np.nan if end is None else end],
             "reserved_room": [res_room],
-            "payment_due": [payment_due],
+            "payment_due": [np.nan if payment_due is None else payment_due],
             "paid": [paid],
             "curr_room": [curr_room],
-        }
+        },
+        index=pd.Index([client_id], name="client_id"),
     )
 
-    return client_list.append(temp_info, ignore_index=True)
+    return typed_client_list(client_list)
+
+
+def add_client_supp(client_supp, new_supp):
+    return pd.concat([client_supp, new_supp])
+
+
+def add_client_list(client_list, new_list):
+    return pd.concat([client_list, new_list])
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w"):
+    """
+    Writes to a temporary file next to path which replaces path once it is complete,
+    so readers only ever see the old or the new file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        with open(tmp_path, mode) as file:
+            yield file
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def overwrite_client_supp(client_supp, full_path):
     client_supp = client_supp.rename_axis("client_id").reset_index()
-    client_supp.to_csv(os.path.join(full_path, "client_supp.csv"), index=False)
+    with atomic_open(os.path.join(full_path, "client_supp.csv")) as file:
+        client_supp.to_csv(file, index=False)
 
 
 def overwrite_client_list(client_list, full_path):
-    client_list = client_list.rename_axis("client_id").reset_index()
-    client_list.to_csv(os.path.join(full_path, "client_list.csv"), index=False)
+    client_list = typed_client_list(client_list).rename_axis("client_id").reset_index()
+    with atomic_open(os.path.join(full_path, "client_list.csv")) as file:
+        client_list.to_csv(file, index=False, date_format=CLIENT_DATE_FORMAT)
+
 
+def get_room_of_type(catalog, room_type):
+    return catalog.rooms(room_type)
 
-def get_room_of_type(hotel, room_type):
-    room_list = []
-    for room in hotel["rooms"]:
-        if room["type"] == room_type:
-            room_list.append(str(room["number"]))
 
-    return room_list
+def get_room_types(catalog):
+    return catalog.types
 
 
-def get_room_number_optimized(intervals, start, end):
+def get_room_number_optimized(intervals, start, end, index=None):
     """
     Finds the best available rooms given a prospective start & end date.
 
     Arguments:
-    intervals is type pd.Dataframe(); DatetimeIndex (start), rooms as columns, Datetime (end) as values
+    intervals maps rooms to pd.Series(); DatetimeIndex (start), Datetime (end) as values
     start is type Datetime
     end is type Datetime
+    index is type AvailabilityIndex of the intervals (optional, built from intervals if None)
 
     Return:
     An ordered list of available rooms
@@ -185,18 +275,10 @@ def get_room_number_optimized(intervals, start, end):
     Intervals contain all the availibility periods of each room, (start, end) represent a prospective new reservation.
     This function checks each availibility period to determine the interval that is minimally disrupted (see get_smallest_left())
     """
-    mask = intervals.index <= start
-    df = intervals[mask].stack().swaplevel(0, 1).reset_index()
-    df.columns = ["room", "start", "end"]
+    if index is None:
+        index = AvailabilityIndex.from_intervals(intervals)
 
-    def filter(x):
-        if x["start"].date() < start.date() and end.date() < x["end"].date():
-            return x
-        else:
-            return pd.Series(data=[None, None, None], index=x.index)
-
-    df = df.apply(filter, axis=1).dropna()
-    overlap = df.set_index("room")
+    overlap = index.query(start, end)
     room_order = get_smallest_left(overlap, start, end)
 
     return room_order.astype({"order": "int64"})
@@ -217,49 +299,170 @@ def get_smallest_left(overlap, start, end):
     Description:
     Overlap represent the single availibility periods of each room which overlaps with the prospective new reservation (start, end).
     Disruption is the number of days leftover from the overlap after inserting the prospective reservation
-    This function calculates for each overlap the amount of disruption.    
+    This function calculates for each overlap the amount of disruption.
+    Rooms with the same disruption are ordered by room number.
+    """
+    left = np.datetime64(start.date()) - overlap["start"].values.astype("datetime64[D]")
+    right = overlap["end"].values.astype("datetime64[D]") - np.datetime64(end.date())
+    order = np.minimum(left, right).astype(np.int64)
+
+    # Ties are broken by room number so the ranking never depends on the input order
+    rooms = overlap.index
+    ranking = np.lexsort((pd.to_numeric(rooms).values, order))
+
+    return pd.DataFrame({"room": rooms[ranking], "order": order[ranking]})
+
+
+def prune_intervals(intervals, curr_date, rooms=None, threshold=0, dirty=None):
     """
-    smallest_remaining = pd.DataFrame(
-        {"room": overlap.index, "order": ([None] * overlap.index.size)}
+    Removes expired intervals (intv_end < curr_date) in place.
+
+    Arguments:
+    intervals maps rooms to pd.Series(); DatetimeIndex (start), Datetime (end) as values
+    curr_date is type date
+    rooms is a list of rooms to prune (all rooms if None)
+    threshold is type INT; rooms with threshold expired intervals or less are left as they are
+    dirty is type set; pruned rooms are added to it (optional)
+
+    Return:
+    pd.Series() with the number of intervals removed, indexed by the rooms which were pruned
+    """
+    if rooms is None:
+        rooms = list(intervals.keys())
+
+    removed = {}
+    for room in rooms:
+        room = int(room)
+        ends = pd.to_datetime(intervals[room])
+        expired = ends < pd.Timestamp(curr_date)
+
+        if expired.sum() > threshold:
+            intervals[room] = ends[~expired].dropna()
+            removed[room] = int(expired.sum())
+
+    if dirty is not None:
+        dirty.update(removed)
+
+    return pd.Series(removed, dtype=np.int64)
+
+
+def free_runs(intervals, rooms, curr_date):
+    """
+    Lengths in days of the free intervals of the rooms from curr_date on, longest first.
+    """
+    curr_day = to_days(curr_date)
+    runs = []
+
+    for room in rooms:
+        room_intervals = intervals[room].dropna()
+        starts = np.maximum(to_days(room_intervals.index), curr_day)
+        ends = to_days(room_intervals.values)
+        runs.extend((ends - starts + 1)[ends >= curr_day].tolist())
+
+    return sorted(runs, reverse=True)
+
+
+def better_packed(new_runs, old_runs):
+    """
+    True if new_runs (see free_runs()) has fewer free intervals than old_runs,
+    or as many and longer ones, compared longest first.
+    """
+    return (len(new_runs), [-run for run in new_runs]) < (
+        len(old_runs),
+        [-run for run in old_runs],
     )
-    smallest_remaining.set_index("room", inplace=True)
 
-    for index, row in overlap.iterrows():
 
-        left = start.date() - row["start"].date()
-        right = row["end"].date() - end.date()
-        if left.days < right.days:
-            smallest_remaining.loc[index, "order"] = int(left.days)
-        else:
-            smallest_remaining.loc[index, "order"] = int(right.days)
+def repack_rooms(intervals, rooms, bookings):
+    """
+    Re-assigns reservations to the rooms of one type.
+
+    Arguments:
+    intervals maps rooms to pd.Series(); DatetimeIndex (start), Datetime (end) as values
+    rooms is the list of rooms the reservations may be moved between
+    bookings is type pd.Dataframe(); start and end (Datetime) and room columns.
+        room is the room a reservation currently holds, -1 for a new reservation
+
+    Return:
+    (assigned, new_intervals); pd.Series() with the room of each booking (bookings index)
+    and the intervals of each room once they are all placed. None if they do not all fit.
+
+    Description:
+    The reservations which hold a room are released first: each is merged back with the free
+    intervals around it, which gives the free segments of the rooms without them. Reservations
+    not in bookings (checked in, or kept where they are) stay as they are. packing.assign()
+    then places every booking again in a single sweep by start date.
+    """
+    room_code = {room: code for code, room in enumerate(rooms)}
+    codes, starts, ends = [], [], []
+
+    for code, room in enumerate(rooms):
+        room_intervals = intervals[room].dropna()
+        codes.append(np.full(room_intervals.size, code, np.int64))
+        starts.append(to_days(room_intervals.index))
+        ends.append(to_days(room_intervals.values))
+
+    booking_starts = to_days(bookings["start"])
+    booking_ends = to_days(bookings["end"])
+    held = bookings["room"].isin(rooms).values
+    codes.append(bookings["room"][held].map(room_code).values.astype(np.int64))
+    starts.append(booking_starts[held])
+    ends.append(booking_ends[held])
+
+    codes = np.concatenate(codes)
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    order = np.lexsort((starts, codes))
+    segments = packing.merge_segments(codes[order], starts[order], ends[order])
+
+    assigned = packing.assign(*segments, len(rooms), booking_starts, booking_ends)
+    if assigned is None:
+        return None
+
+    piece_codes, piece_starts, piece_ends = packing.split_segments(
+        *segments, assigned, booking_starts, booking_ends
+    )
+    new_intervals = {}
+    for code, room in enumerate(rooms):
+        found = piece_codes == code
+        new_intervals[room] = pd.Series(
+            from_days(piece_ends[found]).values,
+            index=from_days(piece_starts[found]),
+            name=room,
+        )
+
+    room_numbers = np.array(rooms, np.int64)
 
-    return smallest_remaining.reset_index().sort_values(by=["order"])
+    return pd.Series(room_numbers[assigned], index=bookings.index), new_intervals
 
 
-def get_payment(hotel, best_room):
-    for room in hotel["rooms"]:
-        if room["number"] == int(best_room):
+def get_payment(catalog, best_room):
+    return catalog.cost(best_room)
 
-            return room["cost"]
 
+def add_reservations(reservations, room_number, client_id, start, dirty=None):
+    room_reservations = reservations[int(room_number)]
+    room_reservations.loc[start] = client_id
+    reservations[int(room_number)] = room_reservations.sort_index()
 
-def add_reservations(reservations, room_number, client_id, start):
-    reservations.loc[start, str(room_number)] = client_id
-    reservations.sort_index(inplace=True)
+    if dirty is not None:
+        dirty.add(int(room_number))
 
 
-def add_intervals(intervals, room_number, start, end, hotel_path):
+def add_intervals(
+    intervals, room_number, start, end, hotel_path, index=None, dirty=None
+):
     old_intv = get_old_interval(intervals, room_number, start, end)
     new_intv = split_interval(old_intv, start, end)
-    update_intervals(intervals, new_intv, room_number)
+    update_intervals(intervals, new_intv, room_number, index, dirty)
 
 
 def get_old_interval(intervals, room_number, start, end):
-    df = intervals[str(room_number)].dropna()
+    df = intervals[int(room_number)].dropna()
     mask = df.index <= start
     df = df.loc[mask]
     for index, value in df.items():
-        if index.date() < start.date() and end.date() < value:
+        if index.date() < start.date() and end.date() < value.date():
 
             return (index.date(), value.date())
 
@@ -280,93 +483,332 @@ def split_interval(old_intv, start, end):
     return df.drop("start", axis=1)
 
 
-def update_intervals(intervals, new_intervals, room_number):
+def update_intervals(intervals, new_intervals, room_number, index=None, dirty=None):
     old_start = new_intervals.index[0]
     new_start = new_intervals.index[1]
 
-    intervals.loc[old_start, str(room_number)] = new_intervals.loc[old_start, "end"]
-    intervals.loc[new_start, str(room_number)] = new_intervals.loc[new_start, "end"]
+    room_intervals = intervals[int(room_number)]
+    room_intervals.loc[old_start] = new_intervals.loc[old_start, "end"]
+    room_intervals.loc[new_start] = new_intervals.loc[new_start, "end"]
+    intervals[int(room_number)] = room_intervals.sort_index()
 
-    intervals.sort_index(inplace=True)
+    if index is not None:
+        index.set(room_number, old_start, new_intervals.loc[old_start, "end"])
+        index.set(room_number, new_start, new_intervals.loc[new_start, "end"])
+
+    if dirty is not None:
+        dirty.add(int(room_number))
 
 
 def add_reservation_client_list(
-    client_list, client_id, state, start, end, best_room, payment_due, paid
+    client_list,
+    client_id,
+    state,
+    start,
+    end,
+    best_room,
+    payment_due,
+    paid,
+    dirty=None,
+    lookup=None,
 ):
-    client_list.loc[client_id, "start"] = start.date()
-    client_list.loc[client_id, "end"] = end.date()
-    client_list.loc[client_id, "reserved_room"] = best_room
+    client_list.loc[client_id, "start"] = pd.Timestamp(start)
+    client_list.loc[client_id, "end"] = pd.Timestamp(end)
+    client_list.loc[client_id, "reserved_room"] = int(best_room)
     client_list.loc[client_id, "payment_due"] = payment_due
     client_list.loc[client_id, "paid"] = paid
     client_list.loc[client_id, "state"] = state
 
+    if dirty is not None:
+        dirty.add(client_id)
+
+    if lookup is not None:
+        lookup.set(client_id, state, start, end)
+
 
-def remove_reservation_client_list(client_list, client_id):
-    client_list.loc[client_id, "start"] = None
-    client_list.loc[client_id, "end"] = None
+def remove_reservation_client_list(client_list, client_id, dirty=None, lookup=None):
+    client_list.loc[client_id, "start"] = np.nan
+    client_list.loc[client_id, "end"] = np.nan
     client_list.loc[client_id, "reserved_room"] = -1
-    client_list.loc[client_id, "payment_due"] = None
+    client_list.loc[client_id, "payment_due"] = np.nan
     client_list.loc[client_id, "paid"] = False
     client_list.loc[client_id, "state"] = 3
 
+    if dirty is not None:
+        dirty.add(client_id)
+
+    if lookup is not None:
+        lookup.set(client_id, 3)
+
 
-def remove_reservations(reservations, res_start):
-    reservations.drop(datetime.strptime(res_start, "%Y-%m-%d"), inplace=True)
+def remove_reservations(reservations, res_start, room_number, dirty=None):
+    res_start = pd.Timestamp(res_start)
+    reservations[int(room_number)] = reservations[int(room_number)].drop(res_start)
 
+    if dirty is not None:
+        dirty.add(int(room_number))
 
-def remove_intervals(intervals, start, end, room_number):
-    old_intv_end = datetime.strptime(start, "%Y-%m-%d") + timedelta(-1)
-    old_intv_start = datetime.strptime(end, "%Y-%m-%d") + timedelta(1)
 
-    new_intv_start = intervals.loc[
-        intervals[str(room_number)] == old_intv_end
-    ].index.date[0]
-    new_intv_end = intervals.loc[old_intv_start, str(room_number)]
+def remove_intervals(intervals, start, end, room_number, index=None, dirty=None):
+    old_intv_end = pd.Timestamp(start) + timedelta(-1)
+    old_intv_start = pd.Timestamp(end) + timedelta(1)
 
-    intervals.loc[np.datetime64(new_intv_start), str(room_number)] = new_intv_end
-    intervals.loc[old_intv_start, str(room_number)] = None
+    room_intervals = intervals[int(room_number)]
+    new_intv_start = room_intervals.index[room_intervals == old_intv_end][0]
+    new_intv_end = room_intervals.loc[old_intv_start]
 
-    intervals.dropna(axis=0, how="all", inplace=True)
+    room_intervals.loc[new_intv_start] = new_intv_end
+    intervals[int(room_number)] = room_intervals.drop(old_intv_start)
 
+    if index is not None:
+        index.set(room_number, new_intv_start, new_intv_end)
+        index.remove(room_number, old_intv_start)
 
-def checkin_client_list(client_list, client_id):
+    if dirty is not None:
+        dirty.add(int(room_number))
+
+
+def checkin_client_list(client_list, client_id, dirty=None, lookup=None):
     client_list.loc[client_id, "state"] = 1
     client_list.loc[client_id, "curr_room"] = client_list.loc[
         client_id, "reserved_room"
     ]
 
+    if dirty is not None:
+        dirty.add(client_id)
+
+    if lookup is not None:
+        start, end = client_list.loc[client_id, ["start", "end"]]
+        lookup.set(client_id, 1, start, end)
+
+
+def pop_reservation(reservations, res_start, room_number, dirty=None):
+    room_reservations = reservations[int(room_number)]
+    reservations[int(room_number)] = room_reservations.drop(
+        pd.Timestamp(res_start), errors="ignore"
+    )
+
+    if dirty is not None:
+        dirty.add(int(room_number))
+
+
+def move_reservation_client_list(client_list, client_id, room_number, dirty=None):
+    client_list.loc[client_id, "reserved_room"] = int(room_number)
+
+    if dirty is not None:
+        dirty.add(client_id)
 
-def pop_reservation(reservations, res_start, room_number):
-    reservations.loc[res_start, str(room_number)] = None
 
+def past_stay(client_list, client_id, paid, checked_out):
+    """
+    One row of the stay archive (see archive.py) holding the stay of a client checking out.
+    """
+    row = client_list.loc[client_id]
+
+    return pd.DataFrame(
+        {
+            "client_id": [client_id],
+            "room": [row["curr_room"]],
+            "start": [row["start"]],
+            "end": [row["end"]],
+            "payment_due": [row["payment_due"]],
+            "paid": [paid],
+            "checked_out": [pd.Timestamp(checked_out)],
+        }
+    )
+
+
+def checkout_client_list(
+    client_list, client_id, paid, dirty=None, lookup=None, stays=None
+):
+    if stays is not None:
+        stays.append(past_stay(client_list, client_id, paid, datetime.now().date()))
 
-def checkout_client_list(client_list, client_id, paid):
     client_list.loc[client_id, "state"] = 3
-    client_list.loc[client_id, "start"] = None
-    client_list.loc[client_id, "end"] = None
+    client_list.loc[client_id, "start"] = np.nan
+    client_list.loc[client_id, "end"] = np.nan
     client_list.loc[client_id, "reserved_room"] = -1
-    client_list.loc[client_id, "payment_due"] = None
+    client_list.loc[client_id, "payment_due"] = np.nan
     client_list.loc[client_id, "paid"] = paid
     client_list.loc[client_id, "curr_room"] = -1
 
+    if dirty is not None:
+        dirty.add(client_id)
+
+    if lookup is not None:
+        lookup.set(client_id, 3)
+
 
 def overwrite_intervals(intervals, script_dir, hotel_path, room_number):
-    df = intervals[str(room_number)].dropna()
+    df = intervals[int(room_number)].dropna()
 
     rooms_path = os.path.join(hotel_path, "rooms/intervals")
     full_path = os.path.join(script_dir, rooms_path)
     file_name = str(room_number) + ".csv"
-    with open(os.path.join(full_path, file_name), "w") as file:
+    with atomic_open(os.path.join(full_path, file_name)) as file:
         file.write("start,end\n")
         df.to_csv(file, header=False, index=True)
 
 
 def overwrite_reservations(reservations, script_dir, hotel_path, room_number):
-    df = reservations[str(room_number)].dropna()
+    df = reservations[int(room_number)].dropna()
 
     rooms_path = os.path.join(hotel_path, "rooms/reservations")
     full_path = os.path.join(script_dir, rooms_path)
     file_name = str(room_number) + ".csv"
-    with open(os.path.join(full_path, file_name), "w") as file:
+    with atomic_open(os.path.join(full_path, file_name)) as file:
         file.write("start,client_id\n")
         df.to_csv(file, header=False, index=True)
+
+
+BATCH_COLUMNS = ["client_id", "room_type", "start", "end"]
+
+
+def read_batch(batch_file):
+    """
+    Reads reservation requests from a csv or a jsonl (one JSON object per line) file.
+
+    Arguments:
+    batch_file is the filepath; *.jsonl and *.json are read as JSON lines, anything else as csv
+
+    Return:
+    pd.Dataframe() with client_id, room_type, start and end columns, in file order.
+    Rows which cannot be parsed keep NaN/NaT values, so they can be reported rather than dropped.
+    """
+    if os.path.splitext(batch_file)[1] in (".jsonl", ".json"):
+        batch = pd.read_json(batch_file, lines=True, dtype=False)
+    else:
+        batch = pd.read_csv(batch_file, dtype=str)
+
+    missing = [column for column in BATCH_COLUMNS if column not in batch.columns]
+    if missing:
+        raise click.BadParameter(
+            f"{batch_file} is missing the columns: {', '.join(missing)}"
+        )
+
+    batch = batch[BATCH_COLUMNS].copy()
+    for column in ["client_id", "room_type"]:
+        batch[column] = pd.to_numeric(batch[column], errors="coerce").astype("Int64")
+    for column in ["start", "end"]:
+        batch[column] = pd.to_datetime(
+            batch[column], format="%Y-%m-%d", errors="coerce"
+        )
+
+    return batch
+
+
+def order_batch(batch, order="file"):
+    """
+    Order in which the rows of a batch are allocated.
+
+    Arguments:
+    batch is type pd.Dataframe() (see read_batch())
+    order is one of hotel.BATCH_ORDERS:
+        file allocates rows as they appear in the file
+        start allocates the earliest reservations first
+        longest allocates the longest stays first, which are the hardest to fit
+
+    Return:
+    The row labels of batch in allocation order; ties keep file order
+    """
+    if order == "start":
+        ranking = np.argsort(batch["start"].values, kind="stable")
+    elif order == "longest":
+        length = (batch["end"] - batch["start"]).dt.days.fillna(-1).values
+        ranking = np.argsort(-length, kind="stable")
+    else:
+        ranking = np.arange(len(batch))
+
+    return batch.index[ranking]
+
+
+def nightly_sales(client_list, catalog, start, end, past_stays=None):
+    """
+    Rooms sold and revenue of each room type for every night of a date range.
+
+    Arguments:
+    client_list is type pd.Dataframe()
+    catalog is type RoomCatalog
+    start is type Datetime
+    end is type Datetime, included
+    past_stays is type pd.Dataframe(), stays of the archive (optional, see archive.read())
+
+    Return:
+    (sold, revenue), two pd.Dataframe() with nights as index and room types as columns
+
+    Description:
+    A stay from start to end sells the nights start .. end - 1, as payment_due charges (end - start) nights,
+    so each night earns payment_due / nights. The room is still held on end (split_interval() frees it
+    from end + 1), so hotel availability counts it as taken that day although it is not sold. Reserved (state 2) and checked in (state 1) clients are counted;
+    check-out clears the dates of a stay from client_list, so past stays only count through past_stays.
+    Each stay adds +1 (and its nightly rate) on its first night in the range and -1 after its last one,
+    in one bincount per room type x night; a cumulative sum along the nights gives every count at once.
+    """
+    types = get_room_types(catalog)
+
+    first = to_days(start)
+    num_nights = max(to_days(end) - first + 1, 0)
+    width = num_nights + 1
+
+    stays = client_list[
+        client_list["state"].isin([1, 2]) & client_list["start"].notna()
+    ]
+    if past_stays is not None and not past_stays.empty:
+        past_stays = past_stays.rename(columns={"room": "reserved_room"})
+        columns = ["start", "end", "reserved_room", "payment_due"]
+        stays = pd.concat([stays[columns], past_stays[columns]])
+    codes = catalog.type_codes(stays["reserved_room"].to_numpy(np.int64, na_value=-1))
+    stays = stays[codes >= 0]
+    codes = codes[codes >= 0]
+
+    stay_start = to_days(stays["start"])
+    stay_end = to_days(stays["end"]) - 1
+    nights = stay_end - stay_start + 1
+    rate = stays["payment_due"].fillna(0).values / np.maximum(nights, 1)
+
+    lo = np.maximum(stay_start, first) - first
+    hi = np.minimum(stay_end, first + num_nights - 1) - first
+    keep = lo <= hi
+    arrive = codes[keep] * width + lo[keep]
+    leave = codes[keep] * width + hi[keep] + 1
+
+    size = len(types) * width
+    sold = np.bincount(arrive, minlength=size) - np.bincount(leave, minlength=size)
+    revenue = np.bincount(arrive, rate[keep], minlength=size) - np.bincount(
+        leave, rate[keep], minlength=size
+    )
+
+    index = pd.date_range(start, periods=num_nights, freq="D", name="night")
+
+    def frame(events):
+        matrix = np.cumsum(events.reshape(len(types), width), axis=1)[:, :num_nights]
+        return pd.DataFrame(matrix.T, index=index, columns=types)
+
+    return frame(sold), frame(revenue).round(2)
+
+
+def sales_metric(sold, revenue, catalog, metric):
+    """
+    One of hotel.REPORT_METRICS from the output of nightly_sales().
+
+    occupancy is the share of the rooms of a type sold each night, revenue the sum of the nightly rates,
+    adr (average daily rate) the revenue per room sold and revpar the revenue per room of the type.
+    adr is NaN on nights without any room sold. Any other metric raises ValueError.
+    """
+    num_rooms = pd.Series(
+        {
+            room_type: len(get_room_of_type(catalog, room_type))
+            for room_type in sold.columns
+        }
+    )
+
+    if metric == "occupancy":
+        return (sold / num_rooms).round(4)
+    elif metric == "adr":
+        return (revenue / sold.where(sold > 0)).round(2)
+    elif metric == "revpar":
+        return (revenue / num_rooms).round(2)
+    elif metric == "revenue":
+        return revenue
+
+    raise ValueError(f"unknown metric {metric}")
@@ -1,13 +1,19 @@
 import click
-import pandas as pd
-import helpers
+import session
+import server
+import snapshot
+import profiling
 import os
+import json
 import shutil
 import fnmatch
 from datetime import datetime
 
 # import sqlite3
 
+# pandas, numpy and the modules built on them (helpers, storage, availability) are
+# imported by the commands which use them, so session commands and --help start fast
+
 INIT_CLIENT_INFO = (
     "client_id,state,start,end,reserved_room,payment_due,paid,curr_room\n"
 )
@@ -15,46 +21,1090 @@ INIT_CLIENT_SUPP = "client_id,name,email\n"
 INIT_RESERVATION_INFO = "start,client_id\n"
 INIT_INTERVAL_INFO = "start,end\n,"
 
+# Clients printed at a time by get-all-clients and get-some-clients, see echo_clients()
+CLIENT_CHUNK_ROWS = 1000
+
+# Allocation orders of reserve-batch, see helpers.order_batch()
+BATCH_ORDERS = ["file", "start", "longest"]
+
+# Metrics of hotel report, see helpers.sales_metric()
+REPORT_METRICS = ["occupancy", "revenue", "adr", "revpar"]
+
+# Nightly sales of the last date ranges reported, see Config.get_sales()
+REPORT_CACHE_FILE = "report_cache.pkl"
+REPORT_CACHE_SIZE = 32
+
+# oplog.LOG_FILE, which hotel quit checks without importing oplog (and pandas with it)
+OPLOG_FILE = "oplog.jsonl"
+
 
 class Config(object):
-    def __init__(self, hotel_path):
+    """
+    Hotel state, loaded lazily.
+
+    Each table is only read from disk the first time it is accessed, and room
+    files are only read for the rooms a command actually asks for.
+
+    Commands record the clients and rooms they change in the dirty sets. Once a
+    command has completed, commit() appends what changed to the operation log (see
+    oplog.py), and flush() writes the tables when a checkpoint is due.
+    """
+
+    def __init__(self, hotel_path, auto_prune=None):
 
         cwd_path = os.path.dirname(__file__)
         self.cwd_path = cwd_path
+        self.hotel_path = hotel_path
+        self.full_path = os.path.join(cwd_path, hotel_path)
+        self._store = None
+        self.auto_prune = auto_prune
+        # Set by hotel serve, which flushes on a timer instead of after every command
+        self.write_behind = False
+        # Set for READ_ONLY_COMMANDS, which hold a shared FLUSH_LOCK and not WRITE_LOCK,
+        # so they must never write the tables
+        self.read_only = False
+        self._oplog = None
+
+        self._client_list = None
+        self._client_supp = None
+        self._client_index = None
+        self._hotel = None
+        self._catalog = None
+        self._lookup = None
+        self._reservations = {}
+        self._intervals = {}
+        self._availability = {}
+        # Tables as of the last record of the operation log, which commit() diffs against
+        self._base_clients = None
+        self._base_rooms = {"reservations": {}, "intervals": {}}
+
+        self.new_clients = []
+        # Stays of clients who checked out, logged on commit and archived on checkpoint
+        self.past_stays = []
+        self.dirty_clients = set()
+        self.dirty_reservations = set()
+        self.dirty_intervals = set()
+
+    @property
+    def store(self):
+        if self._store is None:
+            with profiling.phase("import"):
+                import storage
+
+            self._store = storage.open_storage(self.cwd_path, self.hotel_path)
+        return self._store
+
+    @property
+    def oplog(self):
+        """
+        Operation log of the hotel (see oplog.OpLog), read on first use.
+        """
+        if self._oplog is None:
+            import oplog
+
+            with profiling.phase("load oplog"):
+                self._oplog = oplog.OpLog.read(self.full_path)
+        return self._oplog
+
+    @property
+    def client_list(self):
+        if self._client_list is None:
+            import oplog
+
+            with profiling.phase("load client_list"):
+                client_list = self.store.read_client_list()
+            with profiling.phase("replay oplog"):
+                client_list = oplog.apply_clients(
+                    client_list, self.oplog.client_images()
+                )
+            self._client_list = client_list
+            self._base_clients = client_list.copy()
+        return self._client_list
+
+    @client_list.setter
+    def client_list(self, client_list):
+        self._client_list = client_list
+        self._lookup = None
+
+    @property
+    def lookup(self):
+        """
+        State and date indexes of client_list (see lookup.ClientLookup), loaded on first use.
+
+        The lookup saved by the last checkpoint is loaded, and the clients changed by the
+        operation log since are set in it. It is built from client_list, and saved, if it
+        is missing or older than client_list.
+        """
+        if self._lookup is None:
+            with profiling.phase("load client lookup"):
+                lookup = self.store.read_client_lookup()
+
+            if lookup is None:
+                from lookup import ClientLookup
+
+                client_list = self.client_list
+                with profiling.phase("index clients"):
+                    lookup = ClientLookup.from_client_list(client_list)
+                with profiling.phase("write client lookup"):
+                    self.store.write_client_lookup(lookup)
+            else:
+                with profiling.phase("replay oplog"):
+                    for client_id, image in self.oplog.client_images().items():
+                        lookup.set(
+                            client_id, image["state"], image["start"], image["end"]
+                        )
+            self._lookup = lookup
+        return self._lookup
+
+    def clients_with_state(self, state):
+        """
+        Client ids with state, in order.
+        """
+        return self.lookup.with_state(state)
+
+    def clients_on(self, column, date):
+        """
+        Client ids whose start (arrivals) or end (departures) is date, in order.
+        """
+        if column == "start":
+            return self.lookup.arrivals(date)
+        return self.lookup.departures(date)
+
+    def built_lookup(self):
+        """
+        Client lookup already built, None if there is none yet: commands which change
+        clients keep it up to date without building it.
+        """
+        return self._lookup
+
+    @property
+    def client_supp(self):
+        if self._client_supp is None:
+            import oplog
+
+            with profiling.phase("load client_supp"):
+                client_supp = self.store.read_client_supp()
+            self._client_supp = oplog.apply_supp(client_supp, self.oplog.registered())
+        return self._client_supp
+
+    @client_supp.setter
+    def client_supp(self, client_supp):
+        self._client_supp = client_supp
+
+    def add_clients(self, new_list, new_supp):
+        """
+        Adds newly registered clients to the client tables already loaded.
+        Tables which are not loaded yet will read them from storage after the flush.
+        """
+        import helpers
+
+        if self._client_list is not None:
+            self._client_list = helpers.add_client_list(self._client_list, new_list)
+        if self._lookup is not None:
+            for client_id, row in new_list.iterrows():
+                self._lookup.set(client_id, row["state"], row["start"], row["end"])
+        if self._client_supp is not None:
+            self._client_supp = helpers.add_client_supp(self._client_supp, new_supp)
+
+        self.new_clients.append((new_list, new_supp))
+
+    def next_client_id(self):
+        # Clients registered since the last checkpoint are only in the operation log
+        next_id = max(self.oplog.registered(), default=-1) + 1
+
+        return max(self.store.next_client_id(), next_id) + len(self.new_clients)
+
+    def _changes(self):
+        """
+        Record of the changes not logged yet (see oplog.py), None if there are none.
+        """
+        import pandas as pd
+        import oplog
+
+        clients, supp = [], []
+        new_ids = set()
+        for new_list, new_supp in self.new_clients:
+            for client_id, row in new_supp.iterrows():
+                supp.append(
+                    [int(client_id), {"name": row["name"], "email": row["email"]}]
+                )
+            for client_id in new_list.index:
+                rows = new_list
+                if (
+                    self._client_list is not None
+                    and client_id in self._client_list.index
+                ):
+                    rows = self._client_list
+                clients.append(
+                    [int(client_id), None, oplog.client_image(rows, client_id)]
+                )
+                new_ids.add(int(client_id))
+
+        for client_id in sorted(self.dirty_clients - new_ids):
+            before = oplog.client_image(self._base_clients, client_id)
+            after = oplog.client_image(self._client_list, client_id)
+            if before != after:
+                clients.append([int(client_id), before, after])
+
+        record = {"clients": clients, "supp": supp}
+        for table, tables, dirty in [
+            ("reservations", self._reservations, self.dirty_reservations),
+            ("intervals", self._intervals, self.dirty_intervals),
+        ]:
+            changes = []
+            for room in sorted(dirty):
+                change = oplog.room_change(self._base_rooms[table][room], tables[room])
+                if change is not None:
+                    changes.append([room, change])
+            record[table] = changes
+
+        record["stays"] = (
+            oplog.stay_rows(pd.concat(self.past_stays)) if self.past_stays else []
+        )
+
+        if not any(record.values()):
+            return None
+        return record
+
+    def commit(self, command=None, **tags):
+        """
+        Appends the changes of a command to the operation log, before any table is written.
+
+        Arguments:
+        command is the command line of the command (list of STR)
+        tags are added to the record (undo=seq and redo=seq); a tagged record is
+            appended even if nothing changed
+
+        Return:
+        The record appended, None if there was nothing to log
+        """
+        if not (
+            tags
+            or self.new_clients
+            or self.past_stays
+            or self.dirty_clients
+            or self.dirty_reservations
+            or self.dirty_intervals
+        ):
+            return None
+
+        import oplog
+
+        with profiling.phase("diff changes"):
+            record = self._changes()
+
+        if record is not None or tags:
+            record = dict(command=command, **tags, **(record or {}))
+            with profiling.phase("write oplog"), session.lock_hotel(
+                self.full_path, session.FLUSH_LOCK
+            ):
+                record = self.oplog.append(record)
+
+            images = {c[0]: c[2] for c in record.get("clients", [])}
+            if self._base_clients is not None:
+                self._base_clients = oplog.apply_clients(self._base_clients, images)
+            for table, tables in [
+                ("reservations", self._reservations),
+                ("intervals", self._intervals),
+            ]:
+                for room, change in record.get(table, []):
+                    self._base_rooms[table][room] = tables[room].copy()
+
+        self.new_clients = []
+        self.past_stays = []
+        self.dirty_clients.clear()
+        self.dirty_reservations.clear()
+        self.dirty_intervals.clear()
+
+        return record
+
+    def flush(self, checkpoint=False):
+        """
+        Logs the changes not logged yet (see commit()), then writes the tables if the
+        operation log holds oplog.CHECKPOINT_RECORDS records since the last checkpoint,
+        or if checkpoint.
+        """
+        self.commit()
+        if self._oplog is None and (not checkpoint or self.log_checkpointed()):
+            return
+
+        import oplog
+
+        if checkpoint or len(self.oplog.tail) >= oplog.CHECKPOINT_RECORDS:
+            self.checkpoint()
+
+    def log_checkpointed(self):
+        """
+        Whether every record of the operation log is in the tables already: true if there
+        is no oplog.jsonl, or if its last line is a checkpoint. Only that line is read.
+        """
+        fp = os.path.join(self.full_path, OPLOG_FILE)
+        if not os.path.isfile(fp):
+            return True
+
+        with open(fp, "rb") as in_file:
+            in_file.seek(max(0, os.path.getsize(fp) - 4096))
+            lines = in_file.read().splitlines()
+
+        try:
+            return bool(lines) and "checkpoint" in json.loads(lines[-1])
+        except (ValueError, TypeError):
+            return False
+
+    def checkpoint(self):
+        """
+        Writes the clients and rooms changed by the records of the operation log since the
+        last checkpoint in a single transaction, then marks them as written in the log.
+
+        Nothing is lost if the checkpoint is interrupted: the tables hold the changes of
+        some records and not of others, and the next command replays them all again.
+        Past stays are archived first, and archive.read() ignores the ones archived twice.
+        """
+        if self.read_only:
+            raise RuntimeError(
+                "a checkpoint needs write.lock, read-only commands do not hold it"
+            )
+
+        tail = self.oplog.tail
+        if not tail:
+            return
+
+        client_ids, reservation_rooms, interval_rooms = self.oplog.touched()
+        stays = self.oplog.pending_stays()
+        # Loaded while it still matches client_list, to be saved once client_list is written
+        lookup = self.lookup if client_ids else None
+
+        with profiling.phase("checkpoint"), session.lock_hotel(
+            self.full_path, session.FLUSH_LOCK
+        ):
+            with self.store.transaction():
+                if not stays.empty:
+                    import archive
+
+                    with profiling.phase("write archive"):
+                        archive.append(self.full_path, stays)
+
+                # Clients registered since the last checkpoint go to the journal, with the
+                # rows they have now. A checkpoint interrupted after appending them already
+                # stored some of them, which are rewritten instead.
+                stored = self.store.next_client_id()
+                new_ids = sorted(i for i in self.oplog.registered() if i >= stored)
+                if new_ids:
+                    with profiling.phase("write client_supp (append)"):
+                        self.store.append_client_supp(self.client_supp.loc[new_ids])
+                    with profiling.phase("write client_list (append)"):
+                        self.store.append_client_list(self.client_list.loc[new_ids])
+
+                client_ids -= set(new_ids)
+                if client_ids:
+                    with profiling.phase("write client_list"):
+                        self.store.write_client_list(
+                            self.client_list, sorted(client_ids)
+                        )
+
+                reservations = self.get_reservations(reservation_rooms)
+                for room in sorted(reservation_rooms):
+                    with profiling.phase(f"write reservations/{room}"):
+                        self.store.write_reservations(reservations, room)
+
+                intervals = self.get_intervals(interval_rooms)
+                for room in sorted(interval_rooms):
+                    with profiling.phase(f"write intervals/{room}"):
+                        self.store.write_intervals(intervals, room)
+
+            if lookup is not None:
+                with profiling.phase("write client lookup"):
+                    self.store.write_client_lookup(lookup)
+
+            with profiling.phase("write oplog"):
+                self.oplog.write_checkpoint()
+
+    def apply_record(self, record, undo=False):
+        """
+        Applies the after images of a record of the operation log to the hotel in memory,
+        or its before images if undo, marking the clients and rooms it changes dirty.
+        """
+        import oplog
+
+        images = {
+            int(client_id): before if undo else after
+            for client_id, before, after in record.get("clients", [])
+        }
+        if images:
+            self.client_list = oplog.apply_clients(self.client_list, images)
+            self.dirty_clients.update(images)
+
+        for table, get_rooms, dirty in [
+            ("reservations", self.get_reservations, self.dirty_reservations),
+            ("intervals", self.get_intervals, self.dirty_intervals),
+        ]:
+            changes = record.get(table, [])
+            rooms = get_rooms([room for room, change in changes])
+            for room, change in changes:
+                rooms[int(room)] = oplog.apply_room(rooms[int(room)], change, undo)
+                dirty.add(int(room))
+
+        self.clear_availability()
+
+    @property
+    def client_index(self):
+        if self._client_index is None:
+            with profiling.phase("load client_index"):
+                client_index = self.store.read_client_index()
+            for client_id, supp in self.oplog.registered().items():
+                client_index[(supp["name"], supp["email"])] = client_id
+            self._client_index = client_index
+        return self._client_index
+
+    @property
+    def hotel(self):
+        if self._hotel is None:
+            import pandas as pd
+
+            fp = os.path.join(self.full_path, "hotel.json")
+            with profiling.phase("load hotel.json"):
+                self._hotel = pd.read_json(fp, typ="series")
+        return self._hotel
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            from catalog import RoomCatalog
+
+            self._catalog = RoomCatalog.from_hotel(self.hotel)
+        return self._catalog
+
+    @property
+    def reservations(self):
+        return self.get_reservations()
+
+    @property
+    def intervals(self):
+        return self.get_intervals()
+
+    def all_rooms(self):
+        return self.catalog.numbers.tolist()
+
+    def get_reservations(self, rooms=None):
+        """
+        Reservations of each room (dict of pd.Series), holding at least the given rooms (all rooms if None).
+        """
+        if rooms is None:
+            rooms = self.all_rooms()
+        missing = [int(r) for r in rooms if int(r) not in self._reservations]
+
+        if missing:
+            with profiling.phase("load reservations"):
+                reservations = self.store.read_reservations(missing)
+            self._reservations.update(self._replay_rooms("reservations", reservations))
+
+        return self._reservations
+
+    def get_intervals(self, rooms=None):
+        """
+        Intervals of each room (dict of pd.Series), holding at least the given rooms (all rooms if None).
+        """
+        if rooms is None:
+            rooms = self.all_rooms()
+        missing = [int(r) for r in rooms if int(r) not in self._intervals]
+
+        if missing:
+            with profiling.phase("load intervals"):
+                intervals = self.store.read_intervals(missing)
+            self._intervals.update(self._replay_rooms("intervals", intervals))
+
+        return self._intervals
+
+    def _replay_rooms(self, table, rooms):
+        """
+        Applies the changes of the operation log to rooms just read from storage.
+        """
+        import oplog
+
+        changes = self.oplog.room_changes(table)
+        with profiling.phase("replay oplog"):
+            for room, series in rooms.items():
+                for change in changes.get(room, []):
+                    series = oplog.apply_room(series, change)
+                rooms[room] = series
+                self._base_rooms[table][room] = series.copy()
+
+        return rooms
+
+    def get_availability(self, room_type):
+        """
+        Availability index of the rooms of room_type.
+        Built on first use, then kept up to date by add_intervals and remove_intervals.
+        """
+        if room_type not in self._availability:
+            import helpers
+            from availability import AvailabilityIndex
+
+            rooms = helpers.get_room_of_type(self.catalog, room_type)
+            intervals = self.get_intervals(rooms)
+            with profiling.phase("index availability"):
+                self._availability[room_type] = AvailabilityIndex.from_intervals(
+                    {room: intervals[room] for room in rooms}
+                )
+
+        return self._availability[room_type]
+
+    def get_sales(self, start, end):
+        """
+        Rooms sold and revenue of each room type for every night from start to end (see helpers.nightly_sales()).
+
+        Past stays of the archive are counted along with client_list. Results are cached
+        per date range in report_cache.pkl along with the stamps of client_list, the archive,
+        the operation log and hotel.json, so any reservation, check-in or check-out
+        invalidates them.
+        """
+        import pickle
+        import helpers
+        import archive
+        import oplog
+
+        # Unflushed changes (hotel serve) are not on disk yet, so the stamps would not see them
+        if self.new_clients or self.dirty_clients:
+            return helpers.nightly_sales(
+                self.client_list,
+                self.catalog,
+                start,
+                end,
+                self.get_past_stays(start, end),
+            )
+
+        fp = os.path.join(self.full_path, REPORT_CACHE_FILE)
+        hotel_stat = os.stat(os.path.join(self.full_path, "hotel.json"))
+        stamp = (
+            self.store.client_list_stamp()
+            + archive.stamp(self.full_path)
+            + oplog.stamp(self.full_path)
+            + ((hotel_stat.st_mtime_ns, hotel_stat.st_size),)
+        )
+        key = (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+
+        cache = {}
+        if os.path.isfile(fp):
+            with open(fp, "rb") as in_file:
+                cache = pickle.load(in_file)
+        if key in cache and cache[key][0] == stamp:
+            return cache[key][1]
+
+        sales = helpers.nightly_sales(
+            self.client_list, self.catalog, start, end, self.get_past_stays(start, end)
+        )
+
+        cache = {k: v for k, v in cache.items() if v[0] == stamp and k != key}
+        cache[key] = (stamp, sales)
+        for k in list(cache)[:-REPORT_CACHE_SIZE]:
+            del cache[k]
+        with helpers.atomic_open(fp, "wb") as out_file:
+            pickle.dump(cache, out_file)
+
+        return sales
+
+    def get_past_stays(self, start=None, end=None):
+        """
+        Archived stays overlapping start .. end (see archive.read()), including the stays
+        of check-outs which are only in the operation log or not logged yet.
+        """
+        import pandas as pd
+        import archive
+
+        stays = archive.read(self.full_path, start, end)
+        pending = [self.oplog.pending_stays()] + self.past_stays
+        pending = archive.overlapping(pd.concat(pending), start, end)
+        if not pending.empty:
+            stays = archive.overlapping(pd.concat([stays, pending]))
+
+        return stays
+
+    def load(self):
+        """
+        Reads every table and room at once, for hotel serve.
+        """
+        self.client_list
+        self.client_supp
+        self.client_index
+        self.lookup
+        self.get_reservations()
+        self.get_intervals()
+
+    def discard(self):
+        """
+        Drops every table read so far along with the changes not logged yet, for hotel
+        serve when a command fails half-way: the tables are read again, and the operation
+        log replayed, on next use.
+        """
+        self._oplog = None
+        self._client_list = None
+        self._client_supp = None
+        self._client_index = None
+        self._lookup = None
+        self._reservations = {}
+        self._intervals = {}
+        self._availability = {}
+        self._base_clients = None
+        self._base_rooms = {"reservations": {}, "intervals": {}}
+
+        self.new_clients = []
+        self.past_stays = []
+        self.dirty_clients.clear()
+        self.dirty_reservations.clear()
+        self.dirty_intervals.clear()
+
+    def clear_availability(self):
+        self._availability = {}
+
+    def room_availability(self, room_number):
+        """
+        Availability index already built for the room, None if there is none yet.
+        """
+        for index in self._availability.values():
+            if int(room_number) in index.room_code:
+                return index
+
+        return None
+
+
+def reserve_room(config, client_id, room_type, start, end, repack=False):
+    """
+    Reserves the best available room of room_type for client_id.
+
+    Arguments:
+    config is type Config
+    client_id is type INT; the client must exist and be able to make a reservation
+    room_type is type INT
+    start is type Datetime
+    end is type Datetime
+    repack is type BOOL; if no room is free, move the reservations of room_type which
+        have not started yet to make one (see plan_repack())
+
+    Return:
+    The reserved room number, None if no room of room_type is available
+
+    Description:
+    Rooms are searched through the availability index of room_type, see get_room_number_optimized().
+    The client, reservations and intervals of the best room are updated in memory and marked dirty.
+    """
+    import helpers
+
+    room_matching_type = helpers.get_room_of_type(config.catalog, room_type)
+    intervals = config.get_intervals(room_matching_type)
+    index = config.get_availability(room_type)
+
+    available_rooms = helpers.get_room_number_optimized(intervals, start, end, index)
+    if not available_rooms.empty:
+        best_room = available_rooms["room"][0]
+        helpers.add_intervals(
+            intervals,
+            best_room,
+            start,
+            end,
+            config.hotel_path,
+            index,
+            config.dirty_intervals,
+        )
+    elif repack:
+        plan = plan_repack(config, room_type, (client_id, start, end))
+        if plan is None:
+            return None
+        apply_repack(config, *plan)
+        best_room = plan[1][client_id]
+    else:
+        return None
+
+    delta = end - start
+
+    payment = helpers.get_payment(config.catalog, best_room)
+    payment_due = delta.days * payment
+    paid = False
+
+    helpers.add_reservation_client_list(
+        config.client_list,
+        client_id,
+        2,
+        start,
+        end,
+        best_room,
+        payment_due,
+        paid,
+        config.dirty_clients,
+        config.built_lookup(),
+    )
+
+    reservations = config.get_reservations([best_room])
+    helpers.add_reservations(
+        reservations,
+        best_room,
+        client_id,
+        start,
+        config.dirty_reservations,
+    )
+
+    return best_room
+
+
+def plan_repack(config, room_type, new_booking=None):
+    """
+    Assigns the reservations of room_type which have not started yet to its rooms again.
+
+    Arguments:
+    config is type Config
+    room_type is type INT
+    new_booking is (client_id, start, end) of a reservation to fit in along with them (optional)
+
+    Return:
+    (bookings, assigned, new_intervals), see helpers.repack_rooms(); None if they do not all fit
+
+    Description:
+    Only reserved clients (state 2) whose stay starts after today are moved. Checked in
+    clients and stays starting today keep their room.
+    """
+    import numpy as np
+    import pandas as pd
+    import helpers
+
+    rooms = helpers.get_room_of_type(config.catalog, room_type)
+    client_list = config.client_list
+
+    starts = client_list["start"]
+    movable = (client_list["state"] == 2) & client_list["reserved_room"].isin(rooms)
+    movable &= starts > pd.Timestamp(datetime.date(datetime.now()))
+
+    bookings = pd.DataFrame(
+        {
+            "start": starts[movable],
+            "end": client_list["end"][movable],
+            "room": client_list["reserved_room"][movable].astype(np.int64),
+        }
+    )
+    if new_booking is not None:
+        client_id, start, end = new_booking
+        new_row = pd.DataFrame(
+            {"start": [start], "end": [end], "room": [-1]},
+            index=pd.Index([client_id], name=bookings.index.name),
+        )
+        bookings = pd.concat([bookings, new_row])
+
+    plan = helpers.repack_rooms(config.get_intervals(rooms), rooms, bookings)
+    if plan is None:
+        return None
+
+    return (bookings,) + plan
+
+
+def apply_repack(config, bookings, assigned, new_intervals):
+    """
+    Moves the reservations to the rooms of a plan_repack() and replaces the intervals of their rooms.
+    New bookings (room -1) are left to the caller.
+    """
+    import helpers
+
+    moved = bookings.index[(bookings["room"] >= 0) & (assigned != bookings["room"])]
+    reservations = config.get_reservations(list(new_intervals))
+    intervals = config.get_intervals(list(new_intervals))
+
+    # Every moved reservation leaves its room before any is added, so two
+    # reservations swapping rooms on the same start date never overwrite each other
+    for client_id in moved:
+        helpers.pop_reservation(
+            reservations,
+            bookings.loc[client_id, "start"],
+            bookings.loc[client_id, "room"],
+            config.dirty_reservations,
+        )
+    for client_id in moved:
+        helpers.add_reservations(
+            reservations,
+            assigned[client_id],
+            client_id,
+            bookings.loc[client_id, "start"],
+            config.dirty_reservations,
+        )
+        helpers.move_reservation_client_list(
+            config.client_list, client_id, assigned[client_id], config.dirty_clients
+        )
+
+    for room, room_intervals in new_intervals.items():
+        if not room_intervals.equals(intervals[room].dropna()):
+            intervals[room] = room_intervals
+            config.dirty_intervals.add(room)
+
+    config.clear_availability()
+
+    return moved
+
 
-        rel_path = hotel_path + "/client_list.csv"
-        fp = os.path.join(cwd_path, rel_path)
-        self.client_list = pd.read_csv(fp, index_col="client_id")
+def echo_matrix(matrix, output_format, output, title):
+    """
+    Prints a nights x room types matrix as a table, csv or JSON records, or writes it to output.
+    """
+    import pandas as pd
+    import helpers
 
-        rel_path = hotel_path + "/client_supp.csv"
-        fp = os.path.join(cwd_path, rel_path)
-        self.client_supp = pd.read_csv(fp, index_col="client_id")
+    if output_format == "csv":
+        text = matrix.to_csv()
+    elif output_format == "json":
+        text = matrix.reset_index().to_json(orient="records") + "\n"
+    else:
+        with pd.option_context("display.max_rows", None, "display.max_columns", None):
+            text = f"{matrix}\n"
 
-        rel_path = hotel_path + "/hotel.json"
-        fp = os.path.join(cwd_path, rel_path)
-        self.hotel = pd.read_json(fp, typ="series")
+    if output is None:
+        click.echo(text, nl=False)
+    else:
+        with helpers.atomic_open(output) as out_file:
+            out_file.write(text)
+        click.echo(f"{title} written to {output}")
 
-        rel_path = hotel_path + "/rooms/reservations"
-        fp = os.path.join(cwd_path, rel_path)
-        self.reservations = helpers.get_reservations(fp)
 
-        rel_path = hotel_path + "/rooms/intervals"
-        fp = os.path.join(cwd_path, rel_path)
-        self.intervals = helpers.get_intervals(fp)
+def echo_clients(client_list, client_ids, columns, output_format, limit, offset):
+    """
+    Prints clients as tables, csv or JSON lines, CLIENT_CHUNK_ROWS clients at a time.
+
+    Arguments:
+    client_list is type pd.DataFrame, indexed by client_id (client_list, or the stays of history)
+    client_ids is a list of the client ids to print, in order (every client if None)
+    columns is a comma separated list of columns, every column if None
+    output_format is "table", "csv" or "jsonl"
+    limit is the number of clients to print at most (all if None)
+    offset is the number of clients skipped first
+
+    Description:
+    Each chunk is rendered and written before the next one is taken, so the output is
+    never held whole in memory. Tables are printed one per chunk, each with its header.
+    """
+    import pandas as pd
+    import helpers
+
+    if columns is not None:
+        columns = [column.strip() for column in columns.split(",")]
+        unknown = [column for column in columns if column not in client_list.columns]
+        if unknown:
+            raise click.BadParameter(f"unknown columns {', '.join(unknown)}")
+
+    total = len(client_list) if client_ids is None else len(client_ids)
+    stop = total if limit is None else min(total, offset + limit)
+    width = pd.get_option("display.width")
+
+    # An empty selection still prints the header of its format
+    for i in range(offset, max(stop, offset + 1), CLIENT_CHUNK_ROWS):
+        rows = slice(i, min(i + CLIENT_CHUNK_ROWS, stop))
+        if client_ids is None:
+            chunk = client_list.iloc[rows]
+        else:
+            chunk = client_list.loc[client_ids[rows]]
+        if columns is not None:
+            chunk = chunk[columns]
+
+        if output_format == "csv":
+            text = chunk.to_csv(
+                header=i == offset, date_format=helpers.CLIENT_DATE_FORMAT
+            )
+            click.echo(text, nl=False)
+        elif output_format == "jsonl":
+            if not chunk.empty:
+                # Dates as in client_list.csv rather than epoch milliseconds
+                dates = chunk.select_dtypes("datetime").columns
+                chunk = chunk.assign(
+                    **{
+                        column: chunk[column].dt.strftime(helpers.CLIENT_DATE_FORMAT)
+                        for column in dates
+                    }
+                )
+                text = chunk.reset_index().to_json(orient="records", lines=True)
+                click.echo(text, nl=False)
+        else:
+            click.echo(chunk.to_string(line_width=width))
+
+
+def client_output_options(command):
+    """
+    Options of the commands printing clients, see echo_clients().
+    """
+    command = click.option(
+        "--format",
+        "output_format",
+        type=click.Choice(["table", "csv", "jsonl"]),
+        default="table",
+        show_default=True,
+    )(command)
+    command = click.option(
+        "--columns", help="Comma separated columns to print (default: every column)."
+    )(command)
+    command = click.option(
+        "--offset",
+        type=click.IntRange(min=0),
+        default=0,
+        show_default=True,
+        help="Number of clients to skip.",
+    )(command)
+    command = click.option(
+        "--limit",
+        type=click.IntRange(min=0),
+        help="Number of clients to print at most (default: all).",
+    )(command)
+    return command
+
+
+# Commands which only read the hotel, and may run alongside each other
+READ_ONLY_COMMANDS = {
+    "availability",
+    "report",
+    "arrivals",
+    "departures",
+    "history",
+    "get-one-client",
+    "get-some-clients",
+    "get-all-clients",
+    "get-client-id",
+}
+
+
+class HotelCommand(click.Command):
+    """
+    Times the body of a command as the "command" phase of hotel --profile.
+    """
 
+    def invoke(self, ctx):
+        with profiling.phase("command"):
+            return super().invoke(ctx)
 
-@click.group()
+
+class HotelGroup(click.Group):
+    """
+    Keeps the command line of the subcommand, so the group can forward it to hotel serve,
+    and profiles the whole invocation with hotel --profile.
+    """
+
+    command_class = HotelCommand
+
+    def resolve_command(self, ctx, args):
+        cmd_name, cmd, cmd_args = super().resolve_command(ctx, args)
+        ctx.meta["hotel.command_args"] = [cmd_name] + list(cmd_args)
+
+        if profiling.active():
+            profiling.current().command = cmd_name
+            profiling.current().args = list(cmd_args)
+
+        return cmd_name, cmd, cmd_args
+
+    def invoke(self, ctx):
+        log_file = ctx.params.get("profile_log")
+        stats_file = ctx.params.get("profile_stats")
+        if not (ctx.params.get("profile") or log_file or stats_file):
+            return super().invoke(ctx)
+
+        with profiling.profile(log_file, stats_file):
+            return super().invoke(ctx)
+
+
+@click.group(cls=HotelGroup)
+@click.option(
+    "--auto-prune",
+    type=click.INT,
+    envvar="HOTEL_AUTO_PRUNE",
+    help="Let reserve-dates prune rooms with more than N expired intervals.",
+)
+@click.option(
+    "--hotel",
+    "hotel_dir",
+    type=click.Path(exists=True, file_okay=False),
+    envvar="HOTEL_DIR",
+    help="Work on this hotel directory instead of the one of the session.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    envvar="HOTEL_PROFILE",
+    help="Write the phase timings of the command as a JSON line on stderr.",
+)
+@click.option(
+    "--profile-log",
+    type=click.Path(dir_okay=False),
+    envvar="HOTEL_PROFILE_LOG",
+    help="Append the JSON line to this file instead (implies --profile).",
+)
+@click.option(
+    "--profile-stats",
+    type=click.Path(dir_okay=False),
+    envvar="HOTEL_PROFILE_STATS",
+    help="Dump cProfile stats of the command to this file (implies --profile).",
+)
 @click.pass_context
-def cli(ctx):
+def cli(ctx, auto_prune, hotel_dir, profile, profile_log, profile_stats):
     """
     Hello, I am Jeeves, the hotel concierge. How may I help you?
     """
 
-    if os.path.isfile("session.csv"):
-        hotel_path = helpers.get_hotel_path()
+    # hotel serve runs commands with its own Config already in ctx.obj
+    if ctx.obj is not None:
+        if profiling.active():
+            profiling.current().hotel_path = ctx.obj.hotel_path
+        return
+
+    if hotel_dir is not None:
+        hotel_path = os.path.abspath(hotel_dir)
+    elif os.path.isfile("session.csv"):
+        hotel_path = session.get_hotel_path()
         alphabet = hotel_path.lstrip("data/hotel_")
         click.echo(f"Session for Hotel {alphabet} is in progress")
-        ctx.obj = Config(hotel_path)
+    else:
+        return
+
+    full_path = os.path.join(os.path.dirname(__file__), hotel_path)
+    command = ctx.invoked_subcommand
+    if profiling.active():
+        profiling.current().hotel_path = hotel_path
+
+    if command in server.FORWARDED_COMMANDS:
+        with profiling.phase("forward"):
+            reply = server.forward(
+                full_path,
+                ctx.meta["hotel.command_args"],
+                lambda text: click.echo(text, nl=False),
+            )
+        if reply is not None:
+            output, exit_code = reply
+            click.echo(output, nl=False)
+            ctx.exit(exit_code)
+
+    # Released once the command has been flushed (or has failed)
+    with profiling.phase("lock"):
+        if command in READ_ONLY_COMMANDS:
+            ctx.with_resource(session.lock_hotel(full_path, session.FLUSH_LOCK, False))
+        elif command in server.FORWARDED_COMMANDS or command == "serve":
+            ctx.with_resource(session.lock_hotel(full_path, session.WRITE_LOCK))
+
+    # Commands import pandas and the modules built on it in their body; importing
+    # them here keeps that time out of the "command" phase
+    if profiling.active():
+        with profiling.phase("import"):
+            import storage  # noqa: F401
+
+    ctx.obj = Config(hotel_path, auto_prune)
+    ctx.obj.read_only = command in READ_ONLY_COMMANDS
+
+
+def command_line():
+    """
+    Command line of the subcommand being run, as recorded by HotelGroup.
+    """
+    return click.get_current_context().meta.get("hotel.command_args")
+
+
+@cli.result_callback()
+@click.pass_obj
+def flush(config, result, **kwargs):
+    """
+    Logs the changes of a command once it has completed successfully, and writes the
+    tables when a checkpoint is due. Read-only commands leave both to the next writer.
+    """
+    if isinstance(config, Config) and not config.read_only:
+        config.commit(command_line())
+        if not config.write_behind:
+            config.flush()
 
 
 @cli.command()
@@ -97,12 +1147,31 @@ def quit():
 
     Description:\n
     This commmand ends the current session.\n
+    Stops hotel serve if it is running, once its pending changes are written.\n
+    Writes the changes of the operation log (data/hotel_*/oplog.jsonl) to the tables, see hotel checkpoint.\n
+    Refreshes the binary snapshot of the csv files (data/hotel_*/snapshot) used to load the hotel quickly.\n
     Moves the session.csv file to data/hotel_*/session.csv for storage
     """
-    helpers.handle_session()
+    session.handle_session(allow_hotel=False)
 
-    hotel_path = helpers.get_hotel_path()
+    hotel_path = session.get_hotel_path()
     hotel = hotel_path.split("/")[1]
+    full_path = os.path.join(os.path.dirname(__file__), hotel_path)
+    if server.stop(full_path):
+        click.echo(f"Stopped hotel serve for {hotel}.")
+
+    with session.lock_hotel(full_path, session.WRITE_LOCK):
+        Config(hotel_path).flush(checkpoint=True)
+
+    # Migrated hotels (storage.DB_FILE) have no csv files to snapshot
+    if not os.path.isfile(os.path.join(full_path, "hotel.db")) and snapshot.stale(
+        full_path
+    ):
+        import storage
+
+        with session.lock_hotel(full_path, session.WRITE_LOCK):
+            storage.CsvStorage(os.path.dirname(__file__), hotel_path).write_snapshot()
+
     shutil.move("session.csv", hotel_path)
     click.echo(f"The session for {hotel} is now closed.")
 
@@ -137,6 +1206,8 @@ def initialize(hotel_file):
     }
 
     """
+    import pandas as pd
+    import helpers
 
     if os.path.isfile("session.csv"):
         click.echo("A session is alr in progress. Please verify session.")
@@ -179,13 +1250,87 @@ def initialize(hotel_file):
             with open(fp, "w") as out_file:
                 out_file.write(INIT_INTERVAL_INFO)
 
-        helpers.create_temp(hotel_name)
+        session.create_temp(hotel_name)
 
         click.echo(
             f"Initialization complete. The session for Hotel {hotel_name} is ready for use."
         )
 
 
+@cli.command()
+@click.argument("hotel_dir", type=click.Path(exists=True, file_okay=False))
+def migrate(hotel_dir):
+    """
+    Moves a hotel from csv files to a single hotel.db file.
+
+    Usage:\n
+    hotel migrate data/hotel_*\n
+
+    Arguments:\n
+    hotel_dir is the directory of an initialized hotel\n
+
+    Description:\n
+    This commmand imports client_list.csv, client_supp.csv and rooms/*/*.csv into data/hotel_*/hotel.db (sqlite3), once the changes of the operation log are written to them.\n
+    Once hotel.db exists every command reads and writes it instead of the csv files.\n
+    The csv files are left untouched as a backup.
+    """
+    import storage
+
+    hotel_path = os.path.normpath(hotel_dir)
+    cwd_path = os.path.dirname(__file__)
+    full_path = os.path.join(cwd_path, hotel_path)
+
+    if server.is_running(full_path):
+        click.echo(f"hotel serve is running for {hotel_path}. Please quit it first.")
+        raise click.Abort()
+
+    with session.lock_hotel(full_path, session.WRITE_LOCK):
+        if os.path.isfile(os.path.join(full_path, storage.DB_FILE)):
+            click.echo(f"{hotel_path} has already been migrated.")
+            raise click.Abort()
+
+        Config(hotel_path).flush(checkpoint=True)
+        num_clients = storage.migrate(cwd_path, hotel_path)
+    click.echo(f"Migrated {num_clients} clients of {hotel_path} to {storage.DB_FILE}.")
+
+
+@cli.command()
+@click.option(
+    "--flush-interval",
+    type=click.FLOAT,
+    default=1.0,
+    show_default=True,
+    help="Seconds between checks for a due checkpoint.",
+)
+@click.pass_obj
+def serve(config, flush_interval):
+    """
+    Keep the current hotel loaded and serve commands from memory.
+
+    Usage:\n
+    hotel serve [--flush-interval SECONDS]\n
+
+    Arguments:\n
+    None\n
+
+    Description:\n
+    This commmand loads the hotel of the current session once and listens on data/hotel_*/hotel.sock.\n
+    While it runs, the client and room commands (register, reserve-dates, check-in, get-*, ...) issued from this directory are forwarded to it, and run without reloading the hotel.\n
+    Every command is logged to data/hotel_*/oplog.jsonl as soon as it completes; the tables are written behind, by a checkpoint every 100 commands (checked every --flush-interval seconds) and when it stops.\n
+    Stop it with hotel quit, Ctrl-C or SIGTERM. Options of the hotel group (e.g. --auto-prune) are taken from the serve command line.
+    """
+    session.handle_session()
+
+    if server.is_running(config.full_path):
+        click.echo(f"hotel serve is already running for {config.hotel_path}.")
+        raise click.Abort()
+
+    config.load()
+    click.echo(f"Serving {config.hotel_path} on {server.socket_path(config.full_path)}")
+    server.serve(cli, config, flush_interval)
+    click.echo("hotel serve stopped.")
+
+
 @cli.command()
 @click.argument("name", type=click.STRING)
 @click.argument("email", type=click.STRING)
@@ -207,21 +1352,17 @@ def register(config, name, email):
     Client_list.csv uses client ID to track relevent informtion
 
     """
-    helpers.handle_session()
-
-    id_list = helpers.unique_client(config.client_supp, name, email)
+    import helpers
 
-    if id_list.empty:
-        hotel_path = helpers.get_hotel_path()
-        full_path = os.path.join(config.cwd_path, hotel_path)
+    session.handle_session()
 
-        config.client_supp = helpers.add_client_supp(config.client_supp, name, email)
-        helpers.overwrite_client_supp(config.client_supp, full_path)
-
-        config.client_list = helpers.add_client_list(
-            config.client_list, 3, None, None, -1, None, False, -1
+    if helpers.unique_client(config.client_index, name, email) is None:
+        client_id = config.next_client_id()
+        new_supp = helpers.new_client_supp(client_id, name, email, config.client_index)
+        new_list = helpers.new_client_list(
+            client_id, 3, None, None, -1, None, False, -1
         )
-        helpers.overwrite_client_list(config.client_list, full_path)
+        config.add_clients(new_list, new_supp)
 
         click.echo("Registration successful!")
 
@@ -234,13 +1375,18 @@ def register(config, name, email):
 @click.argument("room_type", type=click.INT)
 @click.argument("start", type=click.DateTime(formats=["%Y-%m-%d"]))
 @click.argument("end", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option(
+    "--repack",
+    is_flag=True,
+    help="If no room is free, move reservations which have not started yet to make one.",
+)
 @click.pass_obj
-def reserve_dates(config, client_id, room_type, start, end):
+def reserve_dates(config, client_id, room_type, start, end, repack):
     """
     Find ideal rooms based on criteria given.
 
     Usage:\n
-    hotel reserve-dates client_id room_type start_date end_date\n
+    hotel reserve-dates client_id room_type start_date end_date [--repack]\n
 
     Arguments:\n
     client_id is type INT\n
@@ -253,63 +1399,37 @@ def reserve_dates(config, client_id, room_type, start, end):
     Rooms are ordered by the minimal disruption of free intervals\n
     Creates new reservation in rooms/reservations/{best_room}.csv\n
     Splits and adds new interverl in rooms/interval/{best_rom}.csv\n
-    Updates client_list.csv with new informtion, reserved state = 2
+    Updates client_list.csv with new informtion, reserved state = 2\n
+    With --repack, a request no room can take is fitted by moving other reservations of room_type (see optimize-rooms)
 
     """
-    helpers.handle_session()
+    import helpers
+
+    session.handle_session()
 
     if client_id in config.client_list.index:
 
         if config.client_list.loc[client_id, "state"] == 3:
 
-            hotel_path = helpers.get_hotel_path()
-            full_path = os.path.join(config.cwd_path, hotel_path)
-
-            room_matching_type = helpers.get_room_of_type(config.hotel, room_type)
-            df_intervals = config.intervals[room_matching_type].dropna(
-                axis=0, how="all"
-            )
+            room_matching_type = helpers.get_room_of_type(config.catalog, room_type)
+            intervals = config.get_intervals(room_matching_type)
+
+            if config.auto_prune is not None:
+                curr_date = datetime.date(datetime.now())
+                helpers.prune_intervals(
+                    intervals,
+                    curr_date,
+                    room_matching_type,
+                    config.auto_prune,
+                    config.dirty_intervals,
+                )
+                config.clear_availability()
 
-            available_rooms = helpers.get_room_number_optimized(
-                df_intervals, start, end
-            )
-            delta = end - start
+            best_room = reserve_room(config, client_id, room_type, start, end, repack)
 
-            if available_rooms.empty:
+            if best_room is None:
                 click.echo("Sorry! There are no rooms available!")
             else:
-                best_room = available_rooms["room"][0]
-
-                payment = helpers.get_payment(config.hotel, best_room)
-                payment_due = delta.days * payment
-                paid = False
-
-                helpers.add_reservation_client_list(
-                    config.client_list,
-                    client_id,
-                    2,
-                    start,
-                    end,
-                    best_room,
-                    payment_due,
-                    paid,
-                )
-                helpers.overwrite_client_list(config.client_list, full_path)
-
-                helpers.add_reservations(
-                    config.reservations, best_room, client_id, start
-                )
-                helpers.overwrite_reservations(
-                    config.reservations, config.cwd_path, hotel_path, best_room
-                )
-
-                helpers.add_intervals(
-                    config.intervals, best_room, start, end, hotel_path
-                )
-                helpers.overwrite_intervals(
-                    config.intervals, config.cwd_path, hotel_path, best_room
-                )
-
                 click.echo("Reservation successful!")
         else:
             click.echo(
@@ -321,6 +1441,158 @@ def reserve_dates(config, client_id, room_type, start, end):
         )
 
 
+@cli.command()
+@click.argument("batch_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--order",
+    type=click.Choice(BATCH_ORDERS),
+    default="file",
+    show_default=True,
+    help="Order in which the rows are allocated.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Result file (default: BATCH_FILE with a .result.csv suffix).",
+)
+@click.pass_obj
+def reserve_batch(config, batch_file, order, output):
+    """
+    Reserve rooms for many clients at once.
+
+    Usage:\n
+    hotel reserve-batch batch_file [--order file|start|longest] [--output result.csv]\n
+
+    Arguments:\n
+    batch_file is a *.csv or *.jsonl filepath with client_id, room_type, start and end (format %Y-%m-%d) for each reservation\n
+
+    Description:\n
+    This commmand runs reserve-dates for every row of batch_file in a single process.\n
+    Rows are allocated in file order, by earliest start, or longest stay first (--order).\n
+    The reservations are logged as a single command, once every row has been allocated.\n
+    Writes the reserved room or the rejection reason of each row to the result file, in file order.
+    """
+    import numpy as np
+    import pandas as pd
+    import helpers
+
+    session.handle_session()
+
+    batch = helpers.read_batch(batch_file)
+    if output is None:
+        output = os.path.splitext(batch_file)[0] + ".result.csv"
+
+    if config.auto_prune is not None:
+        curr_date = datetime.date(datetime.now())
+        for room_type in batch["room_type"].dropna().unique():
+            room_matching_type = helpers.get_room_of_type(config.catalog, room_type)
+            helpers.prune_intervals(
+                config.get_intervals(room_matching_type),
+                curr_date,
+                room_matching_type,
+                config.auto_prune,
+                config.dirty_intervals,
+            )
+        config.clear_availability()
+
+    rooms = pd.Series(None, index=batch.index, dtype="object")
+    reasons = pd.Series("", index=batch.index, dtype="object")
+
+    for row in helpers.order_batch(batch, order):
+        client_id, room_type, start, end = batch.loc[row, helpers.BATCH_COLUMNS]
+
+        if pd.isna(client_id) or pd.isna(room_type):
+            reasons[row] = "invalid client_id or room_type"
+        elif pd.isna(start) or pd.isna(end) or end < start:
+            reasons[row] = "invalid dates"
+        elif client_id not in config.client_list.index:
+            reasons[row] = "unknown client"
+        elif config.client_list.loc[client_id, "state"] != 3:
+            reasons[row] = "client unable to accept a new reservation"
+        else:
+            best_room = reserve_room(config, int(client_id), room_type, start, end)
+            if best_room is None:
+                reasons[row] = "no rooms available"
+            else:
+                rooms[row] = best_room
+
+    # Reservations are persisted before they are reported
+    config.commit(command_line())
+
+    result = batch.assign(
+        start=batch["start"].dt.strftime("%Y-%m-%d"),
+        end=batch["end"].dt.strftime("%Y-%m-%d"),
+        room=rooms,
+        status=np.where(rooms.notna(), "reserved", "rejected"),
+        reason=reasons,
+    )
+    with helpers.atomic_open(output) as file:
+        result.to_csv(file, index_label="row")
+
+    reserved = int(rooms.notna().sum())
+    click.echo(
+        f"Reserved {reserved} of {len(batch)} reservations. Results written to {output}"
+    )
+
+
+@cli.command()
+@click.option(
+    "--type",
+    "room_types",
+    type=click.INT,
+    multiple=True,
+    help="Room type to repack (repeatable, default: every type).",
+)
+@click.option("--dry-run", is_flag=True, help="Print the moves without making them.")
+@click.pass_obj
+def optimize_rooms(config, room_types, dry_run):
+    """
+    Move reservations between rooms of the same type to join free intervals.
+
+    Usage:\n
+    hotel optimize-rooms [--type N ...] [--dry-run]\n
+
+    Description:\n
+    This commmand re-assigns the reservations which have not started yet (state = 2, start after today), one room type at a time.\n
+    Reservations are swept by start date and each goes to the room it leaves the smallest gap in.\n
+    The new assignment is only kept if it leaves fewer free intervals, or as many but longer ones.\n
+    Prints every reservation which changes rooms; payment_due is left as it was agreed.
+    """
+    import helpers
+
+    session.handle_session()
+
+    if not room_types:
+        room_types = helpers.get_room_types(config.catalog)
+
+    curr_date = datetime.date(datetime.now())
+    for room_type in room_types:
+        rooms = helpers.get_room_of_type(config.catalog, room_type)
+        before = helpers.free_runs(config.get_intervals(rooms), rooms, curr_date)
+
+        plan = plan_repack(config, room_type)
+        if plan is not None:
+            bookings, assigned, new_intervals = plan
+            after = helpers.free_runs(new_intervals, rooms, curr_date)
+        if plan is None or not helpers.better_packed(after, before):
+            click.echo(
+                f"Room type {room_type}: already packed ({len(before)} free intervals)"
+            )
+            continue
+
+        moved = bookings.index[assigned != bookings["room"]]
+        for client_id in moved:
+            click.echo(
+                f"Client {client_id}: room {bookings.loc[client_id, 'room']} -> {assigned[client_id]}"
+            )
+        if not dry_run:
+            apply_repack(config, *plan)
+
+        click.echo(
+            f"Room type {room_type}: moved {len(moved)} reservations, free intervals {len(before)} -> {len(after)}"
+        )
+
+
 @cli.command()
 @click.argument("client_id", type=click.INT)
 @click.pass_obj
@@ -340,29 +1612,37 @@ def delete_reservation(config, client_id):
     Updates client_list.csv with new informtion
 
     """
-    helpers.handle_session()
+    import helpers
+
+    session.handle_session()
 
     if client_id in config.client_list.index:
 
         if config.client_list.loc[client_id, "state"] == 2:
-            hotel_path = helpers.get_hotel_path()
-            full_path = os.path.join(config.cwd_path, hotel_path)
-
             res_start = config.client_list.loc[client_id, "start"]
             res_end = config.client_list.loc[client_id, "end"]
             room_number = config.client_list.loc[client_id, "reserved_room"]
 
-            helpers.remove_reservation_client_list(config.client_list, client_id)
-            helpers.overwrite_client_list(config.client_list, full_path)
+            helpers.remove_reservation_client_list(
+                config.client_list,
+                client_id,
+                config.dirty_clients,
+                config.built_lookup(),
+            )
 
-            helpers.remove_reservations(config.reservations, res_start)
-            helpers.overwrite_reservations(
-                config.reservations, config.cwd_path, hotel_path, room_number
+            reservations = config.get_reservations([room_number])
+            helpers.remove_reservations(
+                reservations, res_start, room_number, config.dirty_reservations
             )
 
-            helpers.remove_intervals(config.intervals, res_start, res_end, room_number)
-            helpers.overwrite_intervals(
-                config.intervals, config.cwd_path, hotel_path, room_number
+            intervals = config.get_intervals([room_number])
+            helpers.remove_intervals(
+                intervals,
+                res_start,
+                res_end,
+                room_number,
+                config.room_availability(room_number),
+                config.dirty_intervals,
             )
 
             click.echo("The reservation has been deleted.")
@@ -394,24 +1674,27 @@ def check_in(config, client_id):
     State = 1
 
     """
-    helpers.handle_session()
+    import helpers
+
+    session.handle_session()
 
     if client_id in config.client_list.index:
 
         if config.client_list.loc[client_id, "state"] == 2:
 
-            hotel_path = helpers.get_hotel_path()
-            full_path = os.path.join(config.cwd_path, hotel_path)
-
             res_start = config.client_list.loc[client_id, "start"]
             room_number = config.client_list.loc[client_id, "reserved_room"]
 
-            helpers.checkin_client_list(config.client_list, client_id)
-            helpers.overwrite_client_list(config.client_list, full_path)
+            helpers.checkin_client_list(
+                config.client_list,
+                client_id,
+                config.dirty_clients,
+                config.built_lookup(),
+            )
 
-            helpers.pop_reservation(config.reservations, res_start, room_number)
-            helpers.overwrite_reservations(
-                config.reservations, config.cwd_path, hotel_path, room_number
+            reservations = config.get_reservations([room_number])
+            helpers.pop_reservation(
+                reservations, res_start, room_number, config.dirty_reservations
             )
             click.echo("You are now checked in!")
         else:
@@ -440,19 +1723,25 @@ def check_out(config, client_id, paid):
     paid is stype BOOL\n
 
     Description:\n
-    This commmand updates client_list.csv with new informtion, state = 3
+    This commmand updates client_list.csv with new informtion, state = 3\n
+    The stay is moved to the archive of past stays (see history)
     """
-    helpers.handle_session()
+    import helpers
+
+    session.handle_session()
 
     if client_id in config.client_list.index:
 
         if config.client_list.loc[client_id, "state"] == 1:
 
-            hotel_path = helpers.get_hotel_path()
-            full_path = os.path.join(config.cwd_path, hotel_path)
-
-            helpers.checkout_client_list(config.client_list, client_id, paid)
-            helpers.overwrite_client_list(config.client_list, full_path)
+            helpers.checkout_client_list(
+                config.client_list,
+                client_id,
+                paid,
+                config.dirty_clients,
+                config.built_lookup(),
+                config.past_stays,
+            )
 
             click.echo("You are now checked out!")
 
@@ -482,11 +1771,20 @@ def get_one_client(config, client_id):
     Description:\n
     This commmand prints the info of client_id from client_list.csv
     """
-    helpers.handle_session()
+    import pandas as pd
+    import helpers
+
+    session.handle_session()
 
     if client_id in config.client_list.index:
 
-        client_info = config.client_list.iloc[client_id]
+        client_info = config.client_list.iloc[client_id].copy()
+        # Dates without their midnight time, as in client_list.csv
+        for column in ["start", "end"]:
+            if not pd.isna(client_info[column]):
+                client_info[column] = client_info[column].strftime(
+                    helpers.CLIENT_DATE_FORMAT
+                )
         click.echo(client_info)
 
     else:
@@ -497,50 +1795,100 @@ def get_one_client(config, client_id):
 
 @cli.command()
 @click.argument("state", type=click.INT)
+@client_output_options
 @click.pass_obj
-def get_some_clients(config, state):
+def get_some_clients(config, state, limit, offset, columns, output_format):
     """
     Print clients with state = state.
 
     Usage:\n
-    hotel get-some-clients state\n
+    hotel get-some-clients state [--limit N] [--offset N] [--columns state,start,...] [--format table|csv|jsonl]\n
 
     Arguments:\n
     state is type INT\n
 
     Description:\n
     This commmand prints the info of clients (based on state values) from client_list.csv\n
+    Clients are printed by chunks as they are rendered, from the --offset-th one and at most --limit of them\n
 
     States:\n
-    registered client = 1\n
+    client while checked-in = 1\n
     client with reservation = 2\n
-    client while checked-in = 3
+    registered or checked-out client = 3
+    """
+    session.handle_session()
+    echo_clients(
+        config.client_list,
+        config.clients_with_state(state),
+        columns,
+        output_format,
+        limit,
+        offset,
+    )
+
+
+@cli.command()
+@click.argument("date", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.pass_obj
+def arrivals(config, date):
+    """
+    Print clients arriving on a date.
+
+    Usage:\n
+    hotel arrivals date\n
+
+    Arguments:\n
+    date is format %Y-%m-%d\n
+
+    Description:\n
+    This commmand prints the info of clients whose reservation or stay starts on date, from client_list.csv\n
+    Clients already checked in (state = 1) are listed along with reserved ones (state = 2)
+    """
+    session.handle_session()
+    click.echo(config.client_list.loc[config.clients_on("start", date)])
+
+
+@cli.command()
+@click.argument("date", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.pass_obj
+def departures(config, date):
+    """
+    Print clients departing on a date.
+
+    Usage:\n
+    hotel departures date\n
+
+    Arguments:\n
+    date is format %Y-%m-%d\n
+
+    Description:\n
+    This commmand prints the info of clients whose reservation or stay ends on date, from client_list.csv\n
+    Checked-out clients no longer have dates and are not listed
     """
-    helpers.handle_session()
-    curr_clients = config.client_list.loc[config.client_list["state"] == state]
-    click.echo(curr_clients)
+    session.handle_session()
+    click.echo(config.client_list.loc[config.clients_on("end", date)])
 
 
 @cli.command()
+@client_output_options
 @click.pass_obj
-def get_all_clients(config):
+def get_all_clients(config, limit, offset, columns, output_format):
     """
     Print all clients in client_list.
 
     Usage:\n
-    hotel get-all-clients\n
+    hotel get-all-clients [--limit N] [--offset N] [--columns state,start,...] [--format table|csv|jsonl]\n
 
     Arguments:\n
     None\n
 
     Description:\n
     This commmand prints the info of all clients from client_list.csv\n
+    Clients are printed by chunks as they are rendered, from the --offset-th one and at most --limit of them\n
 
     """
-
-    helpers.handle_session()
-    with pd.option_context("display.max_rows", None, "display.max_columns", None):
-        click.echo(config.client_list)
+    session.handle_session()
+    echo_clients(config.client_list, None, columns, output_format, limit, offset)
 
 
 @cli.command()
@@ -561,63 +1909,341 @@ def get_client_id(config, name, email):
     Description:\n
     This commmand prints the client ID from client_supp.csv
     """
-    helpers.handle_session()
+    import helpers
+
+    session.handle_session()
 
-    id_list = helpers.unique_client(config.client_supp, name, email)
-    if id_list.empty:
+    client_id = helpers.unique_client(config.client_index, name, email)
+    if client_id is None:
         click.echo(
             f"The name: {name} and email: {email} does not match any known client ID"
         )
 
     else:
-        client_id = int(id_list.squeeze())
         click.echo(f"The client ID for {name} is {client_id}")
 
 
-# @cli.command()
-# @click.pass_obj
-# def undo_last_command():
-#     """
-#     Prev command stored in sessions.csv
-#     """
-#     click.echo('Hello World!')
+@cli.command()
+@click.argument("start", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.argument("end", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option(
+    "--type",
+    "room_types",
+    type=click.INT,
+    multiple=True,
+    help="Room type to report (repeatable, default: every type).",
+)
+@click.option(
+    "--occupied", is_flag=True, help="Count occupied rooms instead of free rooms."
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "csv", "json"]),
+    default="table",
+    show_default=True,
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Write to this file instead of printing.",
+)
+@click.pass_obj
+def availability(config, start, end, room_types, occupied, output_format, output):
+    """
+    Print the number of free rooms of each type for every night of a date range.
+
+    Usage:\n
+    hotel availability start_date end_date [--type N ...] [--occupied] [--format table|csv|json] [--output FILE]\n
+
+    Arguments:\n
+    start_date is format %Y-%m-%d\n
+    end_date is format %Y-%m-%d, included\n
+
+    Description:\n
+    This commmand prints a nights x room types matrix of the rooms with a free interval covering each night.\n
+    A reservation holds its room from its start to its end date included, so its end date is not free although hotel report does not count it as sold.\n
+    It only reads rooms/intervals/*.csv; nothing is reserved or written.
+    """
+    import numpy as np
+    import pandas as pd
+    import helpers
+
+    session.handle_session()
+
+    if end < start:
+        raise click.BadParameter("end_date is before start_date")
+
+    if not room_types:
+        room_types = helpers.get_room_types(config.catalog)
+
+    nights = pd.date_range(start, end, freq="D", name="night")
+    counts = {}
+    for room_type in room_types:
+        free = config.get_availability(room_type).free_nights(start, end)
+        if occupied:
+            free = len(helpers.get_room_of_type(config.catalog, room_type)) - free
+        counts[room_type] = free
+
+    matrix = pd.DataFrame(
+        counts, index=nights, columns=list(room_types), dtype=np.int64
+    )
+    matrix.columns.name = "room_type"
+    matrix.index = matrix.index.strftime("%Y-%m-%d").rename("night")
+
+    echo_matrix(matrix, output_format, output, "Availability")
+
+
+@cli.command()
+@click.argument("metric", type=click.Choice(REPORT_METRICS))
+@click.argument("start", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.argument("end", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option(
+    "--type",
+    "room_types",
+    type=click.INT,
+    multiple=True,
+    help="Room type to report (repeatable, default: every type).",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "csv", "json"]),
+    default="table",
+    show_default=True,
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Write to this file instead of printing.",
+)
+@click.pass_obj
+def report(config, metric, start, end, room_types, output_format, output):
+    """
+    Print occupancy, revenue, ADR or RevPAR of each room type for every night of a date range.
+
+    Usage:\n
+    hotel report occupancy|revenue|adr|revpar start_date end_date [--type N ...] [--format table|csv|json] [--output FILE]\n
+
+    Arguments:\n
+    start_date is format %Y-%m-%d\n
+    end_date is format %Y-%m-%d, included\n
+
+    Description:\n
+    occupancy is the share of rooms sold, revenue the sum of the nightly rates (payment_due / nights),\n
+    adr the revenue per room sold and revpar the revenue per available room.\n
+    A stay sells the nights from its start to the night before its end, as charged by payment_due; hotel availability still counts its room as taken on its end date.\n
+    Reserved and checked in clients of client_list are counted; nothing is written but report_cache.pkl.
+    """
+    import helpers
+
+    session.handle_session()
+
+    if end < start:
+        raise click.BadParameter("end_date is before start_date")
+
+    sold, revenue = config.get_sales(start, end)
+    matrix = helpers.sales_metric(sold, revenue, config.catalog, metric)
+
+    if room_types:
+        unknown = [t for t in room_types if t not in matrix.columns]
+        if unknown:
+            raise click.BadParameter(
+                f"unknown room type: {', '.join(map(str, unknown))}"
+            )
+        matrix = matrix[list(room_types)]
+
+    matrix.columns.name = "room_type"
+    matrix.index = matrix.index.strftime("%Y-%m-%d").rename("night")
+
+    echo_matrix(matrix, output_format, output, "Report")
+
+
+def describe_record(record):
+    """
+    Command line of a record of the operation log, for hotel undo and hotel redo.
+    """
+    if not record.get("command"):
+        return f"change {record['seq']}"
+    return " ".join(["hotel"] + record["command"])
+
+
+@cli.command()
+@click.pass_obj
+def undo(config):
+    """
+    Undo the last command which changed the hotel.
+
+    Usage:\n
+    hotel undo\n
+
+    Arguments:\n
+    None\n
+
+    Description:\n
+    This commmand puts the clients and rooms changed by the last command back as they were before it, from the operation log (data/hotel_*/oplog.jsonl).\n
+    Run it again to undo the command before, up to the last 100 commands. hotel redo undoes an undo, until another command changes the hotel.\n
+    register cannot be undone, as client ids are never reused, nor a check-out once hotel checkpoint has archived its stay.
+    """
+    session.handle_session()
+
+    done, undone = config.oplog.stacks()
+    record = config.oplog.find(done[-1]) if done else None
+    if record is None:
+        click.echo("Nothing to undo.")
+        return
+
+    if record.get("supp"):
+        click.echo(
+            f"{describe_record(record)} registered clients and cannot be undone."
+        )
+        raise click.Abort()
+    if record.get("stays") and record["seq"] <= config.oplog.checkpoint:
+        click.echo(
+            f"{describe_record(record)} cannot be undone: its stays are archived."
+        )
+        raise click.Abort()
+
+    config.apply_record(record, undo=True)
+    config.commit(command_line(), undo=record["seq"])
+    click.echo(f"Undid {describe_record(record)}")
+
+
+@cli.command()
+@click.pass_obj
+def redo(config):
+    """
+    Redo the last command undone.
+
+    Usage:\n
+    hotel redo\n
+
+    Arguments:\n
+    None\n
+
+    Description:\n
+    This commmand applies the changes of the last command undone by hotel undo again.\n
+    Commands can be redone in the reverse order of their undo, until another command changes the hotel.
+    """
+    session.handle_session()
+
+    done, undone = config.oplog.stacks()
+    record = config.oplog.find(undone[-1]) if undone else None
+    if record is None:
+        click.echo("Nothing to redo.")
+        return
+
+    # Stays of a check-out undone before the last checkpoint were left out of the archive
+    if record.get("stays") and record["seq"] <= config.oplog.checkpoint:
+        click.echo(
+            f"{describe_record(record)} cannot be redone: it was undone before the last checkpoint."
+        )
+        raise click.Abort()
+
+    config.apply_record(record)
+    config.commit(command_line(), redo=record["seq"])
+    click.echo(f"Redid {describe_record(record)}")
 
 
 @cli.command()
 @click.pass_obj
-def clear_cache(config):
+def checkpoint(config):
     """
-    Clear Intervals which have expired. 
+    Write the changes of the operation log to the tables.
 
     Usage:\n
-    hotel clear-cache\n
+    hotel checkpoint\n
 
     Arguments:\n
     None\n
 
     Description:\n
-    This commmand removes intervals where intv_end < current_date.\n 
-    Run if reserve_dates() is slow.
+    Commands which change the hotel append a record to data/hotel_*/oplog.jsonl and leave the tables as they are; every command replays the records on top of the tables it reads.\n
+    This commmand writes the clients, rooms and archived stays of the records since the last checkpoint to the tables, as is done every 100 commands and by hotel quit.
     """
-    helpers.handle_session()
+    session.handle_session()
+
+    pending = len(config.oplog.tail)
+    config.flush(checkpoint=True)
+    click.echo(f"Wrote the changes of {pending} commands to the tables.")
+
+
+@cli.command()
+@click.option(
+    "--threshold",
+    type=click.INT,
+    default=0,
+    help="Only prune rooms with more than THRESHOLD expired intervals.",
+)
+@click.pass_obj
+def clear_cache(config, threshold):
+    """
+    Clear Intervals which have expired.
+
+    Usage:\n
+    hotel clear-cache [--threshold N]\n
+
+    Arguments:\n
+    None\n
 
-    df = config.intervals.stack().swaplevel(0, 1).reset_index()
-    df.columns = ["room", "start", "end"]
+    Description:\n
+    This commmand removes intervals where intv_end < current_date.\n
+    Only the rooms/intervals/{room}.csv files of rooms which had expired intervals are rewritten.\n
+    Prints the number of intervals removed from each room.\n
+    Use hotel --auto-prune N to prune automatically during reserve-dates.
+    """
+    import helpers
+
+    session.handle_session()
+
+    intervals = config.get_intervals()
     curr_date = datetime.date(datetime.now())
+    removed = helpers.prune_intervals(
+        intervals, curr_date, threshold=threshold, dirty=config.dirty_intervals
+    )
 
-    def clear(x):
-        if x["end"].date() < curr_date:
-            return pd.Series(data=[None, None, None], index=x.index)
-        else:
-            return x
+    for room, count in removed.items():
+        click.echo(f"Room {room}: removed {count} expired intervals")
+
+    config.clear_availability()
+    click.echo(f"Removed {removed.sum()} expired intervals from {removed.size} rooms.")
+
+
+@cli.command()
+@click.argument("start", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.argument("end", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--client", "client_ids", type=click.INT, multiple=True)
+@click.option("--room", "rooms", type=click.INT, multiple=True)
+@client_output_options
+@click.pass_obj
+def history(
+    config, start, end, client_ids, rooms, limit, offset, columns, output_format
+):
+    """
+    Print past stays from the archive.
+
+    Usage:\n
+    hotel history start_date end_date [--client ID ...] [--room N ...] [--limit N] [--offset N] [--columns ...] [--format table|csv|jsonl]\n
+
+    Arguments:\n
+    start_date is format %Y-%m-%d\n
+    end_date is format %Y-%m-%d\n
+
+    Description:\n
+    This commmand prints the stays checked out from the hotel which overlap start_date .. end_date, by end date\n
+    Stays (client_id, room, start, end, payment_due, paid, checked_out) are archived by check-out in archive/stays-{month}.csv.gz\n
+    Only the months holding stays of the date range are read
+    """
+    session.handle_session()
 
-    config.intervals = df.apply(clear, axis=1).dropna()
+    if end < start:
+        raise click.BadParameter("end_date is before start_date")
 
+    stays = config.get_past_stays(start, end)
+    if client_ids:
+        stays = stays[stays["client_id"].isin(client_ids)]
+    if rooms:
+        stays = stays[stays["room"].isin(rooms)]
 
-# @cli.command()
-# @click.pass_obj
-# def read_glacial_file():
-#     """
-#     Stores client previous stay data (start, end, payment_due, paid, prev_room)
-#     """
-#     click.echo('Hello World!')
+    stays = stays.set_index("client_id")
+    echo_clients(stays, None, columns, output_format, limit, offset)
@@ -0,0 +1,122 @@
+from bisect import bisect_left, insort
+import numpy as np
+import pandas as pd
+from availability import DAY_OFFSET, to_days
+
+# Date keys pack (day, client_id) into one int64: days since epoch shifted to be
+# non-negative in the high bits, client id in the low bits, so the clients of a
+# day are a contiguous, id-ordered run of the sorted keys.
+CLIENT_BITS = 40
+CLIENT_MASK = (1 << CLIENT_BITS) - 1
+
+
+class ClientLookup(object):
+    """
+    Secondary indexes of client_list: the client ids of each state, and the start and
+    end dates of every reservation or stay as sorted arrays.
+
+    get-some-clients reads the ids of a state instead of scanning every client, and
+    arrivals and departures find the clients of a date with two binary searches. The
+    indexes are built from client_list and saved next to it (storage.CLIENT_LOOKUP_FILE)
+    by each checkpoint which changes clients; a command loads them and sets the clients
+    changed since (see Config.lookup). Within a command, and across the commands of
+    hotel serve, the helpers which change the state or dates of a client keep them up to
+    date (add_reservation_client_list, ...).
+    """
+
+    def __init__(self):
+        # Sorted list of the client ids of each state
+        self.ids_of_state = {}
+        # Current state, start day and end day of each client, None when it has no dates
+        self.state_of = {}
+        self.start_of = {}
+        self.end_of = {}
+
+        self.start_keys = np.empty(0, np.int64)
+        self.end_keys = np.empty(0, np.int64)
+
+    @classmethod
+    def from_client_list(cls, client_list):
+        lookup = cls()
+
+        ids = client_list.index.to_numpy(np.int64)
+        states = client_list["state"].to_numpy(np.int64)
+        for state in np.unique(states):
+            lookup.ids_of_state[int(state)] = np.sort(ids[states == state]).tolist()
+        lookup.state_of = dict(zip(ids.tolist(), states.tolist()))
+
+        dated = client_list["start"].notna().to_numpy()
+        starts = to_days(client_list["start"][dated])
+        ends = to_days(client_list["end"][dated])
+        lookup.start_of = dict(zip(ids[dated].tolist(), starts.tolist()))
+        lookup.end_of = dict(zip(ids[dated].tolist(), ends.tolist()))
+
+        lookup.start_keys = np.sort(lookup._key(starts, ids[dated]))
+        lookup.end_keys = np.sort(lookup._key(ends, ids[dated]))
+
+        return lookup
+
+    def _key(self, day, client_id):
+        return ((day + DAY_OFFSET) << CLIENT_BITS) | client_id
+
+    def set(self, client_id, state, start=None, end=None):
+        """
+        Records the new state and dates of a client (start and end are None once they are cleared).
+        """
+        client_id = int(client_id)
+        old_state = self.state_of.get(client_id)
+        if old_state is not None:
+            ids = self.ids_of_state[old_state]
+            i = bisect_left(ids, client_id)
+            if i < len(ids) and ids[i] == client_id:
+                del ids[i]
+        insort(self.ids_of_state.setdefault(int(state), []), client_id)
+        self.state_of[client_id] = int(state)
+
+        self.start_keys = self._move(
+            self.start_keys, self.start_of, client_id, self._day(start)
+        )
+        self.end_keys = self._move(
+            self.end_keys, self.end_of, client_id, self._day(end)
+        )
+
+    def _day(self, date):
+        if date is None or pd.isna(date):
+            return None
+        return to_days(date)
+
+    def _move(self, keys, day_of, client_id, day):
+        old_day = day_of.pop(client_id, None)
+        if old_day is not None:
+            i = np.searchsorted(keys, self._key(old_day, client_id))
+            keys = np.delete(keys, i)
+
+        if day is not None:
+            day_of[client_id] = day
+            key = self._key(day, client_id)
+            keys = np.insert(keys, np.searchsorted(keys, key), key)
+
+        return keys
+
+    def with_state(self, state):
+        """
+        Client ids with state, in order.
+        """
+        return list(self.ids_of_state.get(int(state), ()))
+
+    def _on(self, keys, date):
+        day = to_days(date)
+        lo, hi = np.searchsorted(keys, [self._key(day, 0), self._key(day + 1, 0)])
+        return (keys[lo:hi] & CLIENT_MASK).tolist()
+
+    def arrivals(self, date):
+        """
+        Client ids whose reservation or stay starts on date, in order.
+        """
+        return self._on(self.start_keys, date)
+
+    def departures(self, date):
+        """
+        Client ids whose reservation or stay ends on date, in order.
+        """
+        return self._on(self.end_keys, date)
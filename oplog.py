@@ -0,0 +1,360 @@
+import os
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import helpers
+import archive
+
+# Write-ahead log of a hotel, data/hotel_*/oplog.jsonl. Every command which changes the
+# hotel appends one record to it (and fsyncs it) before anything else is written, so a
+# command is durable as soon as its record is. The tables themselves are only rewritten
+# by a checkpoint, once CHECKPOINT_RECORDS records have piled up (or on hotel quit,
+# hotel checkpoint and when hotel serve stops), and every Config replays the records
+# written since the last checkpoint on top of the tables it loads.
+#
+# A record holds the before and after images of what the command changed: the rows of
+# the clients, new client_supp rows, the entries of the rooms (only those which changed)
+# and the stays archived by check-out. Replaying the after images is idempotent, so a
+# checkpoint interrupted half-way is simply replayed again, and the before images are
+# what hotel undo puts back.
+#
+# The file is JSON lines: records, then a {"checkpoint": seq} line once every record up
+# to seq is in the tables. A checkpoint rewrites the file keeping the last UNDO_DEPTH
+# records, which hotel undo and hotel redo can still walk through.
+LOG_FILE = "oplog.jsonl"
+CHECKPOINT_RECORDS = 100
+UNDO_DEPTH = 100
+
+CLIENT_COLUMNS = list(helpers.CLIENT_LIST_DTYPES)
+# End of the interval of a room which has never been reserved (see helpers.room_intervals())
+OPEN_END = pd.Timestamp(pd.Timestamp.max.date()).strftime(helpers.CLIENT_DATE_FORMAT)
+
+
+def log_path(full_path):
+    return os.path.join(full_path, LOG_FILE)
+
+
+def stamp(full_path):
+    """
+    Changes whenever a record is appended or a checkpoint is taken, for the report cache.
+    """
+    fp = log_path(full_path)
+    if not os.path.isfile(fp):
+        return ()
+
+    stat = os.stat(fp)
+    return ((stat.st_mtime_ns, stat.st_size),)
+
+
+def _value(value):
+    """
+    JSON value of a table cell: dates as %Y-%m-%d, missing values as None.
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    elif isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime(helpers.CLIENT_DATE_FORMAT)
+    elif hasattr(value, "item"):
+        return value.item()
+
+    return value
+
+
+def client_image(client_list, client_id):
+    row = client_list.loc[client_id]
+    return {column: _value(row[column]) for column in CLIENT_COLUMNS}
+
+
+def client_frame(images):
+    """
+    Typed client_list rows (see helpers.typed_client_list()) of {client_id: image}.
+    """
+    frame = pd.DataFrame.from_dict(images, orient="index", columns=CLIENT_COLUMNS)
+    frame.index = frame.index.astype(np.int64).rename("client_id")
+    for column in ["start", "end"]:
+        frame[column] = pd.to_datetime(frame[column], format=helpers.CLIENT_DATE_FORMAT)
+
+    return helpers.typed_client_list(frame)
+
+
+def apply_clients(client_list, images):
+    """
+    Sets the rows of {client_id: image} in client_list, adding the clients it does not hold.
+
+    Return:
+    client_list, updated in place unless clients were added
+    """
+    if not images:
+        return client_list
+
+    frame = client_frame(images)
+    known = frame.index.isin(client_list.index)
+    if known.any():
+        client_list.loc[frame.index[known]] = frame[known]
+    if not known.all():
+        client_list = helpers.add_client_list(client_list, frame[~known])
+
+    return client_list
+
+
+def apply_supp(client_supp, images):
+    """
+    Adds the client_supp rows of {client_id: {"name": ..., "email": ...}} missing from client_supp.
+    """
+    new_ids = [client_id for client_id in images if client_id not in client_supp.index]
+    if not new_ids:
+        return client_supp
+
+    frame = pd.DataFrame.from_dict(
+        {client_id: images[client_id] for client_id in new_ids},
+        orient="index",
+        columns=["name", "email"],
+    )
+    frame.index = frame.index.astype(np.int64).rename("client_id")
+
+    return helpers.add_client_supp(client_supp, frame)
+
+
+def room_image(series):
+    """
+    {start: value} of the entries of a room, dates as %Y-%m-%d.
+    """
+    return {_value(start): _value(value) for start, value in series.dropna().items()}
+
+
+def room_change(before, after):
+    """
+    Change of a room from the pd.Series() before to the one after, None if it did not change.
+
+    Only the entries which differ are kept, except for a room which was free from its
+    first day onwards: helpers.room_intervals() makes that interval start on the day the
+    room is read, so it is replaced as a whole rather than patched.
+    """
+    before, after = room_image(before), room_image(after)
+    if before == after:
+        return None
+
+    if list(before.values()) == [OPEN_END]:
+        return {"before": before, "after": after, "full": True}
+
+    return {
+        "before": {k: v for k, v in before.items() if after.get(k) != v},
+        "after": {k: v for k, v in after.items() if before.get(k) != v},
+        "full": False,
+    }
+
+
+def apply_room(series, change, undo=False):
+    """
+    The room pd.Series() once change (see room_change()) is applied, or reverted if undo.
+    """
+    if undo:
+        old, new = change["after"], change["before"]
+    else:
+        old, new = change["before"], change["after"]
+
+    if change["full"]:
+        image = dict(new)
+    else:
+        image = room_image(series)
+        for start in old:
+            image.pop(start, None)
+        image.update(new)
+
+    index = pd.DatetimeIndex(
+        pd.to_datetime(list(image), format=helpers.CLIENT_DATE_FORMAT)
+    )
+    if series.dtype.kind == "M":
+        values = pd.to_datetime(list(image.values()), format=helpers.CLIENT_DATE_FORMAT)
+        values = np.asarray(values, dtype="datetime64[ns]")
+    else:
+        values = np.asarray(list(image.values()), dtype=series.dtype)
+
+    return pd.Series(values, index=index, name=series.name).sort_index()
+
+
+def stay_rows(stays):
+    return [
+        {column: _value(value) for column, value in row.items()}
+        for row in stays[list(archive.STAY_DTYPES)].to_dict("records")
+    ]
+
+
+def stays_frame(rows):
+    if not rows:
+        return archive.empty()
+
+    stays = pd.DataFrame(rows, columns=list(archive.STAY_DTYPES))
+    for column in archive.DATE_COLUMNS:
+        stays[column] = pd.to_datetime(stays[column], format=helpers.CLIENT_DATE_FORMAT)
+
+    return stays.astype(archive.STAY_DTYPES)
+
+
+class OpLog(object):
+    """
+    Records of oplog.jsonl, and the seq of the last one written to the tables.
+    """
+
+    def __init__(self, full_path, checkpoint=0, records=None):
+        self.full_path = full_path
+        self.checkpoint = checkpoint
+        self.records = [] if records is None else records
+
+    @classmethod
+    def read(cls, full_path):
+        oplog = cls(full_path)
+        fp = log_path(full_path)
+        if not os.path.isfile(fp):
+            return oplog
+
+        with open(fp) as in_file:
+            for line in in_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write of a command which never completed
+                    continue
+                if "checkpoint" in entry:
+                    oplog.checkpoint = entry["checkpoint"]
+                else:
+                    oplog.records.append(entry)
+
+        return oplog
+
+    @property
+    def tail(self):
+        """
+        Records which are not in the tables yet, in order.
+        """
+        return [r for r in self.records if r["seq"] > self.checkpoint]
+
+    def next_seq(self):
+        last = self.records[-1]["seq"] if self.records else 0
+        return max(last, self.checkpoint) + 1
+
+    def append(self, record):
+        """
+        Numbers record and appends it to the log, returning once it is on disk.
+        """
+        record = dict(
+            seq=self.next_seq(),
+            time=datetime.now().isoformat(timespec="seconds"),
+            **record,
+        )
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+
+        with open(log_path(self.full_path), "a") as out_file:
+            if out_file.tell() > 0 and not self._ends_with_newline():
+                out_file.write("\n")
+            out_file.write(line)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+        self.records.append(record)
+        return record
+
+    def _ends_with_newline(self):
+        with open(log_path(self.full_path), "rb") as in_file:
+            in_file.seek(-1, os.SEEK_END)
+            return in_file.read(1) == b"\n"
+
+    def write_checkpoint(self):
+        """
+        Marks every record as written to the tables, dropping all but the last UNDO_DEPTH.
+        """
+        self.checkpoint = self.next_seq() - 1
+        self.records = self.records[-UNDO_DEPTH:]
+
+        with helpers.atomic_open(log_path(self.full_path)) as out_file:
+            for record in self.records:
+                out_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            out_file.write(json.dumps({"checkpoint": self.checkpoint}) + "\n")
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+    def find(self, seq):
+        for record in self.records:
+            if record["seq"] == seq:
+                return record
+
+        return None
+
+    def stacks(self):
+        """
+        (done, undone): seqs of the commands hotel undo and hotel redo would take, last one last.
+
+        A record tagged "undo" moves the last done command to undone, one tagged "redo"
+        moves it back, and any other command makes the undone ones unreachable.
+        """
+        done, undone = [], []
+        for record in self.records:
+            if "undo" in record:
+                if done and done[-1] == record["undo"]:
+                    undone.append(done.pop())
+            elif "redo" in record:
+                if undone and undone[-1] == record["redo"]:
+                    done.append(undone.pop())
+            else:
+                done.append(record["seq"])
+                undone = []
+
+        return done, undone
+
+    def registered(self):
+        """
+        {client_id: {"name": ..., "email": ...}} of the clients registered since the last checkpoint.
+        """
+        return {
+            int(client_id): supp
+            for record in self.tail
+            for client_id, supp in record.get("supp", [])
+        }
+
+    def pending_stays(self):
+        """
+        Stays of the check-outs since the last checkpoint which have not been undone.
+        """
+        done = set(self.stacks()[0])
+        rows = [
+            row
+            for record in self.tail
+            if record["seq"] in done
+            for row in record.get("stays", [])
+        ]
+
+        return stays_frame(rows)
+
+    def touched(self):
+        """
+        (client ids, reservation rooms, interval rooms) changed since the last checkpoint.
+        """
+        clients, reservations, intervals = set(), set(), set()
+        for record in self.tail:
+            clients.update(int(c[0]) for c in record.get("clients", []))
+            reservations.update(int(r[0]) for r in record.get("reservations", []))
+            intervals.update(int(r[0]) for r in record.get("intervals", []))
+
+        return clients, reservations, intervals
+
+    def client_images(self):
+        """
+        {client_id: image} of the clients changed since the last checkpoint, as they are now.
+        """
+        return {
+            int(client_id): after
+            for record in self.tail
+            for client_id, before, after in record.get("clients", [])
+        }
+
+    def room_changes(self, table):
+        """
+        {room: [change, ...]} of the reservations or intervals (table) changed since the last checkpoint, in order.
+        """
+        changes = {}
+        for record in self.tail:
+            for room, change in record.get(table, []):
+                changes.setdefault(int(room), []).append(change)
+
+        return changes
@@ -0,0 +1,102 @@
+import numpy as np
+from availability import DAY_BITS, DAY_OFFSET
+
+# Room assignment over integer days (see availability.to_days()). Rooms are codes
+# 0 .. num_rooms - 1 and every array of intervals is sorted by (code, start).
+#
+# A reservation [s, e] placed in a free interval [a, b] leaves [a, s - 1] and
+# [e + 1, b] free, and only fits if a < s and e < b, as in split_interval().
+
+
+def merge_segments(codes, starts, ends):
+    """
+    Joins the intervals of each room which follow each other (next start == end + 1).
+
+    Arguments:
+    codes, starts, ends are np.array() of int64, sorted by (code, start)
+
+    Return:
+    (codes, starts, ends) of the merged segments
+    """
+    if codes.size == 0:
+        return codes, starts, ends
+
+    begin = np.ones(codes.size, bool)
+    begin[1:] = (codes[1:] != codes[:-1]) | (starts[1:] != ends[:-1] + 1)
+    last = np.append(begin[1:], True)
+
+    return codes[begin], starts[begin], ends[last]
+
+
+def assign(seg_codes, seg_starts, seg_ends, num_rooms, starts, ends):
+    """
+    Places every reservation in a free segment, sweeping them by start.
+
+    Arguments:
+    seg_codes, seg_starts, seg_ends are the free segments, sorted by (code, start)
+    num_rooms is type INT
+    starts, ends are np.array() of int64, one reservation each
+
+    Return:
+    np.array() with the room code of each reservation, None if one of them does not fit
+
+    Description:
+    Reservations are taken by start, so everything before the start of a reservation has
+    already been decided: the room to pick is the one it leaves the smallest gap in, after
+    the free segment start or the last reservation placed in the room. Ties go to the room
+    whose segment ends soonest, then to the lowest code, which keeps long free runs intact.
+    Each step is a single searchsorted over every room, as in AvailabilityIndex.query().
+    """
+    keys = (seg_codes << DAY_BITS) | (seg_starts + DAY_OFFSET)
+    codes = np.arange(num_rooms, dtype=np.int64)
+    # Last day taken by a reservation placed in each room so far
+    cursor = np.full(num_rooms, np.iinfo(np.int64).min // 2)
+    result = np.full(starts.size, -1, np.int64)
+
+    if keys.size == 0:
+        return result if starts.size == 0 else None
+
+    for i in np.lexsort((ends, starts)):
+        start, end = starts[i], ends[i]
+
+        pos = np.searchsorted(keys, (codes << DAY_BITS) | (start + DAY_OFFSET)) - 1
+        found = pos >= 0
+        pos = np.where(found, pos, 0)
+        first = np.maximum(seg_starts[pos], cursor + 1)
+
+        found &= seg_codes[pos] == codes
+        found &= seg_ends[pos] > end
+        found &= first < start
+        if not found.any():
+            return None
+
+        candidates = codes[found]
+        left = start - first[found]
+        right = seg_ends[pos][found] - end
+        best = candidates[np.lexsort((candidates, right, left))[0]]
+
+        result[i] = best
+        cursor[best] = end
+
+    return result
+
+
+def split_segments(seg_codes, seg_starts, seg_ends, codes, starts, ends):
+    """
+    Free intervals left in the segments once the reservations are placed.
+
+    Within a room, pieces are disjoint and ordered: each reservation [s, e] ends a piece
+    at s - 1 and starts the next one at e + 1. The k-th smallest start of a room therefore
+    pairs with its k-th smallest end, and two sorts give every piece at once.
+
+    Return:
+    (codes, starts, ends) sorted by (code, start)
+    """
+    piece_codes = np.concatenate([seg_codes, codes])
+    piece_starts = np.concatenate([seg_starts, ends + 1])
+    piece_ends = np.concatenate([seg_ends, starts - 1])
+
+    by_start = np.lexsort((piece_starts, piece_codes))
+    by_end = np.lexsort((piece_ends, piece_codes))
+
+    return piece_codes[by_start], piece_starts[by_start], piece_ends[by_end]
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import time
+import contextlib
+from datetime import datetime
+import click
+
+# Timings of the command being run with hotel --profile. Code which may be slow wraps
+# itself in phase(), which does nothing unless a command is being profiled.
+_current = None
+
+
+class Profile(object):
+    """
+    Phase timings of one hotel command.
+
+    Phases are named after what they do ("load client_list", "write intervals/12", ...).
+    A phase entered several times (one room file after another) adds up, and phases may
+    nest, so "command" includes the tables the command loads lazily.
+    """
+
+    def __init__(self):
+        # Filled in once the command line has been parsed
+        self.command = None
+        self.args = []
+        self.hotel_path = None
+        self.phases = {}
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def record(self, status):
+        """
+        The structured log line of the command, as a dict.
+        """
+        return {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "pid": os.getpid(),
+            "command": self.command,
+            "args": self.args,
+            "hotel": self.hotel_path,
+            "status": status,
+            "total": round(time.perf_counter() - self.started, 6),
+            "phases": {name: round(t, 6) for name, t in self.phases.items()},
+        }
+
+
+def active():
+    return _current is not None
+
+
+def current():
+    return _current
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Times a phase of the command being profiled.
+    """
+    if _current is None:
+        yield
+        return
+
+    with _current.phase(name):
+        yield
+
+
+@contextlib.contextmanager
+def profile(log_file=None, stats_file=None):
+    """
+    Profiles the command run inside the block.
+
+    Arguments:
+    log_file is the file the log line is appended to (stderr if None)
+    stats_file is the file cProfile stats are dumped to, for python -m pstats (none if None).
+        Commands run by hotel serve are not profiled again inside a profiled serve.
+
+    Description:
+    One JSON line is written per command, whether it succeeds or fails, so the lines of a
+    day can be aggregated into latency percentiles per command and phase.
+    """
+    global _current
+
+    previous = _current
+    _current = Profile()
+
+    profiler = None
+    if stats_file is not None and previous is None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    status = "error"
+    try:
+        yield _current
+        status = "ok"
+    except click.exceptions.Exit as e:
+        # hotel serve forwarding, or ctx.exit() in a command
+        status = "ok" if e.exit_code == 0 else f"exit {e.exit_code}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(stats_file)
+
+        line = json.dumps(_current.record(status))
+        if log_file is None:
+            sys.stderr.write(line + "\n")
+        else:
+            with open(log_file, "a") as out_file:
+                out_file.write(line + "\n")
+
+        _current = previous
@@ -0,0 +1,264 @@
+import os
+import io
+import json
+import time
+import signal
+import socket
+import socketserver
+import contextlib
+import traceback
+import click
+
+SOCKET_FILE = "hotel.sock"
+
+# Output of a forwarded command is sent back in pieces of about this many characters,
+# so a long listing is never held whole by the daemon or the client
+REPLY_CHUNK = 1 << 16
+
+# Commands which run inside hotel serve when it is running for the hotel of the session
+FORWARDED_COMMANDS = {
+    "register",
+    "reserve-dates",
+    "reserve-batch",
+    "optimize-rooms",
+    "delete-reservation",
+    "check-in",
+    "check-out",
+    "get-one-client",
+    "get-some-clients",
+    "get-all-clients",
+    "get-client-id",
+    "arrivals",
+    "departures",
+    "history",
+    "availability",
+    "report",
+    "clear-cache",
+    "undo",
+    "redo",
+    "checkpoint",
+}
+
+
+def socket_path(full_path):
+    return os.path.join(full_path, SOCKET_FILE)
+
+
+def _request(full_path, message, write=None):
+    """
+    Sends one JSON message to the daemon of the hotel and waits for its reply.
+
+    Arguments:
+    full_path is the hotel directory
+    message is type dict
+    write is called with each piece of output the daemon sends ahead of its reply (optional,
+        the pieces are joined to the output of the reply otherwise)
+
+    Return:
+    The reply (dict), None if no daemon is listening
+    """
+    path = socket_path(full_path)
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        sock.close()
+        return None
+
+    pieces = []
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps(message).encode() + b"\n")
+        stream.flush()
+
+        while True:
+            line = stream.readline()
+            if not line:
+                raise click.ClickException("hotel serve closed the connection.")
+
+            reply = json.loads(line)
+            if "exit_code" in reply:
+                break
+            if write is None:
+                pieces.append(reply["output"])
+            else:
+                write(reply["output"])
+
+    if pieces:
+        reply["output"] = "".join(pieces) + reply["output"]
+
+    return reply
+
+
+def is_running(full_path):
+    return _request(full_path, {"ping": True}) is not None
+
+
+def forward(full_path, args, write=None):
+    """
+    Runs a command in the daemon of the hotel.
+
+    Arguments:
+    full_path is the hotel directory
+    args is the command line of the command (e.g. ["check-in", "2"])
+    write is called with the output of the command as it arrives (optional); only the
+        output which has not been written yet is returned then
+
+    Return:
+    (output, exit_code) of the command, None if no daemon is running
+    """
+    reply = _request(full_path, {"args": list(args)}, write)
+    if reply is None:
+        return None
+
+    return reply["output"], reply["exit_code"]
+
+
+def stop(full_path):
+    """
+    Asks the daemon of the hotel to write its pending changes and exit.
+    Returns False if no daemon was running.
+    """
+    return _request(full_path, {"shutdown": True}) is not None
+
+
+class ReplyStream(io.StringIO):
+    """
+    Output of a command run by the daemon, sent to the client in pieces as it is written.
+    getvalue() is the output written since the last piece was sent.
+    """
+
+    def __init__(self, send=None):
+        super().__init__()
+        self.send = send
+
+    def write(self, text):
+        written = super().write(text)
+        if self.send is not None and self.tell() >= REPLY_CHUNK:
+            self.send(self.getvalue())
+            self.seek(0)
+            self.truncate()
+        return written
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def send(self, reply):
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        message = json.loads(line)
+        if message.get("shutdown"):
+            self.server.stopped = True
+            reply = {"output": "", "exit_code": 0}
+        elif "args" in message:
+            output, exit_code = self.server.run(
+                message["args"], lambda text: self.send({"output": text})
+            )
+            reply = {"output": output, "exit_code": exit_code}
+        else:
+            reply = {"output": "", "exit_code": 0}
+
+        self.send(reply)
+
+
+class HotelServer(socketserver.UnixStreamServer):
+    """
+    Serves the commands of one hotel from a Config kept in memory.
+
+    Requests are handled one at a time, so commands never interleave. Every command
+    is logged to the operation log as soon as it completes (see oplog.py), and the
+    tables are written behind: a due checkpoint is taken once flush_interval seconds
+    have passed, and a checkpoint is always taken when the server stops. A command
+    which fails is not logged, and the Config reads the hotel again after it.
+    """
+
+    def __init__(self, cli, config, flush_interval):
+        self.cli = cli
+        self.config = config
+        self.flush_interval = flush_interval
+        self.stopped = False
+        self.timeout = flush_interval or None
+
+        path = socket_path(config.full_path)
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, RequestHandler)
+
+    def run(self, args, send=None):
+        """
+        Runs a command against the in-memory Config.
+
+        Arguments:
+        args is the command line of the command
+        send is called with pieces of the output while the command runs (optional)
+
+        Return:
+        (output, exit_code) of the command, the output not sent yet
+        """
+        output = ReplyStream(send)
+        failed = True
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                result = self.cli.main(
+                    args, prog_name="hotel", standalone_mode=False, obj=self.config
+                )
+                exit_code = result if isinstance(result, int) else 0
+                failed = False
+            except click.UsageError as e:
+                # Raised on the command line or its parameters, before any table changed
+                e.show()
+                exit_code = e.exit_code
+                failed = False
+            except click.ClickException as e:
+                e.show()
+                exit_code = e.exit_code
+            except click.Abort:
+                click.echo("Aborted!", err=True)
+                exit_code = 1
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+
+        if failed:
+            # The command was not logged, so whatever it changed in memory must not be
+            # logged by the next command either
+            self.config.discard()
+            self.config.load()
+
+        return output.getvalue(), exit_code
+
+    def serve(self):
+        last_flush = time.monotonic()
+        try:
+            while not self.stopped:
+                self.handle_request()
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    self.config.flush()
+                    last_flush = time.monotonic()
+        finally:
+            self.config.flush(checkpoint=True)
+            self.server_close()
+            os.remove(socket_path(self.config.full_path))
+
+
+def serve(cli, config, flush_interval=1.0):
+    """
+    Runs the daemon of a hotel until it is stopped (hotel quit, SIGTERM or Ctrl-C).
+    """
+    config.write_behind = True
+    server = HotelServer(cli, config, flush_interval)
+
+    def terminate(signum, frame):
+        server.stopped = True
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,50 @@
+import os
+import fcntl
+import contextlib
+import click
+
+# Advisory locks of a hotel directory. Commands which change the hotel hold WRITE_LOCK
+# from the moment they load it until their changes are flushed, so two desks never
+# overwrite each other's updates. Flushing also takes FLUSH_LOCK, which read-only
+# commands share, so they never read a hotel half-way through a flush.
+WRITE_LOCK = "write.lock"
+FLUSH_LOCK = "flush.lock"
+
+
+def handle_session(allow_hotel=True):
+    """
+    Aborts unless there is a session, or a hotel was given with hotel --hotel (allow_hotel).
+    """
+    ctx = click.get_current_context(silent=True)
+    if allow_hotel and ctx is not None and ctx.find_root().obj is not None:
+        return
+
+    if not os.path.exists("session.csv"):
+        click.echo("No current session.")
+        raise click.Abort()
+
+
+def create_temp(hotel_name):
+    hotel_dir = "data/hotel_" + hotel_name + "\n"
+    with open("session.csv", "w") as out_file:
+        out_file.write(hotel_dir)
+
+
+def get_hotel_path():
+    with open("session.csv", "r") as fp:
+        line = fp.readline().rstrip()
+
+    return line
+
+
+@contextlib.contextmanager
+def lock_hotel(full_path, lock_file, exclusive=True):
+    """
+    Holds a shared or exclusive flock() on data/hotel_*/{lock_file}, waiting for it if needed.
+    """
+    with open(os.path.join(full_path, lock_file), "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
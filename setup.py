@@ -3,7 +3,21 @@ from setuptools import setup
 setup(
     name="hotel",
     version="1.0",
-    py_modules=["hotel"],
+    py_modules=[
+        "hotel",
+        "helpers",
+        "storage",
+        "availability",
+        "archive",
+        "catalog",
+        "lookup",
+        "oplog",
+        "packing",
+        "profiling",
+        "server",
+        "session",
+        "snapshot",
+    ],
     install_requires=["Click", "pandas", "numpy", "jsonschema"],
     entry_points="""
 		[console_scripts]
@@ -0,0 +1,188 @@
+import os
+
+# Binary copies of the csv files of a hotel under data/hotel_*/snapshot, one .npy
+# structured array per csv. A snapshot is only used while it is newer than its csv
+# files, so the csv files stay the source of truth and can still be edited by hand.
+#
+# numpy and pandas are imported by the functions which need them: checking whether a
+# snapshot is fresh (hotel quit) only needs os.stat.
+SNAPSHOT_DIR = "snapshot"
+
+# Same dtypes as helpers.CLIENT_LIST_DTYPES, with -1 for missing rooms and NaT for missing dates
+CLIENT_LIST_FIELDS = [
+    ("client_id", "<i8"),
+    ("state", "<i1"),
+    ("start", "<M8[ns]"),
+    ("end", "<M8[ns]"),
+    ("reserved_room", "<i4"),
+    ("payment_due", "<f8"),
+    ("paid", "?"),
+    ("curr_room", "<i4"),
+]
+
+
+def sources(full_path, name):
+    """
+    The csv files a snapshot is built from.
+
+    Arguments:
+    full_path is the hotel directory
+    name is client_list, client_supp, reservations/{room} or intervals/{room}
+    """
+    if name in ("client_list", "client_supp"):
+        fp = os.path.join(full_path, name + ".csv")
+        return [fp, fp + ".journal"]
+
+    return [os.path.join(full_path, "rooms", name + ".csv")]
+
+
+def snapshot_path(full_path, name):
+    return os.path.join(full_path, SNAPSHOT_DIR, name + ".npy")
+
+
+def is_fresh(full_path, name):
+    """
+    True if the snapshot exists and is newer than each of its csv files.
+    """
+    try:
+        stamp = os.stat(snapshot_path(full_path, name)).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+    for fp in sources(full_path, name):
+        if os.path.isfile(fp) and os.stat(fp).st_mtime_ns > stamp:
+            return False
+
+    return True
+
+
+def names(full_path):
+    """
+    Every snapshot of a hotel, from the csv files it has.
+    """
+    result = []
+    for name in ["client_list", "client_supp"]:
+        if os.path.isfile(sources(full_path, name)[0]):
+            result.append(name)
+
+    for table in ["reservations", "intervals"]:
+        for file in sorted(os.listdir(os.path.join(full_path, "rooms", table))):
+            result.append(table + "/" + os.path.splitext(file)[0])
+
+    return result
+
+
+def stale(full_path):
+    return [name for name in names(full_path) if not is_fresh(full_path, name)]
+
+
+def load(full_path, name):
+    """
+    Memory maps a snapshot, None if it is missing or older than its csv files.
+    The mapping is copy-on-write: commands change the arrays in place without touching the file.
+    """
+    import numpy as np
+
+    if not is_fresh(full_path, name):
+        return None
+
+    return np.load(snapshot_path(full_path, name), mmap_mode="c")
+
+
+def save(full_path, name, array):
+    import numpy as np
+    import helpers
+
+    fp = snapshot_path(full_path, name)
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    with helpers.atomic_open(fp, "wb") as out_file:
+        np.save(out_file, array)
+
+
+def from_client_list(client_list):
+    import numpy as np
+    import helpers
+
+    client_list = helpers.typed_client_list(client_list)
+
+    array = np.empty(client_list.index.size, CLIENT_LIST_FIELDS)
+    array["client_id"] = client_list.index.values
+    for field, dtype in CLIENT_LIST_FIELDS[1:]:
+        column = client_list[field]
+        if field in ("reserved_room", "curr_room"):
+            array[field] = column.to_numpy(dtype, na_value=-1)
+        else:
+            array[field] = column.values
+
+    return array
+
+
+def to_client_list(array):
+    import numpy as np
+    import pandas as pd
+    import helpers
+
+    columns = {}
+    for field in array.dtype.names[1:]:
+        values = array[field]
+        if values.dtype.kind == "U":
+            # Snapshot saved while dates were kept as strings
+            values = np.where(values == "", np.nan, values.astype(object))
+        columns[field] = values
+
+    index = pd.Index(array["client_id"], name="client_id")
+
+    return helpers.typed_client_list(pd.DataFrame(columns, index=index))
+
+
+def from_client_supp(client_supp):
+    import numpy as np
+
+    name = client_supp["name"].values.astype(str)
+    email = client_supp["email"].values.astype(str)
+    fields = [
+        ("client_id", "<i8"),
+        ("name", name.dtype if name.size else "<U1"),
+        ("email", email.dtype if email.size else "<U1"),
+    ]
+
+    array = np.empty(client_supp.index.size, fields)
+    array["client_id"] = client_supp.index.values
+    array["name"] = name
+    array["email"] = email
+
+    return array
+
+
+def to_client_supp(array):
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            "name": array["name"].astype(object),
+            "email": array["email"].astype(object),
+        },
+        index=pd.Index(array["client_id"], name="client_id"),
+    )
+
+
+def from_room(series, value_dtype):
+    """
+    Structured (start, value) array of the rows a room file holds.
+    """
+    import numpy as np
+
+    series = series.dropna()
+    array = np.empty(series.size, [("start", "<M8[ns]"), ("value", value_dtype)])
+    array["start"] = series.index.values
+    array["value"] = series.values
+
+    return array
+
+
+def to_room(array, room):
+    import pandas as pd
+
+    index = pd.DatetimeIndex(array["start"])
+
+    return pd.Series(array["value"], index=index, name=int(room))
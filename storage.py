@@ -0,0 +1,643 @@
+import os
+import pickle
+import sqlite3
+import contextlib
+import pandas as pd
+import helpers
+import snapshot
+
+DB_FILE = "hotel.db"
+CLIENT_INDEX_FILE = "client_index.pkl"
+# lookup.ClientLookup of client_list, valid for as long as client_list_stamp() is unchanged
+CLIENT_LOOKUP_FILE = "client_lookup.pkl"
+
+# New clients are appended to <table>.csv.journal and folded back into <table>.csv
+# once the journal holds this many rows (or whenever the table is rewritten anyway)
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_MAX_ROWS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS client_list (
+    client_id INTEGER PRIMARY KEY,
+    state INTEGER NOT NULL,
+    start TEXT,
+    "end" TEXT,
+    reserved_room INTEGER,
+    payment_due REAL,
+    paid INTEGER,
+    curr_room INTEGER
+);
+CREATE INDEX IF NOT EXISTS client_list_state ON client_list (state);
+
+CREATE TABLE IF NOT EXISTS client_supp (
+    client_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS client_supp_name_email ON client_supp (name, email);
+
+CREATE TABLE IF NOT EXISTS reservations (
+    room INTEGER NOT NULL,
+    start TEXT NOT NULL,
+    client_id INTEGER NOT NULL,
+    PRIMARY KEY (room, start)
+);
+
+CREATE TABLE IF NOT EXISTS intervals (
+    room INTEGER NOT NULL,
+    start TEXT NOT NULL,
+    "end" TEXT NOT NULL,
+    PRIMARY KEY (room, start)
+);
+"""
+
+CLIENT_LIST_COLUMNS = [
+    "state",
+    "start",
+    "end",
+    "reserved_room",
+    "payment_due",
+    "paid",
+    "curr_room",
+]
+CLIENT_SUPP_COLUMNS = ["name", "email"]
+
+
+def _load_stamped(fp, stamp):
+    """
+    Object pickled by _dump_stamped() with stamp, None if it is missing or has another stamp.
+    """
+    if not os.path.isfile(fp):
+        return None
+
+    with open(fp, "rb") as in_file:
+        try:
+            if pickle.load(in_file) != stamp:
+                return None
+            return pickle.load(in_file)
+        except (ValueError, EOFError, pickle.UnpicklingError):
+            return None
+
+
+def _dump_stamped(fp, stamp, obj):
+    with helpers.atomic_open(fp, "wb") as out_file:
+        pickle.dump(stamp, out_file)
+        pickle.dump(obj, out_file, pickle.HIGHEST_PROTOCOL)
+
+
+def open_storage(cwd_path, hotel_path):
+    """
+    Picks the storage backend of a hotel: hotel.db if it has been migrated, csv files otherwise.
+    """
+    full_path = os.path.join(cwd_path, hotel_path)
+    if os.path.isfile(os.path.join(full_path, DB_FILE)):
+        return SqliteStorage(full_path)
+
+    return CsvStorage(cwd_path, hotel_path)
+
+
+class CsvStorage(object):
+    """
+    Original layout: client_list.csv, client_supp.csv and one csv per room under
+    rooms/reservations and rooms/intervals. Every write rewrites the whole file,
+    except new clients which are appended to a journal.
+
+    Each write also saves a binary snapshot of the file (see snapshot.py), which
+    reads use instead of parsing the csv for as long as it is newer than the csv.
+    """
+
+    def __init__(self, cwd_path, hotel_path):
+        self.cwd_path = cwd_path
+        self.hotel_path = hotel_path
+        self.full_path = os.path.join(cwd_path, hotel_path)
+        self.num_clients = None
+
+    def read_client_list(self):
+        array = snapshot.load(self.full_path, "client_list")
+        if array is not None:
+            return snapshot.to_client_list(array)
+
+        # Nullable Int32 columns parse slowly and dates are faster to parse with their
+        # format, so typed_client_list() converts both once the file is read
+        dtypes = {
+            column: object if dtype.startswith("datetime") else dtype
+            for column, dtype in helpers.CLIENT_LIST_DTYPES.items()
+            if not dtype.startswith("Int")
+        }
+        client_list = self._read_clients("client_list.csv", dtypes)
+
+        return helpers.typed_client_list(client_list)
+
+    def read_client_supp(self):
+        array = snapshot.load(self.full_path, "client_supp")
+        if array is not None:
+            client_supp = snapshot.to_client_supp(array)
+        else:
+            client_supp = self._read_clients("client_supp.csv")
+        self.num_clients = client_supp.index.size
+
+        return client_supp
+
+    def _read_clients(self, file_name, dtypes=None):
+        """
+        Replays the journal on top of the base csv.
+        """
+        fp = os.path.join(self.full_path, file_name)
+        clients = pd.read_csv(fp, index_col="client_id", dtype=dtypes)
+
+        journal = self._read_journal(file_name, dtypes)
+        if journal is not None:
+            clients = pd.concat([clients, journal])
+
+        return clients
+
+    def _read_journal(self, file_name, dtypes=None):
+        """
+        Client rows of the journal of file_name, None if there is no journal.
+        """
+        fp = os.path.join(self.full_path, file_name + JOURNAL_SUFFIX)
+        if not os.path.isfile(fp):
+            return None
+
+        return pd.read_csv(fp, index_col="client_id", dtype=dtypes)
+
+    def _journal_rows(self, file_name):
+        fp = os.path.join(self.full_path, file_name + JOURNAL_SUFFIX)
+        if not os.path.isfile(fp):
+            return 0
+
+        with open(fp) as in_file:
+            return sum(1 for line in in_file) - 1
+
+    def read_client_index(self):
+        """
+        Loads the persisted (name, email) -> client_id index of client_supp.csv and adds
+        the clients of its journal to it. The persisted index is rebuilt if missing or
+        older than client_supp.csv.
+        """
+        fp = os.path.join(self.full_path, CLIENT_INDEX_FILE)
+
+        if os.path.isfile(fp):
+            with open(fp, "rb") as in_file:
+                num_base = self._client_index_header(in_file)
+                if num_base is not None:
+                    client_index = pickle.load(in_file)
+                    journal = self._read_journal("client_supp.csv")
+                    if journal is not None:
+                        client_index.update(helpers.build_client_index(journal))
+                    self.num_clients = num_base + self._journal_rows("client_supp.csv")
+                    return client_index
+
+        client_supp = self.read_client_supp()
+        num_base = client_supp.index.size - self._journal_rows("client_supp.csv")
+        self._dump_client_index(client_supp.iloc[:num_base])
+
+        return helpers.build_client_index(client_supp)
+
+    def _client_index_header(self, in_file):
+        """
+        Number of clients in client_supp.csv if the index pickled in in_file is up to date with it, None otherwise.
+        """
+        try:
+            stamp, num_base = pickle.load(in_file)
+        except (ValueError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if stamp != self._stamp("client_supp.csv", journal=False):
+            return None
+
+        return num_base
+
+    def _dump_client_index(self, client_supp):
+        """
+        Persists the index of client_supp, the rows of client_supp.csv without its journal.
+        A header comes first so that next_client_id() can check it without loading the index.
+        """
+        fp = os.path.join(self.full_path, CLIENT_INDEX_FILE)
+        with helpers.atomic_open(fp, "wb") as out_file:
+            header = (
+                self._stamp("client_supp.csv", journal=False),
+                client_supp.index.size,
+            )
+            pickle.dump(header, out_file)
+            pickle.dump(helpers.build_client_index(client_supp), out_file)
+
+    def read_client_lookup(self):
+        fp = os.path.join(self.full_path, CLIENT_LOOKUP_FILE)
+        return _load_stamped(fp, self.client_list_stamp())
+
+    def write_client_lookup(self, lookup):
+        fp = os.path.join(self.full_path, CLIENT_LOOKUP_FILE)
+        _dump_stamped(fp, self.client_list_stamp(), lookup)
+
+    def client_list_stamp(self):
+        """
+        Changes whenever client_list.csv or its journal is written.
+        """
+        return self._stamp("client_list.csv")
+
+    def _stamp(self, file_name, journal=True):
+        stamp = []
+        fp = os.path.join(self.full_path, file_name)
+
+        for file in [fp, fp + JOURNAL_SUFFIX] if journal else [fp]:
+            if os.path.isfile(file):
+                stat = os.stat(file)
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+
+        return tuple(stamp)
+
+    def next_client_id(self):
+        if self.num_clients is None:
+            num_base = None
+            fp = os.path.join(self.full_path, CLIENT_INDEX_FILE)
+            if os.path.isfile(fp):
+                with open(fp, "rb") as in_file:
+                    num_base = self._client_index_header(in_file)
+
+            if num_base is None:
+                self.read_client_index()
+            else:
+                self.num_clients = num_base + self._journal_rows("client_supp.csv")
+
+        return self.num_clients
+
+    def append_client_list(self, new_list):
+        self._append_clients(new_list, "client_list.csv")
+
+    def append_client_supp(self, new_supp):
+        self._append_clients(new_supp, "client_supp.csv")
+        self.num_clients += new_supp.index.size
+
+    def _append_clients(self, new_clients, file_name):
+        """
+        Appends new client rows to the journal, compacting it into the base csv when it is full.
+        """
+        fp = os.path.join(self.full_path, file_name + JOURNAL_SUFFIX)
+        new_journal = not os.path.isfile(fp)
+
+        with open(fp, "a") as out_file:
+            new_clients.to_csv(
+                out_file, header=new_journal, date_format=helpers.CLIENT_DATE_FORMAT
+            )
+
+        if self._journal_rows(file_name) >= JOURNAL_MAX_ROWS:
+            self.compact(file_name)
+
+    def compact(self, file_name):
+        """
+        Folds the journal of client_list.csv or client_supp.csv into the base csv.
+        """
+        clients = self._read_clients(file_name)
+        with helpers.atomic_open(os.path.join(self.full_path, file_name)) as out_file:
+            clients.rename_axis("client_id").to_csv(out_file)
+        self._drop_journal(file_name)
+
+        if file_name == "client_supp.csv":
+            self._dump_client_index(clients)
+
+    def _drop_journal(self, file_name):
+        fp = os.path.join(self.full_path, file_name + JOURNAL_SUFFIX)
+        if os.path.isfile(fp):
+            os.remove(fp)
+
+    def read_reservations(self, rooms):
+        fp = os.path.join(self.full_path, "rooms/reservations")
+        reservations = {}
+        missing = []
+
+        for room in rooms:
+            array = snapshot.load(self.full_path, f"reservations/{room}")
+            if array is None:
+                missing.append(room)
+            else:
+                reservations[int(room)] = snapshot.to_room(array, room)
+
+        if missing:
+            reservations.update(helpers.get_reservations(fp, missing))
+
+        return reservations
+
+    def read_intervals(self, rooms):
+        fp = os.path.join(self.full_path, "rooms/intervals")
+        intervals = {}
+        missing = []
+
+        for room in rooms:
+            array = snapshot.load(self.full_path, f"intervals/{room}")
+            if array is None:
+                missing.append(room)
+            elif array.size == 0:
+                # Never reserved: free from today, as for an empty csv
+                empty = pd.DataFrame(columns=["start", "end"])
+                intervals[int(room)] = helpers.room_intervals(empty, room)
+            else:
+                intervals[int(room)] = snapshot.to_room(array, room)
+
+        if missing:
+            intervals.update(helpers.get_intervals(fp, missing))
+
+        return intervals
+
+    def write_client_list(self, client_list, client_ids):
+        helpers.overwrite_client_list(client_list, self.full_path)
+        self._drop_journal("client_list.csv")
+        snapshot.save(
+            self.full_path, "client_list", snapshot.from_client_list(client_list)
+        )
+
+    def write_reservations(self, reservations, room_number):
+        helpers.overwrite_reservations(
+            reservations, self.cwd_path, self.hotel_path, room_number
+        )
+        array = snapshot.from_room(reservations[int(room_number)], "<i8")
+        snapshot.save(self.full_path, f"reservations/{room_number}", array)
+
+    def write_intervals(self, intervals, room_number):
+        helpers.overwrite_intervals(
+            intervals, self.cwd_path, self.hotel_path, room_number
+        )
+        array = snapshot.from_room(intervals[int(room_number)], "<M8[ns]")
+        snapshot.save(self.full_path, f"intervals/{room_number}", array)
+
+    def write_snapshot(self):
+        """
+        Saves the snapshots which are missing or older than their csv files.
+        """
+        for name in snapshot.stale(self.full_path):
+            if name == "client_list":
+                array = snapshot.from_client_list(self.read_client_list())
+            elif name == "client_supp":
+                array = snapshot.from_client_supp(self.read_client_supp())
+            else:
+                table, room = name.split("/")
+                room = int(room)
+                if table == "reservations":
+                    reservations = self.read_reservations([room])
+                    array = snapshot.from_room(reservations[room], "<i8")
+                else:
+                    # Empty like the csv of a room which has never been reserved,
+                    # rather than the interval from today read_intervals() fills in
+                    df = pd.read_csv(snapshot.sources(self.full_path, name)[0])
+                    if df.empty or df.isnull().values.any():
+                        series = pd.Series(dtype="datetime64[ns]")
+                    else:
+                        series = helpers.room_intervals(df, room)
+                    array = snapshot.from_room(series, "<M8[ns]")
+
+            snapshot.save(self.full_path, name, array)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+class SqliteStorage(object):
+    """
+    Single file backend (hotel.db). Tables are indexed, writes only touch the rows
+    that changed and a transaction commits or rolls back every table at once.
+    """
+
+    def __init__(self, full_path):
+        self.full_path = full_path
+        self.conn = sqlite3.connect(os.path.join(full_path, DB_FILE))
+        self.conn.executescript(SCHEMA)
+
+    def read_client_list(self):
+        client_list = pd.read_sql_query(
+            "SELECT * FROM client_list ORDER BY client_id",
+            self.conn,
+            index_col="client_id",
+        )
+
+        return helpers.typed_client_list(client_list)
+
+    def read_client_supp(self):
+        return pd.read_sql_query(
+            "SELECT * FROM client_supp ORDER BY client_id",
+            self.conn,
+            index_col="client_id",
+        )
+
+    def read_client_index(self):
+        return SqliteClientIndex(self.conn)
+
+    def read_client_lookup(self):
+        fp = os.path.join(self.full_path, CLIENT_LOOKUP_FILE)
+        return _load_stamped(fp, self.client_list_stamp())
+
+    def write_client_lookup(self, lookup):
+        fp = os.path.join(self.full_path, CLIENT_LOOKUP_FILE)
+        _dump_stamped(fp, self.client_list_stamp(), lookup)
+
+    def client_list_stamp(self):
+        """
+        Changes whenever hotel.db is written, which covers client_list and more.
+        """
+        stat = os.stat(os.path.join(self.full_path, DB_FILE))
+        return ((stat.st_mtime_ns, stat.st_size),)
+
+    def next_client_id(self):
+        (next_id,) = self.conn.execute(
+            "SELECT COALESCE(MAX(client_id) + 1, 0) FROM client_supp"
+        ).fetchone()
+
+        return next_id
+
+    def append_client_list(self, new_list):
+        self.write_client_list(new_list, new_list.index)
+
+    def append_client_supp(self, new_supp):
+        self.write_client_supp(new_supp, new_supp.index)
+
+    def read_reservations(self, rooms):
+        df = self._read_rooms("reservations", "client_id", rooms)
+        groups = dict(list(df.groupby("room")))
+        reservations = {}
+
+        for room in rooms:
+            room_df = groups.get(int(room), df.iloc[:0])
+            reservations[int(room)] = helpers.room_reservations(room_df, room)
+
+        return reservations
+
+    def read_intervals(self, rooms):
+        df = self._read_rooms("intervals", '"end"', rooms)
+        groups = dict(list(df.groupby("room")))
+        intervals = {}
+
+        for room in rooms:
+            room_df = groups.get(int(room), df.iloc[:0])
+            intervals[int(room)] = helpers.room_intervals(
+                room_df[["start", "end"]], room
+            )
+
+        return intervals
+
+    def _read_rooms(self, table, column, rooms):
+        placeholders = ",".join("?" * len(rooms))
+        query = (
+            f"SELECT room, start, {column} FROM {table} "
+            f"WHERE room IN ({placeholders}) ORDER BY room, start"
+        )
+        return pd.read_sql_query(query, self.conn, params=[int(r) for r in rooms])
+
+    def write_client_list(self, client_list, client_ids):
+        client_list = helpers.typed_client_list(client_list)
+        rows = [
+            [int(client_id)]
+            + [
+                _sql_value(client_list.loc[client_id, column])
+                for column in CLIENT_LIST_COLUMNS
+            ]
+            for client_id in client_ids
+        ]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO client_list "
+            '(client_id, state, start, "end", reserved_room, payment_due, paid, curr_room) '
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def write_client_supp(self, client_supp, client_ids):
+        rows = [
+            [int(client_id)]
+            + [
+                _sql_value(client_supp.loc[client_id, column])
+                for column in CLIENT_SUPP_COLUMNS
+            ]
+            for client_id in client_ids
+        ]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO client_supp (client_id, name, email) VALUES (?, ?, ?)",
+            rows,
+        )
+
+    def write_reservations(self, reservations, room_number):
+        self._write_room(
+            "reservations", "client_id", reservations[int(room_number)], room_number
+        )
+
+    def write_intervals(self, intervals, room_number):
+        self._write_room("intervals", '"end"', intervals[int(room_number)], room_number)
+
+    def _write_room(self, table, column, series, room_number):
+        """
+        Diffs the room column against its rows in the table and only writes the difference.
+        """
+        room = int(room_number)
+        new_rows = {
+            _sql_value(start): _sql_value(value)
+            for start, value in series.dropna().items()
+        }
+        old_rows = dict(
+            self.conn.execute(
+                f"SELECT start, {column} FROM {table} WHERE room = ?", (room,)
+            ).fetchall()
+        )
+
+        removed = [
+            (room, start)
+            for start, value in old_rows.items()
+            if new_rows.get(start) != value
+        ]
+        added = [
+            (room, start, value)
+            for start, value in new_rows.items()
+            if old_rows.get(start) != value
+        ]
+
+        self.conn.executemany(
+            f"DELETE FROM {table} WHERE room = ? AND start = ?", removed
+        )
+        self.conn.executemany(
+            f"INSERT INTO {table} (room, start, {column}) VALUES (?, ?, ?)", added
+        )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.conn:
+            yield
+
+
+class SqliteClientIndex(object):
+    """
+    (name, email) -> client_id lookups answered by the client_supp_name_email index of hotel.db.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        # Clients registered since the index was read, which hotel.db only holds once
+        # a checkpoint inserts them
+        self.pending = {}
+
+    def get(self, key, default=None):
+        if key in self.pending:
+            return self.pending[key]
+
+        row = self.conn.execute(
+            "SELECT client_id FROM client_supp WHERE name = ? AND email = ?", key
+        ).fetchone()
+
+        return default if row is None else row[0]
+
+    def __setitem__(self, key, client_id):
+        # The row itself is inserted by SqliteStorage.append_client_supp at the next checkpoint
+        self.pending[key] = client_id
+
+
+def _sql_value(value):
+    if value is None or (not isinstance(value, str) and pd.isnull(value)):
+        return None
+    elif isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    elif hasattr(value, "isoformat"):
+        return value.isoformat()
+    elif hasattr(value, "item"):
+        return value.item()
+
+    return value
+
+
+def migrate(cwd_path, hotel_path):
+    """
+    Imports the csv files of an existing hotel directory into a new hotel.db.
+    The csv files are left untouched but are no longer read or written afterwards.
+    """
+    full_path = os.path.join(cwd_path, hotel_path)
+    csv_store = CsvStorage(cwd_path, hotel_path)
+    client_list = csv_store.read_client_list()
+    client_supp = csv_store.read_client_supp()
+
+    db = SqliteStorage(full_path)
+    try:
+        with db.transaction():
+            db.write_client_list(client_list, client_list.index)
+            db.write_client_supp(client_supp, client_supp.index)
+
+            for table, column in [
+                ("reservations", "client_id"),
+                ("intervals", '"end"'),
+            ]:
+                rooms_path = os.path.join(full_path, "rooms", table)
+                for file in os.listdir(rooms_path):
+                    room = int(os.path.splitext(file)[0])
+                    df = pd.read_csv(os.path.join(rooms_path, file)).dropna()
+                    df["start"] = pd.to_datetime(df["start"])
+                    if table == "intervals":
+                        df["end"] = pd.to_datetime(df["end"])
+                    db.conn.executemany(
+                        f"INSERT INTO {table} (room, start, {column}) VALUES (?, ?, ?)",
+                        [
+                            (room, _sql_value(start), _sql_value(value))
+                            for start, value in df.itertuples(index=False)
+                        ],
+                    )
+    except Exception:
+        db.conn.close()
+        os.remove(os.path.join(full_path, DB_FILE))
+        raise
+
+    db.conn.close()
+
+    return client_list.index.size
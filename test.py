@@ -2,8 +2,35 @@ import unittest
 import pandas as pd
 import numpy as np
 import datetime
-from helpers import get_room_number_optimized
-from pandas._testing import assert_frame_equal
+import tempfile
+import os
+import sys
+import subprocess
+from helpers import get_room_number_optimized, add_intervals, remove_intervals
+from helpers import build_client_index, unique_client, new_client_supp
+from helpers import prune_intervals, read_batch, order_batch
+from helpers import nightly_sales, sales_metric
+from helpers import repack_rooms, free_runs, better_packed
+from helpers import add_reservation_client_list, checkin_client_list
+from helpers import checkout_client_list, remove_reservation_client_list
+from helpers import typed_client_list, CLIENT_LIST_DTYPES
+from availability import AvailabilityIndex
+from catalog import RoomCatalog
+from lookup import ClientLookup
+from storage import CsvStorage, SqliteStorage
+import helpers
+import snapshot
+import archive
+import oplog
+import server
+import session
+import profiling
+import json
+import threading
+import click
+from click.testing import CliRunner
+import hotel
+from pandas._testing import assert_frame_equal, assert_series_equal
 
 
 class Test_get_room_number_optimized(unittest.TestCase):
@@ -41,22 +68,16 @@ class Test_get_room_number_optimized(unittest.TestCase):
             }
         )
 
-        r1 = (
-            r1.set_index(r1["start"]).rename(columns={"end": "1"}).drop("start", axis=1)
-        )
-        r2 = (
-            r2.set_index(r2["start"]).rename(columns={"end": "2"}).drop("start", axis=1)
-        )
-        r3 = (
-            r3.set_index(r3["start"]).rename(columns={"end": "3"}).drop("start", axis=1)
-        )
+        r1 = r1.set_index(r1["start"]).rename(columns={"end": 1}).drop("start", axis=1)
+        r2 = r2.set_index(r2["start"]).rename(columns={"end": 2}).drop("start", axis=1)
+        r3 = r3.set_index(r3["start"]).rename(columns={"end": 3}).drop("start", axis=1)
 
         data = pd.concat([r1, r2, r3], axis=1, sort=False)
 
         start = datetime.datetime(2020, 8, 22)
         end = datetime.datetime(2020, 8, 28)
         result = get_room_number_optimized(data, start, end)
-        answer = pd.DataFrame({"room": ["2", "1", "3"], "order": [2, 6, 7]})
+        answer = pd.DataFrame({"room": [2, 1, 3], "order": [2, 6, 7]})
         # Ignore index values
         # np.array_equal(result.values,answer.values)
         assert_frame_equal(result.reset_index(drop=True), answer.reset_index(drop=True))
@@ -102,21 +123,15 @@ class Test_get_room_number_optimized(unittest.TestCase):
             }
         )
 
-        r1 = (
-            r1.set_index(r1["start"]).rename(columns={"end": "1"}).drop("start", axis=1)
-        )
-        r2 = (
-            r2.set_index(r2["start"]).rename(columns={"end": "2"}).drop("start", axis=1)
-        )
-        r3 = (
-            r3.set_index(r3["start"]).rename(columns={"end": "3"}).drop("start", axis=1)
-        )
+        r1 = r1.set_index(r1["start"]).rename(columns={"end": 1}).drop("start", axis=1)
+        r2 = r2.set_index(r2["start"]).rename(columns={"end": 2}).drop("start", axis=1)
+        r3 = r3.set_index(r3["start"]).rename(columns={"end": 3}).drop("start", axis=1)
 
         data = pd.concat([r1, r2, r3], axis=1, sort=False)
         start = datetime.datetime(2020, 8, 22)
         end = datetime.datetime(2020, 8, 28)
         result = get_room_number_optimized(data, start, end)
-        answer = pd.DataFrame({"room": ["1", "2", "3"], "order": [2, 2, 2]})
+        answer = pd.DataFrame({"room": [1, 2, 3], "order": [2, 2, 2]})
 
         assert_frame_equal(result.reset_index(drop=True), answer.reset_index(drop=True))
 
@@ -143,21 +158,15 @@ class Test_get_room_number_optimized(unittest.TestCase):
             }
         )
 
-        r1 = (
-            r1.set_index(r1["start"]).rename(columns={"end": "1"}).drop("start", axis=1)
-        )
-        r2 = (
-            r2.set_index(r2["start"]).rename(columns={"end": "2"}).drop("start", axis=1)
-        )
-        r3 = (
-            r3.set_index(r3["start"]).rename(columns={"end": "3"}).drop("start", axis=1)
-        )
+        r1 = r1.set_index(r1["start"]).rename(columns={"end": 1}).drop("start", axis=1)
+        r2 = r2.set_index(r2["start"]).rename(columns={"end": 2}).drop("start", axis=1)
+        r3 = r3.set_index(r3["start"]).rename(columns={"end": 3}).drop("start", axis=1)
 
         data = pd.concat([r1, r2, r3], axis=1, sort=False)
         start = datetime.datetime(2020, 8, 22)
         end = datetime.datetime(2020, 8, 28)
         result = get_room_number_optimized(data, start, end)
-        answer = pd.DataFrame({"room": ["1", "3"], "order": [15, 78]})
+        answer = pd.DataFrame({"room": [1, 3], "order": [15, 78]})
 
         assert_frame_equal(result.reset_index(drop=True), answer.reset_index(drop=True))
 
@@ -202,15 +211,9 @@ class Test_get_room_number_optimized(unittest.TestCase):
             }
         )
 
-        r1 = (
-            r1.set_index(r1["start"]).rename(columns={"end": "1"}).drop("start", axis=1)
-        )
-        r2 = (
-            r2.set_index(r2["start"]).rename(columns={"end": "2"}).drop("start", axis=1)
-        )
-        r3 = (
-            r3.set_index(r3["start"]).rename(columns={"end": "3"}).drop("start", axis=1)
-        )
+        r1 = r1.set_index(r1["start"]).rename(columns={"end": 1}).drop("start", axis=1)
+        r2 = r2.set_index(r2["start"]).rename(columns={"end": 2}).drop("start", axis=1)
+        r3 = r3.set_index(r3["start"]).rename(columns={"end": 3}).drop("start", axis=1)
 
         data = pd.concat([r1, r2, r3], axis=1, sort=False)
         start = datetime.datetime(2020, 8, 10)
@@ -242,24 +245,1406 @@ class Test_get_room_number_optimized(unittest.TestCase):
             }
         )
 
-        r1 = (
-            r1.set_index(r1["start"]).rename(columns={"end": "1"}).drop("start", axis=1)
-        )
-        r2 = (
-            r2.set_index(r2["start"]).rename(columns={"end": "2"}).drop("start", axis=1)
-        )
-        r3 = (
-            r3.set_index(r3["start"]).rename(columns={"end": "3"}).drop("start", axis=1)
-        )
+        r1 = r1.set_index(r1["start"]).rename(columns={"end": 1}).drop("start", axis=1)
+        r2 = r2.set_index(r2["start"]).rename(columns={"end": 2}).drop("start", axis=1)
+        r3 = r3.set_index(r3["start"]).rename(columns={"end": 3}).drop("start", axis=1)
 
         data = pd.concat([r1, r2, r3], axis=1, sort=False)
         start = datetime.datetime(2020, 8, 22)
         end = datetime.datetime(2020, 8, 28)
         result = get_room_number_optimized(data, start, end)
-        answer = pd.DataFrame({"room": ["3"], "order": [3]})
+        answer = pd.DataFrame({"room": [3], "order": [3]})
 
         assert_frame_equal(result.reset_index(drop=True), answer.reset_index(drop=True))
 
+    def test_ties_by_room_number(self):
+        """
+        Ties are ordered by room number whatever the column order
+        """
+        data = pd.DataFrame(
+            {
+                10: [datetime.datetime(2022, 12, 31)],
+                9: [datetime.datetime(2022, 12, 31)],
+                2: [datetime.datetime(2020, 8, 30)],
+            },
+            index=pd.DatetimeIndex(["2020-08-20"]),
+        )
+        start = datetime.datetime(2020, 8, 22)
+        end = datetime.datetime(2020, 8, 28)
+        result = get_room_number_optimized(data, start, end)
+        answer = pd.DataFrame({"room": [2, 9, 10], "order": [2, 2, 2]})
+
+        assert_frame_equal(result.reset_index(drop=True), answer.reset_index(drop=True))
+
+
+class Test_availability_index(unittest.TestCase):
+    def setUp(self):
+        intervals = pd.DataFrame(
+            {
+                1: [
+                    datetime.datetime(2020, 9, 3),
+                    None,
+                    datetime.datetime(2262, 4, 11),
+                ],
+                2: [None, datetime.datetime(2262, 4, 11), None],
+            },
+            index=pd.DatetimeIndex(["2020-08-10", "2020-08-15", "2020-09-22"]),
+        )
+        self.intervals = {room: ends.dropna() for room, ends in intervals.items()}
+
+    def assert_index_matches(self, index, intervals):
+        rebuilt = AvailabilityIndex.from_intervals(intervals)
+        np.testing.assert_array_equal(index.keys, rebuilt.keys)
+        np.testing.assert_array_equal(index.ends, rebuilt.ends)
+
+    def test_query(self):
+        """
+        Only the interval of each room which contains (start, end) is returned
+        """
+        index = AvailabilityIndex.from_intervals(self.intervals)
+        result = index.query(
+            datetime.datetime(2020, 8, 22), datetime.datetime(2020, 8, 28)
+        )
+
+        self.assertEqual(list(result.index), [1, 2])
+        self.assertEqual(list(result["start"].dt.day), [10, 15])
+
+    def test_add_remove_intervals(self):
+        """
+        add_intervals and remove_intervals keep the index in sync with the intervals
+        """
+        index = AvailabilityIndex.from_intervals(self.intervals)
+        start = datetime.datetime(2020, 10, 1)
+        end = datetime.datetime(2020, 10, 5)
+
+        add_intervals(self.intervals, 1, start, end, None, index)
+        self.assert_index_matches(index, self.intervals)
+        self.assertEqual(list(index.query(start, end).index), [2])
+
+        remove_intervals(self.intervals, "2020-10-01", "2020-10-05", 1, index)
+        self.assert_index_matches(index, self.intervals)
+        self.assertEqual(list(index.query(start, end).index), [1, 2])
+
+    def test_free_nights(self):
+        """
+        Nights are counted for every room whose free interval covers them, ends included
+        """
+        index = AvailabilityIndex.from_intervals(self.intervals)
+        counts = index.free_nights(
+            datetime.datetime(2020, 9, 2), datetime.datetime(2020, 9, 23)
+        )
+
+        self.assertEqual(list(counts[:3]), [2, 2, 1])
+        self.assertEqual(list(counts[-3:]), [1, 2, 2])
+        self.assertEqual(counts.size, 22)
+
+
+class Test_prune_intervals(unittest.TestCase):
+    def setUp(self):
+        intervals = pd.DataFrame(
+            {
+                1: [
+                    datetime.datetime(2020, 7, 1),
+                    datetime.datetime(2020, 8, 1),
+                    None,
+                ],
+                2: [
+                    None,
+                    datetime.datetime(2020, 7, 20),
+                    datetime.datetime(2262, 4, 11),
+                ],
+            },
+            index=pd.DatetimeIndex(["2020-06-01", "2020-07-10", "2020-08-10"]),
+        )
+        self.intervals = {room: ends.dropna() for room, ends in intervals.items()}
+        self.today = datetime.date(2020, 7, 25)
+
+    def test_prune(self):
+        """
+        Only intervals which ended before today are removed
+        """
+        removed = prune_intervals(self.intervals, self.today)
+
+        self.assertEqual(removed.to_dict(), {1: 1, 2: 1})
+        self.assertEqual(list(self.intervals[1].index.day), [10])
+        self.assertEqual(list(self.intervals[2].index.day), [10])
+
+    def test_threshold(self):
+        """
+        Rooms at or under the threshold are left untouched
+        """
+        self.intervals[2].loc[pd.Timestamp("2020-06-01")] = datetime.datetime(
+            2020, 6, 5
+        )
+        removed = prune_intervals(self.intervals, self.today, [1, 2], threshold=1)
+
+        self.assertEqual(removed.to_dict(), {2: 2})
+        self.assertEqual(self.intervals[1].count(), 2)
+
+
+class Test_client_index(unittest.TestCase):
+    def test_new_client_supp(self):
+        """
+        New clients are added to the index with their client ID
+        """
+        client_supp = pd.DataFrame(
+            {"name": ["t.king", "s.beast"], "email": ["t@k.com", "s@b.com"]}
+        ).rename_axis("client_id")
+        client_index = build_client_index(client_supp)
+
+        self.assertEqual(unique_client(client_index, "s.beast", "s@b.com"), 1)
+        self.assertIsNone(unique_client(client_index, "s.beast", "t@k.com"))
+
+        new_supp = new_client_supp(2, "a.possum", "a@p.com", client_index)
+
+        self.assertEqual(unique_client(client_index, "a.possum", "a@p.com"), 2)
+        self.assertEqual(new_supp.loc[2, "name"], "a.possum")
+
+
+class Test_csv_client_journal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp_dir.name, "client_supp.csv"), "w") as out_file:
+            out_file.write("client_id,name,email\n0,t.king,t@k.com\n")
+        self.store = CsvStorage(self.tmp_dir.name, "")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_replay_and_compact(self):
+        """
+        Appended clients are read back from the journal until it is compacted
+        """
+        client_index = self.store.read_client_index()
+        for name in ["s.beast", "a.possum", "h.badger"]:
+            client_id = self.store.next_client_id()
+            self.store.append_client_supp(
+                new_client_supp(client_id, name, name + "@mail.com", client_index)
+            )
+
+        self.assertEqual(
+            list(self.store.read_client_supp()["name"]),
+            ["t.king", "s.beast", "a.possum", "h.badger"],
+        )
+        self.assertEqual(client_index[("h.badger", "h.badger@mail.com")], 3)
+
+        self.store.compact("client_supp.csv")
+        journal = os.path.join(self.tmp_dir.name, "client_supp.csv.journal")
+        self.assertFalse(os.path.isfile(journal))
+        self.assertEqual(list(self.store.read_client_supp().index), [0, 1, 2, 3])
+
+    def test_client_index_journal(self):
+        """
+        client_index.pkl is only rewritten when the journal is compacted
+        """
+        client_index = self.store.read_client_index()
+        pickled = os.path.join(self.tmp_dir.name, "client_index.pkl")
+        before = os.stat(pickled).st_mtime_ns
+
+        for name in ["s.beast", "a.possum"]:
+            client_id = self.store.next_client_id()
+            self.store.append_client_supp(
+                new_client_supp(client_id, name, name + "@mail.com", client_index)
+            )
+        self.assertEqual(os.stat(pickled).st_mtime_ns, before)
+
+        store = CsvStorage(self.tmp_dir.name, "")
+        self.assertEqual(store.next_client_id(), 3)
+        self.assertEqual(store.read_client_index(), client_index)
+
+        store.compact("client_supp.csv")
+        self.assertNotEqual(os.stat(pickled).st_mtime_ns, before)
+        store = CsvStorage(self.tmp_dir.name, "")
+        self.assertEqual(store.read_client_index(), client_index)
+        self.assertEqual(store.next_client_id(), 3)
+
+
+class Test_sqlite_storage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SqliteStorage(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.store.conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_client_list_round_trip(self):
+        """
+        Only the given client rows are written
+        """
+        client_list = pd.DataFrame(
+            {
+                "state": [2, 3],
+                "start": [datetime.date(2020, 8, 22), None],
+                "end": [datetime.date(2020, 8, 28), None],
+                "reserved_room": [5, -1],
+                "payment_due": [180.0, None],
+                "paid": [False, False],
+                "curr_room": [-1, -1],
+            }
+        ).rename_axis("client_id")
+
+        with self.store.transaction():
+            self.store.write_client_list(client_list, [0])
+
+        result = self.store.read_client_list()
+        self.assertEqual(list(result.index), [0])
+        self.assertEqual(result.loc[0, "start"], pd.Timestamp(2020, 8, 22))
+        self.assertEqual(result.loc[0, "reserved_room"], 5)
+        self.assertFalse(result.loc[0, "paid"])
+        self.assertEqual(result.dtypes.astype(str).to_dict(), CLIENT_LIST_DTYPES)
+
+    def test_intervals_round_trip(self):
+        """
+        Rewriting a room replaces its old intervals, other rooms are untouched
+        """
+        intervals = {
+            1: pd.Series(
+                [datetime.datetime(2020, 8, 21), datetime.datetime(2262, 4, 11)],
+                index=pd.DatetimeIndex(["2020-08-01", "2020-08-29"]),
+                name=1,
+            ),
+            2: pd.Series(
+                [datetime.datetime(2262, 4, 11)],
+                index=pd.DatetimeIndex(["2020-08-01"]),
+                name=2,
+            ),
+        }
+
+        with self.store.transaction():
+            self.store.write_intervals(intervals, 1)
+            self.store.write_intervals(intervals, 2)
+
+        intervals[1].loc[pd.Timestamp("2020-08-29")] = datetime.datetime(2020, 9, 1)
+        with self.store.transaction():
+            self.store.write_intervals(intervals, 1)
+
+        result = self.store.read_intervals([1, 2])
+        for room in [1, 2]:
+            assert_series_equal(result[room], intervals[room], check_freq=False)
+
+
+class Test_reserve_batch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w") as out_file:
+            out_file.write(text)
+        return path
+
+    def test_read_csv_and_jsonl(self):
+        """
+        Both formats give the same rows, invalid values are kept as missing
+        """
+        csv_path = self.write(
+            "batch.csv",
+            "client_id,room_type,start,end\n0,1,2030-08-22,2030-08-28\n1,2,bad,2030-08-28\n",
+        )
+        jsonl_path = self.write(
+            "batch.jsonl",
+            '{"client_id": 0, "room_type": 1, "start": "2030-08-22", "end": "2030-08-28"}\n'
+            '{"client_id": 1, "room_type": 2, "start": "bad", "end": "2030-08-28"}\n',
+        )
+
+        batch = read_batch(csv_path)
+        assert_frame_equal(read_batch(jsonl_path), batch)
+        self.assertEqual(list(batch["client_id"]), [0, 1])
+        self.assertTrue(pd.isna(batch.loc[1, "start"]))
+
+    def test_order(self):
+        """
+        Rows are allocated in file order, by start, or longest stay first
+        """
+        batch = pd.DataFrame(
+            {
+                "start": pd.to_datetime(["2030-08-10", "2030-08-01", "2030-08-05"]),
+                "end": pd.to_datetime(["2030-08-12", "2030-08-03", "2030-08-15"]),
+            }
+        )
+
+        self.assertEqual(list(order_batch(batch, "file")), [0, 1, 2])
+        self.assertEqual(list(order_batch(batch, "start")), [1, 2, 0])
+        self.assertEqual(list(order_batch(batch, "longest")), [2, 0, 1])
+
+
+class Test_room_catalog(unittest.TestCase):
+    def test_lookups(self):
+        """
+        Rooms keep the order of hotel.json, numbers are ints whatever they are given as
+        """
+        catalog = RoomCatalog(
+            [
+                {"number": 12, "type": 2, "cost": 30},
+                {"number": 3, "type": 1, "cost": 10},
+                {"number": 7, "type": 2, "cost": 35},
+            ]
+        )
+
+        self.assertEqual(catalog.types, [1, 2])
+        self.assertEqual(catalog.rooms(2), [12, 7])
+        self.assertEqual(catalog.rooms(5), [])
+        self.assertEqual(catalog.cost("7"), 35)
+        self.assertEqual(catalog.type_codes([7, 3, -1, 99]).tolist(), [1, 0, -1, -1])
+
+
+class Test_repack_rooms(unittest.TestCase):
+    def setUp(self):
+        """
+        Room 1 holds a reservation from the 10th to the 12th, room 2 one from the 25th to the 27th
+        """
+
+        def day(d):
+            return pd.Timestamp(2030, 1, d)
+
+        forever = pd.Timestamp(2262, 4, 11)
+        self.today = day(1)
+        self.intervals = {
+            1: pd.Series([day(9), forever], index=[day(1), day(13)], name=1),
+            2: pd.Series([day(24), forever], index=[day(1), day(28)], name=2),
+        }
+        self.bookings = pd.DataFrame(
+            {"start": [day(10), day(25)], "end": [day(12), day(27)], "room": [1, 2]},
+            index=pd.Index([0, 1], name="client_id"),
+        )
+
+    def test_new_booking(self):
+        """
+        A stay from the 5th to the 30th fits once both reservations share a room
+        """
+        new_row = pd.DataFrame(
+            {
+                "start": [pd.Timestamp(2030, 1, 5)],
+                "end": [pd.Timestamp(2030, 1, 30)],
+                "room": [-1],
+            },
+            index=pd.Index([2], name="client_id"),
+        )
+        assigned, new_intervals = repack_rooms(
+            self.intervals, [1, 2], pd.concat([self.bookings, new_row])
+        )
+
+        self.assertEqual(assigned.to_dict(), {0: 2, 1: 2, 2: 1})
+        self.assertEqual(list(new_intervals[1].index.day), [1, 31])
+        self.assertEqual(list(new_intervals[1].dt.day), [4, 11])
+        self.assertEqual(list(new_intervals[2].index.day), [1, 13, 28])
+        self.assertEqual(list(new_intervals[2].dt.day), [9, 24, 11])
+
+    def test_better_packed(self):
+        assigned, new_intervals = repack_rooms(self.intervals, [1, 2], self.bookings)
+
+        before = free_runs(self.intervals, [1, 2], self.today)
+        after = free_runs(new_intervals, [1, 2], self.today)
+        self.assertEqual(len(before), len(after))
+        self.assertTrue(better_packed(after, before))
+        self.assertFalse(better_packed(before, before))
+
+    def test_no_fit(self):
+        """
+        Reservations are never dropped to make room
+        """
+        new_row = pd.DataFrame(
+            {
+                "start": [pd.Timestamp(2030, 1, 5)],
+                "end": [pd.Timestamp(2030, 1, 26)],
+                "room": [-1],
+            },
+            index=pd.Index([2], name="client_id"),
+        )
+        bookings = pd.concat([self.bookings, new_row, new_row.rename(index={2: 3})])
+
+        self.assertIsNone(repack_rooms(self.intervals, [1, 2], bookings))
+
+
+def sample_client_list():
+    """
+    Clients 0 and 3 reserved, 1 checked in and 2 without a reservation, in August 2030
+    """
+    return typed_client_list(
+        pd.DataFrame(
+            {
+                "state": [2, 1, 3, 2],
+                "start": ["2030-08-01", "2030-08-02", np.nan, "2030-08-02"],
+                "end": ["2030-08-03", "2030-08-05", np.nan, "2030-08-03"],
+                "reserved_room": [1, 2, -1, 3],
+                "payment_due": [20.0, 30.0, np.nan, 30.0],
+                "paid": [False, False, True, False],
+                "curr_room": [-1, 2, -1, -1],
+            },
+            index=pd.Index([0, 1, 2, 3], name="client_id"),
+        )
+    )
+
+
+class Test_report(unittest.TestCase):
+    def setUp(self):
+        self.catalog = RoomCatalog(
+            [
+                {"number": 1, "type": 1, "cost": 10},
+                {"number": 2, "type": 1, "cost": 10},
+                {"number": 3, "type": 2, "cost": 30},
+            ]
+        )
+        self.client_list = sample_client_list()
+
+    def test_nightly_sales(self):
+        """
+        A stay sells the nights from its start up to the night before its end
+        """
+        sold, revenue = nightly_sales(
+            self.client_list,
+            self.catalog,
+            datetime.datetime(2030, 7, 31),
+            datetime.datetime(2030, 8, 4),
+        )
+
+        self.assertEqual(list(sold.columns), [1, 2])
+        self.assertEqual(sold[1].tolist(), [0, 1, 2, 1, 1])
+        self.assertEqual(sold[2].tolist(), [0, 0, 1, 0, 0])
+        self.assertEqual(revenue[1].tolist(), [0.0, 10.0, 20.0, 10.0, 10.0])
+
+    def test_end_date_held_not_sold(self):
+        """
+        On the end date of a reservation its room is neither sold (report) nor free (availability)
+        """
+        start, end = datetime.datetime(2027, 1, 10), datetime.datetime(2027, 1, 15)
+        open_end = pd.Timestamp(pd.Timestamp.max.date())
+        intervals = {
+            room: pd.Series(
+                [open_end], index=pd.DatetimeIndex(["2027-01-01"]), name=room
+            )
+            for room in [1, 2]
+        }
+        add_intervals(intervals, 1, start, end, "")
+        index = AvailabilityIndex.from_intervals(intervals)
+
+        client_list = self.client_list.iloc[[0]].copy()
+        client_list.loc[0, ["start", "end"]] = [start, end]
+
+        nights = (datetime.datetime(2027, 1, 14), datetime.datetime(2027, 1, 16))
+        sold, revenue = nightly_sales(client_list, self.catalog, *nights)
+        self.assertEqual(sold[1].tolist(), [1, 0, 0])
+        self.assertEqual(index.free_nights(*nights).tolist(), [1, 1, 2])
+
+    def test_metrics(self):
+        sold, revenue = nightly_sales(
+            self.client_list,
+            self.catalog,
+            datetime.datetime(2030, 8, 1),
+            datetime.datetime(2030, 8, 2),
+        )
+
+        occupancy = sales_metric(sold, revenue, self.catalog, "occupancy")
+        self.assertEqual(occupancy[1].tolist(), [0.5, 1.0])
+        adr = sales_metric(sold, revenue, self.catalog, "adr")
+        self.assertTrue(np.isnan(adr.loc["2030-08-01", 2]))
+        self.assertEqual(adr.loc["2030-08-02", 2], 30.0)
+        revpar = sales_metric(sold, revenue, self.catalog, "revpar")
+        self.assertEqual(revpar[1].tolist(), [5.0, 10.0])
+        self.assertIs(sales_metric(sold, revenue, self.catalog, "revenue"), revenue)
+        with self.assertRaises(ValueError):
+            sales_metric(sold, revenue, self.catalog, "profit")
+
+
+class Test_client_lookup(unittest.TestCase):
+    def setUp(self):
+        self.client_list = sample_client_list()
+
+    def test_from_client_list(self):
+        lookup = ClientLookup.from_client_list(self.client_list)
+
+        self.assertEqual(lookup.with_state(2), [0, 3])
+        self.assertEqual(lookup.with_state(5), [])
+        self.assertEqual(lookup.arrivals(datetime.datetime(2030, 8, 2)), [1, 3])
+        self.assertEqual(lookup.departures(datetime.datetime(2030, 8, 3)), [0, 3])
+        self.assertEqual(lookup.departures(datetime.datetime(2030, 8, 4)), [])
+
+    def test_maintained_by_helpers(self):
+        """
+        The helpers keep the lookup equal to one built again from the updated client_list
+        """
+        lookup = ClientLookup.from_client_list(self.client_list)
+
+        add_reservation_client_list(
+            self.client_list,
+            2,
+            2,
+            datetime.datetime(2030, 8, 2),
+            datetime.datetime(2030, 8, 4),
+            1,
+            20.0,
+            False,
+            lookup=lookup,
+        )
+        checkin_client_list(self.client_list, 0, lookup=lookup)
+        checkout_client_list(self.client_list, 1, True, lookup=lookup)
+        remove_reservation_client_list(self.client_list, 3, lookup=lookup)
+
+        rebuilt = ClientLookup.from_client_list(self.client_list)
+        for state in [1, 2, 3]:
+            self.assertEqual(lookup.with_state(state), rebuilt.with_state(state))
+        np.testing.assert_array_equal(lookup.start_keys, rebuilt.start_keys)
+        np.testing.assert_array_equal(lookup.end_keys, rebuilt.end_keys)
+        self.assertEqual(lookup.arrivals(datetime.datetime(2030, 8, 2)), [2])
+        self.assertEqual(lookup.departures(datetime.datetime(2030, 8, 3)), [0])
+
+    def test_saved(self):
+        """
+        The lookup saved next to client_list is loaded with the operation log replayed on it
+        """
+        import bench
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            today = datetime.date(2030, 1, 1)
+            bench.generate_hotel(tmp_dir, 4, 2, 1, today=today)
+            store = CsvStorage(tmp_dir, "")
+            self.assertIsNone(store.read_client_lookup())
+
+            runner = CliRunner()
+            result = runner.invoke(
+                hotel.cli, ["--hotel", tmp_dir, "arrivals", "2030-01-01"]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIsNotNone(store.read_client_lookup())
+
+            client_list = store.read_client_list()
+            client_id = int(client_list.index[client_list["state"] == 3][0])
+            args = [str(client_id), "1", "2040-01-01", "2040-01-05"]
+            runner.invoke(hotel.cli, ["--hotel", tmp_dir, "reserve-dates"] + args)
+
+            def assert_current(lookup):
+                rebuilt = ClientLookup.from_client_list(
+                    hotel.Config(tmp_dir).client_list
+                )
+                for state in [1, 2, 3]:
+                    self.assertEqual(
+                        lookup.with_state(state), rebuilt.with_state(state)
+                    )
+                np.testing.assert_array_equal(lookup.start_keys, rebuilt.start_keys)
+                np.testing.assert_array_equal(lookup.end_keys, rebuilt.end_keys)
+
+            config = hotel.Config(tmp_dir)
+            self.assertIn(client_id, config.clients_with_state(2))
+            self.assertEqual(
+                config.clients_on("start", datetime.datetime(2040, 1, 1)), [client_id]
+            )
+            assert_current(config.lookup)
+
+            hotel.Config(tmp_dir).flush(checkpoint=True)
+            assert_current(store.read_client_lookup())
+
+
+class Test_echo_clients(unittest.TestCase):
+    def setUp(self):
+        self.client_list = pd.DataFrame(
+            {
+                "state": [2, 3, 3, 2, 3],
+                "start": ["2030-08-01", np.nan, np.nan, "2030-08-02", np.nan],
+                "paid": [False, True, False, False, True],
+            },
+            index=pd.Index([0, 1, 2, 3, 4], name="client_id"),
+        )
+
+        @click.command()
+        @click.option("--ids")
+        @hotel.client_output_options
+        def echo(ids, limit, offset, columns, output_format):
+            client_ids = None if ids is None else [int(i) for i in ids.split(",")]
+            hotel.echo_clients(
+                self.client_list, client_ids, columns, output_format, limit, offset
+            )
+
+        self.echo = echo
+        self.chunk_rows = hotel.CLIENT_CHUNK_ROWS
+        hotel.CLIENT_CHUNK_ROWS = 2
+
+    def tearDown(self):
+        hotel.CLIENT_CHUNK_ROWS = self.chunk_rows
+
+    def run_echo(self, *args):
+        result = CliRunner().invoke(self.echo, list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_csv_chunks(self):
+        """
+        Chunks follow each other as a single csv, whatever the chunk size
+        """
+        output = self.run_echo("--format", "csv")
+        self.assertEqual(output, self.client_list.to_csv())
+
+        output = self.run_echo("--format", "csv", "--offset", "1", "--limit", "3")
+        self.assertEqual(output, self.client_list.iloc[1:4].to_csv())
+
+    def test_jsonl_columns(self):
+        output = self.run_echo(
+            "--format", "jsonl", "--ids", "3,0,4", "--limit", "2", "--columns", "paid"
+        )
+        lines = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(
+            lines, [{"client_id": 3, "paid": False}, {"client_id": 0, "paid": False}]
+        )
+
+    def test_table_and_empty(self):
+        output = self.run_echo("--limit", "2")
+        self.assertEqual(output, self.client_list.iloc[:2].to_string() + "\n")
+
+        output = self.run_echo("--format", "csv", "--offset", "9")
+        self.assertEqual(output, "client_id,state,start,paid\n")
+        self.assertEqual(self.run_echo("--format", "jsonl", "--limit", "0"), "")
+
+        result = CliRunner().invoke(self.echo, ["--columns", "state,name"])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("unknown columns name", result.output)
+
+
+class Test_archive(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stays(self, client_ids, starts, ends):
+        return pd.DataFrame(
+            {
+                "client_id": client_ids,
+                "room": 1,
+                "start": pd.to_datetime(starts),
+                "end": pd.to_datetime(ends),
+                "payment_due": 10.0,
+                "paid": True,
+                "checked_out": pd.to_datetime(ends),
+            }
+        )
+
+    def test_partitions(self):
+        """
+        Stays are appended to the month they end in, queries only open overlapping months
+        """
+        archive.append(
+            self.tmp_dir.name,
+            self.stays(
+                [0, 1], ["2030-07-28", "2030-08-10"], ["2030-08-02", "2030-08-12"]
+            ),
+        )
+        archive.append(
+            self.tmp_dir.name, self.stays([2], ["2030-09-29"], ["2030-10-01"])
+        )
+        archive.append(
+            self.tmp_dir.name, self.stays([3], ["2030-08-20"], ["2030-08-21"])
+        )
+
+        self.assertEqual(
+            archive.partitions(self.tmp_dir.name, "2030-07-30", "2030-07-31"),
+            ["stays-2030-08.csv.gz"],
+        )
+        self.assertEqual(
+            archive.partitions(self.tmp_dir.name, "2030-09-30", None),
+            ["stays-2030-10.csv.gz"],
+        )
+
+        stays = archive.read(self.tmp_dir.name, "2030-08-12", "2030-09-30")
+        self.assertEqual(stays["client_id"].tolist(), [1, 3, 2])
+        self.assertEqual(stays.dtypes.astype(str).to_dict(), archive.STAY_DTYPES)
+        self.assertEqual(archive.read(self.tmp_dir.name)["client_id"].size, 4)
+
+    def test_stale_manifest(self):
+        """
+        A partition appended to behind the back of the manifest is read again
+        """
+        archive.append(
+            self.tmp_dir.name, self.stays([0], ["2030-08-01"], ["2030-08-02"])
+        )
+        manifest = archive.read_manifest(self.tmp_dir.name)
+        archive.append(
+            self.tmp_dir.name, self.stays([1], ["2030-07-01"], ["2030-08-03"])
+        )
+        archive.write_manifest(self.tmp_dir.name, manifest)
+
+        stays = archive.read(self.tmp_dir.name, "2030-07-02", "2030-07-03")
+        self.assertEqual(stays["client_id"].tolist(), [1])
+
+    def test_checkout_and_report(self):
+        """
+        Check-out archives the stay, which reports still count
+        """
+        client_list = typed_client_list(
+            pd.DataFrame(
+                {
+                    "state": [1],
+                    "start": ["2030-08-01"],
+                    "end": ["2030-08-03"],
+                    "reserved_room": [1],
+                    "payment_due": [20.0],
+                    "paid": [False],
+                    "curr_room": [1],
+                },
+                index=pd.Index([0], name="client_id"),
+            )
+        )
+        catalog = RoomCatalog([{"number": 1, "type": 1, "cost": 10}])
+        start, end = datetime.datetime(2030, 8, 1), datetime.datetime(2030, 8, 3)
+        before = nightly_sales(client_list, catalog, start, end)
+
+        stays = []
+        checkout_client_list(client_list, 0, True, stays=stays)
+        archive.append(self.tmp_dir.name, pd.concat(stays))
+        past_stays = archive.read(self.tmp_dir.name, start, end)
+
+        self.assertTrue(pd.isna(client_list.loc[0, "start"]))
+        self.assertEqual(past_stays.loc[0, "room"], 1)
+        self.assertTrue(past_stays.loc[0, "paid"])
+        after = nightly_sales(client_list, catalog, start, end, past_stays)
+        assert_frame_equal(after[0], before[0])
+        assert_frame_equal(after[1], before[1])
+
+
+class Test_oplog(unittest.TestCase):
+    def setUp(self):
+        import bench
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.hotel_dir = os.path.join(self.tmp_dir.name, "hotel_bench")
+        bench.generate_hotel(self.hotel_dir, 4, 2, 1, today=datetime.date(2030, 1, 1))
+
+        self.store = CsvStorage(self.hotel_dir, "")
+        client_list = self.store.read_client_list()
+        self.client_id = int(client_list.index[client_list["state"] == 3][0])
+        self.intervals = self.store.read_intervals([1, 3])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_hotel(self, *args):
+        result = CliRunner().invoke(hotel.cli, ["--hotel", self.hotel_dir] + list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def reserve(self):
+        self.run_hotel(
+            "reserve-dates", str(self.client_id), "1", "2040-01-01", "2040-01-05"
+        )
+
+    def state(self):
+        return hotel.Config(self.hotel_dir).client_list.loc[self.client_id, "state"]
+
+    def test_checkpoint(self):
+        """
+        Commands are only logged, and replayed on load until a checkpoint writes the tables
+        """
+        self.reserve()
+
+        self.assertEqual(self.store.read_client_list().loc[self.client_id, "state"], 3)
+        self.assertEqual(self.state(), 2)
+        self.assertEqual(len(oplog.OpLog.read(self.hotel_dir).tail), 1)
+
+        self.run_hotel("checkpoint")
+        self.assertEqual(self.store.read_client_list().loc[self.client_id, "state"], 2)
+        self.assertEqual(self.state(), 2)
+        log = oplog.OpLog.read(self.hotel_dir)
+        self.assertEqual((log.tail, log.checkpoint), ([], 1))
+
+    def test_undo_redo(self):
+        self.reserve()
+        self.run_hotel("checkpoint")
+
+        self.assertIn("Undid hotel reserve-dates", self.run_hotel("undo"))
+        config = hotel.Config(self.hotel_dir)
+        self.assertEqual(config.client_list.loc[self.client_id, "state"], 3)
+        for room in [1, 3]:
+            assert_series_equal(
+                config.get_intervals([room])[room], self.intervals[room]
+            )
+
+        self.run_hotel("redo")
+        self.assertEqual(self.state(), 2)
+        self.assertEqual(self.run_hotel("redo"), "Nothing to redo.\n")
+
+        # Another command makes the commands undone unreachable
+        self.run_hotel("undo")
+        self.run_hotel(
+            "reserve-dates", str(self.client_id), "1", "2040-02-01", "2040-02-05"
+        )
+        self.assertEqual(self.run_hotel("redo"), "Nothing to redo.\n")
+
+    def test_read_only_due_checkpoint(self):
+        """
+        A read-only command leaves a due checkpoint to the next command which changes the hotel
+        """
+        self.reserve()
+        self.run_hotel("register", "s.beast", "s@b.com")
+
+        code = "import sys, oplog, hotel; oplog.CHECKPOINT_RECORDS = 2; hotel.cli(sys.argv[1:])"
+        result = subprocess.run(
+            [sys.executable, "-c", code, "--hotel", self.hotel_dir, "get-all-clients"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(len(oplog.OpLog.read(self.hotel_dir).tail), 2)
+        self.assertEqual(self.store.read_client_list().loc[self.client_id, "state"], 3)
+
+    def test_interrupted_checkpoint(self):
+        """
+        A checkpoint which fails half-way is replayed again, then taken by the next one
+        """
+        self.reserve()
+
+        write_intervals = CsvStorage.write_intervals
+        CsvStorage.write_intervals = lambda *args: 1 / 0
+        try:
+            with self.assertRaises(ZeroDivisionError):
+                hotel.Config(self.hotel_dir).flush(checkpoint=True)
+        finally:
+            CsvStorage.write_intervals = write_intervals
+
+        self.assertEqual(self.store.read_client_list().loc[self.client_id, "state"], 2)
+        self.assertEqual(len(oplog.OpLog.read(self.hotel_dir).tail), 1)
+
+        config = hotel.Config(self.hotel_dir)
+        room = config.client_list.loc[self.client_id, "reserved_room"]
+        self.assertIn(
+            pd.Timestamp("2039-12-31"), config.get_intervals([room])[room].values
+        )
+
+        hotel.Config(self.hotel_dir).flush(checkpoint=True)
+        self.assertIn(
+            pd.Timestamp("2039-12-31"), self.store.read_intervals([room])[room].values
+        )
+
+    def test_room_change(self):
+        """
+        Changes keep the entries which differ, and replace a room free from its first day
+        """
+        dates = pd.to_datetime(["2030-01-01", "2030-01-10", "2030-01-20"])
+        before = pd.Series(dates[[0, 1]], index=dates[[0, 1]], name=1)
+        after = pd.Series(dates[[0, 2]], index=dates[[0, 2]], name=1)
+
+        change = oplog.room_change(before, after)
+        self.assertEqual(change["before"], {"2030-01-10": "2030-01-10"})
+        self.assertEqual(change["after"], {"2030-01-20": "2030-01-20"})
+        assert_series_equal(oplog.apply_room(before, change), after)
+        assert_series_equal(oplog.apply_room(after, change, undo=True), before)
+        self.assertIsNone(oplog.room_change(before, before.copy()))
+
+        free = pd.Series([pd.Timestamp(oplog.OPEN_END)], index=dates[[0]], name=1)
+        change = oplog.room_change(free, after)
+        self.assertTrue(change["full"])
+        moved = pd.Series(free.values, index=dates[[1]], name=1)
+        assert_series_equal(oplog.apply_room(moved, change), after)
+
+
+class Test_flush(unittest.TestCase):
+    def setUp(self):
+        import bench
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.hotel_dir = os.path.join(self.tmp_dir.name, "hotel_bench")
+        bench.generate_hotel(self.hotel_dir, 4, 2, 1, today=datetime.date(2030, 1, 1))
+
+        client_list = CsvStorage(self.hotel_dir, "").read_client_list()
+        self.client_id = int(client_list.index[client_list["state"] == 3][0])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def files(self):
+        """
+        {path: mtime} of every file of the hotel, except the lock files of session.py
+        """
+        return {
+            os.path.join(root, file): os.stat(os.path.join(root, file)).st_mtime_ns
+            for root, dirs, files in os.walk(self.hotel_dir)
+            for file in files
+            if file not in (session.WRITE_LOCK, session.FLUSH_LOCK)
+        }
+
+    def reserve(self):
+        return CliRunner().invoke(
+            hotel.cli,
+            ["--hotel", self.hotel_dir, "reserve-dates", str(self.client_id)]
+            + ["1", "2040-01-01", "2040-01-05"],
+        )
+
+    def test_dirty_rooms(self):
+        """
+        Only the files of the room which was reserved are rewritten
+        """
+        self.assertEqual(self.reserve().exit_code, 0)
+        before = self.files()
+        hotel.Config(self.hotel_dir).flush(checkpoint=True)
+        after = self.files()
+
+        room = (
+            CsvStorage(self.hotel_dir, "")
+            .read_client_list()
+            .loc[self.client_id, "reserved_room"]
+        )
+        changed = {
+            os.path.relpath(path, self.hotel_dir)
+            for path in before
+            if after[path] != before[path] and "rooms" in path
+        }
+        self.assertEqual(
+            changed,
+            {f"rooms/reservations/{room}.csv", f"rooms/intervals/{room}.csv"},
+        )
+
+    def test_failed_command(self):
+        """
+        A command which raises after changing the tables in memory writes nothing
+        """
+        before = self.files()
+
+        get_payment = helpers.get_payment
+        helpers.get_payment = lambda *args: 1 / 0
+        try:
+            result = self.reserve()
+        finally:
+            helpers.get_payment = get_payment
+
+        self.assertIsInstance(result.exception, ZeroDivisionError)
+        self.assertEqual(self.files(), before)
+        self.assertEqual(
+            hotel.Config(self.hotel_dir).client_list.loc[self.client_id, "state"], 3
+        )
+
+    def test_server_failed_command(self):
+        """
+        A command which fails under hotel serve is not logged by the next one
+        """
+        client_list = CsvStorage(self.hotel_dir, "").read_client_list()
+        other_id = int(client_list.index[client_list["state"] == 3][1])
+
+        config = hotel.Config(self.hotel_dir)
+        config.write_behind = True
+        config.load()
+        hotel_server = server.HotelServer(hotel.cli, config, 0)
+        try:
+            get_payment = helpers.get_payment
+            helpers.get_payment = lambda *args: 1 / 0
+            try:
+                output, exit_code = hotel_server.run(
+                    ["reserve-dates", str(self.client_id), "1"]
+                    + ["2040-01-01", "2040-01-05"]
+                )
+            finally:
+                helpers.get_payment = get_payment
+            self.assertEqual(exit_code, 1)
+            self.assertIn("ZeroDivisionError", output)
+
+            output, exit_code = hotel_server.run(
+                ["reserve-dates", str(other_id), "1", "2040-02-01", "2040-02-05"]
+            )
+            self.assertEqual(exit_code, 0, output)
+        finally:
+            hotel_server.server_close()
+
+        (record,) = oplog.OpLog.read(self.hotel_dir).records
+        self.assertEqual([c[0] for c in record["clients"]], [other_id])
+        self.assertEqual(
+            record["command"],
+            ["reserve-dates", str(other_id), "1", "2040-02-01", "2040-02-05"],
+        )
+
+        config = hotel.Config(self.hotel_dir)
+        self.assertEqual(config.client_list.loc[self.client_id, "state"], 3)
+        self.assertEqual(config.client_list.loc[other_id, "state"], 2)
+        for room, series in config.get_intervals().items():
+            self.assertNotIn(pd.Timestamp("2039-12-31"), series.values)
+
+    def test_interrupted_write(self):
+        """
+        atomic_open() leaves the file as it was if the write fails half-way
+        """
+        fp = os.path.join(self.tmp_dir.name, "table.csv")
+        with open(fp, "w") as out_file:
+            out_file.write("old")
+
+        with self.assertRaises(ZeroDivisionError):
+            with helpers.atomic_open(fp) as out_file:
+                out_file.write("new")
+                1 / 0
+
+        with open(fp) as in_file:
+            self.assertEqual(in_file.read(), "old")
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir.name)), ["hotel_bench", "table.csv"]
+        )
+
+    def test_remove_reservations(self):
+        """
+        The reservation starting on res_start is dropped, given as a string or a date
+        """
+        dates = pd.to_datetime(["2030-01-01", "2030-01-10"])
+        reservations = {2: pd.Series([4, 5], index=dates, name=2)}
+        dirty = set()
+
+        helpers.remove_reservations(reservations, "2030-01-10", 2, dirty)
+        self.assertEqual(list(reservations[2].index), [dates[0]])
+        helpers.remove_reservations(reservations, dates[0].date(), "2", dirty)
+        self.assertTrue(reservations[2].empty)
+        self.assertEqual(dirty, {2})
+
+
+class Test_server(unittest.TestCase):
+    class Config(object):
+        def __init__(self, full_path):
+            self.full_path = full_path
+            self.flushes = 0
+            self.checkpoints = 0
+            self.discards = 0
+
+        def flush(self, checkpoint=False):
+            self.flushes += 1
+            self.checkpoints += checkpoint
+
+        def discard(self):
+            self.discards += 1
+
+        def load(self):
+            pass
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = self.Config(self.tmp_dir.name)
+
+        @click.group()
+        def cli():
+            pass
+
+        @cli.command()
+        @click.argument("name")
+        @click.pass_obj
+        def hello(config, name):
+            click.echo(f"Hello {name} from {config.full_path}")
+
+        @cli.command()
+        def fail():
+            raise RuntimeError("out of towels")
+
+        self.server = server.HotelServer(cli, self.config, 0.05)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        server.stop(self.tmp_dir.name)
+        self.thread.join()
+        self.tmp_dir.cleanup()
+
+    def test_forward(self):
+        """
+        Commands run against the Config of the server, errors are returned as exit codes
+        """
+        output, exit_code = server.forward(self.tmp_dir.name, ["hello", "jeeves"])
+        self.assertEqual(output, f"Hello jeeves from {self.tmp_dir.name}\n")
+        self.assertEqual(exit_code, 0)
+
+        output, exit_code = server.forward(self.tmp_dir.name, ["goodbye"])
+        self.assertIn("No such command", output)
+        self.assertEqual(exit_code, 2)
+
+    def test_failed_command(self):
+        """
+        A command which fails drops the changes of the Config, a usage error does not
+        """
+        output, exit_code = server.forward(self.tmp_dir.name, ["fail"])
+        self.assertIn("RuntimeError: out of towels", output)
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(self.config.discards, 1)
+
+        server.forward(self.tmp_dir.name, ["goodbye"])
+        self.assertEqual(self.config.discards, 1)
+
+    def test_forward_pieces(self):
+        """
+        Long output is sent back in pieces as it is written, in order
+        """
+        reply_chunk = server.REPLY_CHUNK
+        server.REPLY_CHUNK = 20
+        try:
+            pieces = []
+            output, exit_code = server.forward(
+                self.tmp_dir.name, ["hello", "x" * 50], pieces.append
+            )
+        finally:
+            server.REPLY_CHUNK = reply_chunk
+
+        self.assertGreater(len(pieces), 0)
+        self.assertEqual(
+            "".join(pieces) + output, f"Hello {'x' * 50} from {self.tmp_dir.name}\n"
+        )
+        self.assertEqual(exit_code, 0)
+
+    def test_stop(self):
+        """
+        Stopping takes a checkpoint of the pending changes and removes the socket
+        """
+        self.assertTrue(server.is_running(self.tmp_dir.name))
+        self.assertTrue(server.stop(self.tmp_dir.name))
+        self.thread.join()
+
+        self.assertGreater(self.config.flushes, 0)
+        self.assertEqual(self.config.checkpoints, 1)
+        self.assertFalse(server.is_running(self.tmp_dir.name))
+        self.assertIsNone(server.forward(self.tmp_dir.name, ["hello", "jeeves"]))
+
+
+class Test_startup(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        """
+        Importing the cli (--help, begin, quit, forwarding to hotel serve) does not import pandas
+        """
+        code = "import sys, hotel; print(sorted({'pandas', 'numpy', 'jsonschema'} & set(sys.modules)))"
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_quit(self):
+        """
+        hotel quit does not import pandas once the snapshot is fresh and the operation log checkpointed
+        """
+        import bench
+        import glob
+        import shutil
+
+        code = (
+            "import sys, hotel\n"
+            "sys.argv = ['hotel', 'quit']\n"
+            "try:\n"
+            "    hotel.cli()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print(sorted({'pandas', 'numpy', 'jsonschema'} & set(sys.modules)))"
+        )
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for fp in glob.glob(os.path.join(repo_dir, "*.py")):
+                shutil.copy(fp, tmp_dir)
+            hotel_dir = os.path.join(tmp_dir, "data", "hotel_T")
+            bench.generate_hotel(hotel_dir, 4, 2, 1, today=datetime.date(2030, 1, 1))
+            CsvStorage(hotel_dir, "").write_snapshot()
+
+            # Without an operation log, then with one whose records are all checkpointed
+            for log in [
+                None,
+                '{"seq":1,"command":["check-in","0"]}\n{"checkpoint": 1}\n',
+            ]:
+                if log is not None:
+                    with open(
+                        os.path.join(hotel_dir, hotel.OPLOG_FILE), "w"
+                    ) as out_file:
+                        out_file.write(log)
+                # quit moves session.csv into the hotel directory
+                if os.path.isfile(os.path.join(hotel_dir, "session.csv")):
+                    os.remove(os.path.join(hotel_dir, "session.csv"))
+                session_fp = os.path.join(tmp_dir, "session.csv")
+                with open(session_fp, "w") as out_file:
+                    out_file.write("data/hotel_T\n")
+
+                result = subprocess.run(
+                    [sys.executable, "-c", code],
+                    cwd=tmp_dir,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                self.assertIn("is now closed", result.stdout)
+                self.assertEqual(result.stdout.splitlines()[-1], "[]")
+
+    def test_oplog_file(self):
+        self.assertEqual(hotel.OPLOG_FILE, oplog.LOG_FILE)
+
+
+class Test_snapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for table in ["reservations", "intervals"]:
+            os.makedirs(os.path.join(self.tmp_dir.name, "rooms", table))
+        self.store = CsvStorage(self.tmp_dir.name, "")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_rooms(self):
+        """
+        Rooms are read back from their snapshot until the csv file is newer
+        """
+        intervals = {
+            1: pd.Series(
+                [datetime.datetime(2020, 8, 21), datetime.datetime(2262, 4, 11)],
+                index=pd.DatetimeIndex(["2020-08-01", "2020-08-29"]),
+                name=1,
+            )
+        }
+        self.store.write_intervals(intervals, 1)
+        self.assertTrue(snapshot.is_fresh(self.tmp_dir.name, "intervals/1"))
+
+        result = self.store.read_intervals([1])
+        assert_series_equal(result[1], intervals[1], check_freq=False)
+
+        fp = os.path.join(self.tmp_dir.name, "rooms", "intervals", "1.csv")
+        with open(fp, "w") as out_file:
+            out_file.write("start,end\n2020-08-01,2262-04-11\n")
+        os.utime(fp, ns=(0, os.stat(fp).st_mtime_ns + 10**9))
+
+        self.assertEqual(snapshot.stale(self.tmp_dir.name), ["intervals/1"])
+        self.assertEqual(self.store.read_intervals([1])[1].size, 1)
+
+    def test_client_list(self):
+        """
+        Missing dates survive the round trip as NaT, columns are typed
+        """
+        client_list = pd.DataFrame(
+            {
+                "state": [2, 3],
+                "start": ["2030-08-22", np.nan],
+                "end": ["2030-08-28", np.nan],
+                "reserved_room": [5, -1],
+                "payment_due": [180.0, np.nan],
+                "paid": [False, True],
+                "curr_room": [-1, -1],
+            },
+            index=pd.Index([0, 1], name="client_id"),
+        )
+        self.store.write_client_list(client_list, [0, 1])
+
+        assert_frame_equal(
+            self.store.read_client_list(), typed_client_list(client_list)
+        )
+        self.assertTrue(pd.isna(self.store.read_client_list().loc[1, "start"]))
+
+    def test_client_list_string_dates(self):
+        """
+        Snapshots saved while dates were strings are still read
+        """
+        array = np.array(
+            [(0, 2, "2030-08-22", "2030-08-28", 5, 180.0, False, -1)],
+            [
+                (name, "<U10" if name in ("start", "end") else dtype)
+                for name, dtype in snapshot.CLIENT_LIST_FIELDS
+            ],
+        )
+        client_list = snapshot.to_client_list(array)
+
+        self.assertEqual(client_list.dtypes.astype(str).to_dict(), CLIENT_LIST_DTYPES)
+        self.assertEqual(client_list.loc[0, "end"], pd.Timestamp(2030, 8, 28))
+
+
+class Test_lock_hotel(unittest.TestCase):
+    def test_readers_wait_for_flush(self):
+        """
+        A shared lock is only granted once the exclusive lock is released
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            acquired = threading.Event()
+
+            def read():
+                with session.lock_hotel(tmp_dir, session.FLUSH_LOCK, False):
+                    acquired.set()
+
+            with session.lock_hotel(tmp_dir, session.FLUSH_LOCK):
+                reader = threading.Thread(target=read)
+                reader.start()
+                self.assertFalse(acquired.wait(0.2))
+
+            reader.join()
+            self.assertTrue(acquired.is_set())
+
 
 if __name__ == "__main__":
     unittest.main()
+
+
+class Test_generate_hotel(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.hotel_dir = os.path.join(self.tmp_dir.name, "hotel_bench")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_consistent(self):
+        """
+        Reserved clients are in the reservations of their room, between two free intervals
+        """
+        import bench
+
+        today = datetime.date(2030, 1, 1)
+        num_clients = bench.generate_hotel(self.hotel_dir, 4, 2, 1, today=today)
+        store = CsvStorage(self.hotel_dir, "")
+        client_list = store.read_client_list()
+        reservations = store.read_reservations([1, 2, 3, 4])
+        intervals = store.read_intervals([1, 2, 3, 4])
+
+        self.assertEqual(client_list.index.size, num_clients)
+        reserved = client_list[client_list["state"] == 2]
+        self.assertEqual(
+            sum(r.size for r in reservations.values()), reserved.index.size
+        )
+
+        for client_id, row in reserved.iterrows():
+            start = pd.Timestamp(row["start"])
+            room_intervals = intervals[row["reserved_room"]]
+            self.assertEqual(reservations[row["reserved_room"]][start], client_id)
+            self.assertIn(start - pd.Timedelta(days=1), room_intervals.values)
+            self.assertIn(
+                pd.Timestamp(row["end"]) + pd.Timedelta(days=1), room_intervals.index
+            )
+
+    def test_run_command(self):
+        """
+        A command which does not print the message of its success fails the benchmark
+        """
+        import bench
+
+        num_clients = bench.generate_hotel(self.hotel_dir, 4, 2, 1)
+        args = ["reserve-dates", str(num_clients), "1", "2040-01-01", "2040-01-05"]
+        with self.assertRaises(click.ClickException) as raised:
+            bench.run_command(self.hotel_dir, args, "Reservation successful!")
+        self.assertIn("does not exist", raised.exception.message)
+
+        timing = bench.run_command(self.hotel_dir, ["get-all-clients"])
+        self.assertGreater(timing, 0)
+
+
+class Test_profiling(unittest.TestCase):
+    def test_log_line(self):
+        """
+        Phases entered several times add up, and the line is written even if the command fails
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = os.path.join(tmp_dir, "profile.log")
+
+            with profiling.profile(log_file) as profile:
+                profile.command = "check-in"
+                for room in range(3):
+                    with profiling.phase("load reservations"):
+                        pass
+            with self.assertRaises(ValueError):
+                with profiling.profile(log_file):
+                    raise ValueError()
+
+            with open(log_file) as in_file:
+                lines = [json.loads(line) for line in in_file]
+
+        self.assertFalse(profiling.active())
+        self.assertEqual([line["status"] for line in lines], ["ok", "error"])
+        self.assertEqual(lines[0]["command"], "check-in")
+        self.assertEqual(list(lines[0]["phases"]), ["load reservations"])
+        self.assertGreaterEqual(
+            lines[0]["total"], lines[0]["phases"]["load reservations"]
+        )